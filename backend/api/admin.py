@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Patient, Visit, Attachment
+from .models import Patient, Visit, Attachment, PatientSummary, GrowthFlag
 
 @admin.register(Patient)
 class PatientAdmin(admin.ModelAdmin):
@@ -54,3 +54,15 @@ class ScanResultAdmin(admin.ModelAdmin):
 
     def short_impression(self, obj):
         return obj.impression[:50] if obj.impression else ''
+
+@admin.register(PatientSummary)
+class PatientSummaryAdmin(admin.ModelAdmin):
+    list_display = ('patient', 'last_visit_date', 'overdue_vaccine_count', 'next_vaccine_due_date', 'refreshed_on')
+    search_fields = ('patient__name',)
+    readonly_fields = ('updated_at',)
+
+@admin.register(GrowthFlag)
+class GrowthFlagAdmin(admin.ModelAdmin):
+    list_display = ('patient', 'kind', 'z_score', 'reference_z', 'detected_on')
+    list_filter = ('kind', 'detected_on')
+    search_fields = ('patient__name',)
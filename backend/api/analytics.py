@@ -0,0 +1,182 @@
+from collections import defaultdict
+from datetime import timedelta
+from itertools import accumulate
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .constants import VACCINE_SCHEDULE_DATA
+from .models import DailyStat, PendingRollup, Patient, Visit, Vaccination
+from .stats import DAILY_VISITS, DAILY_VISITS_BY_TYPE
+
+# Clinic analytics answered from DailyStat buckets.
+#
+# The buckets below are maintained by the rollup_analytics command rather
+# than by signals: signals only record which days changed (PendingRollup),
+# and the command recomputes those days in bulk.
+
+DAILY_DIAGNOSES = 'diagnoses'
+DAILY_VACCINES_GIVEN = 'vaccines_given'
+DAILY_BIRTHS = 'births'
+
+ROLLUP_METRICS = [DAILY_DIAGNOSES, DAILY_VACCINES_GIVEN, DAILY_BIRTHS]
+
+SICK_TAG = 'Sick'
+
+# visit_type of the registration visit created along with a patient. It is
+# not a clinic visit, so every metric here leaves it out.
+REGISTRATION_VISIT_TYPE = 'Initial'
+
+
+def normalize_diagnosis(diagnosis):
+    return ' '.join((diagnosis or '').split()).lower()[:200]
+
+
+def mark_days_dirty(*days):
+    days = {day for day in days if day}
+    if days:
+        PendingRollup.objects.bulk_create(
+            [PendingRollup(day=day) for day in days],
+            update_conflicts=True,
+            unique_fields=['day'],
+            update_fields=['marked_at'],
+        )
+
+
+def compute_rollup_buckets(days=None):
+    """
+    Computes the ROLLUP_METRICS buckets for the given days (all days when
+    None). Returns a list of unsaved DailyStat rows.
+    """
+    visits = Visit.objects.exclude(visit_type=REGISTRATION_VISIT_TYPE).exclude(diagnosis__isnull=True).exclude(diagnosis='')
+    given = Vaccination.objects.filter(status='Given', given_at__isnull=False)
+    patients = Patient.objects.all()
+    if days is not None:
+        visits = visits.filter(date__in=days)
+        given = given.filter(given_at__in=days)
+        patients = patients.filter(dob__in=days)
+
+    buckets = defaultdict(float)
+    for row in visits.values('date', 'diagnosis').annotate(n=Count('id')).order_by():
+        key = normalize_diagnosis(row['diagnosis'])
+        if key:
+            buckets[(row['date'], DAILY_DIAGNOSES, key)] += row['n']
+    for row in given.values('given_at', 'vaccine_name').annotate(n=Count('id')).order_by():
+        buckets[(row['given_at'], DAILY_VACCINES_GIVEN, row['vaccine_name'])] += row['n']
+    for row in patients.values('dob', 'gender').annotate(n=Count('id')).order_by():
+        buckets[(row['dob'], DAILY_BIRTHS, row['gender'])] += row['n']
+
+    return [DailyStat(day=day, metric=metric, key=key, value=value) for (day, metric, key), value in buckets.items()]
+
+
+def rollup_pending_days(chunk_size=500):
+    """
+    Recomputes the buckets of every day marked in PendingRollup, a chunk of
+    days per transaction. Returns (days, rows) processed.
+    """
+    total_days = total_rows = 0
+    while True:
+        started = timezone.now()
+        days = list(PendingRollup.objects.order_by('day').values_list('day', flat=True)[:chunk_size])
+        if not days:
+            break
+        rows = compute_rollup_buckets(days)
+        with transaction.atomic():
+            DailyStat.objects.filter(metric__in=ROLLUP_METRICS, day__in=days).delete()
+            DailyStat.objects.bulk_create(rows, batch_size=1000)
+            # Days re-marked while we were computing stay for the next pass.
+            PendingRollup.objects.filter(day__in=days, marked_at__lte=started).delete()
+        total_days += len(days)
+        total_rows += len(rows)
+    return total_days, total_rows
+
+
+def rollup_all():
+    rows = compute_rollup_buckets()
+    with transaction.atomic():
+        PendingRollup.objects.all().delete()
+        DailyStat.objects.filter(metric__in=ROLLUP_METRICS).delete()
+        DailyStat.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def _sum_by_key(metric, start, end):
+    rows = DailyStat.objects.filter(metric=metric, day__range=(start, end)).values('key').annotate(total=Sum('value'))
+    return {row['key']: row['total'] for row in rows}
+
+
+def visit_volume_by_week(start, end):
+    """Visits per ISO week (keyed by the week's Monday) within the range."""
+    weeks = defaultdict(float)
+    # The visits bucket counts registration visits too; their by-type
+    # bucket is subtracted back out.
+    rows = DailyStat.objects.filter(
+        Q(metric=DAILY_VISITS, key='') | Q(metric=DAILY_VISITS_BY_TYPE, key=REGISTRATION_VISIT_TYPE),
+        day__range=(start, end)
+    ).values_list('day', 'metric', 'value')
+    for day, metric, value in rows:
+        weeks[day - timedelta(days=day.weekday())] += value if metric == DAILY_VISITS else -value
+    monday = start - timedelta(days=start.weekday())
+    result = []
+    while monday <= end:
+        result.append({'week_start': monday, 'visits': int(weeks.get(monday, 0))})
+        monday += timedelta(days=7)
+    return result
+
+
+def top_diagnoses(start, end, limit=10):
+    rows = (
+        DailyStat.objects.filter(metric=DAILY_DIAGNOSES, day__range=(start, end))
+        .values('key').annotate(total=Sum('value')).order_by('-total', 'key')[:limit]
+    )
+    return [{'diagnosis': row['key'], 'visits': int(row['total'])} for row in rows]
+
+
+def vaccination_coverage(start, end):
+    """
+    Per scheduled vaccine: doses given in the range against doses that fell
+    due in the range, the latter derived from birth buckets shifted by the
+    schedule age. HPV is only scheduled for girls.
+    """
+    max_age = max(item['age_days'] for item in VACCINE_SCHEDULE_DATA)
+    first = start - timedelta(days=max_age)
+    span = (end - first).days + 1
+
+    births = {'Male': [0] * span, 'Female': [0] * span}
+    rows = DailyStat.objects.filter(metric=DAILY_BIRTHS, day__range=(first, end)).values_list('day', 'key', 'value')
+    for day, gender, value in rows:
+        if gender in births:
+            births[gender][(day - first).days] += value
+    prefix = {gender: [0] + list(accumulate(values)) for gender, values in births.items()}
+
+    def born_between(genders, lo, hi):
+        i, j = (lo - first).days, (hi - first).days + 1
+        return sum(prefix[g][j] - prefix[g][i] for g in genders)
+
+    given = _sum_by_key(DAILY_VACCINES_GIVEN, start, end)
+    coverage = []
+    for item in VACCINE_SCHEDULE_DATA:
+        offset = timedelta(days=item['age_days'])
+        for name in item['vaccines']:
+            genders = ['Female'] if 'Girls' in name else ['Male', 'Female']
+            due = born_between(genders, start - offset, end - offset)
+            doses = int(given.get(name, 0))
+            coverage.append({
+                'vaccine': name,
+                'due': int(due),
+                'given': doses,
+                'coverage': round(doses / due, 3) if due else None,
+            })
+    return coverage
+
+
+def sick_visit_ratio(start, end):
+    by_type = _sum_by_key(DAILY_VISITS_BY_TYPE, start, end)
+    visits = sum(_sum_by_key(DAILY_VISITS, start, end).values()) - by_type.get(REGISTRATION_VISIT_TYPE, 0)
+    sick = by_type.get(SICK_TAG, 0)
+    return {
+        'visits': int(visits),
+        'sick_visits': int(sick),
+        'ratio': round(sick / visits, 3) if visits else None,
+    }
@@ -0,0 +1,40 @@
+from asgiref.sync import sync_to_async
+from rest_framework.views import APIView
+
+# DRF dispatches synchronously, so an APIView with `async def` handlers
+# needs its own dispatch. Under ASGI these views run on the event loop and
+# a request waiting on the LLM holds no worker thread; authentication,
+# permission checks and throttling (which may query the database) run in
+# a thread via sync_to_async. Under WSGI Django runs them with
+# async_to_sync, so they behave like any other view.
+
+
+class AsyncAPIView(APIView):
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if hasattr(response, '__await__'):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def options(self, request, *args, **kwargs):
+        return super().options(request, *args, **kwargs)
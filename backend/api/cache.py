@@ -0,0 +1,60 @@
+import uuid
+from datetime import date
+
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+
+from .models import Patient
+from .schedule import sparse_storage
+
+# Versioned response cache for patient records.
+#
+# Every write that changes what PatientDetailSerializer renders replaces
+# Patient.record_version (see api/signals.py). Cache keys embed that version,
+# so a read always looks up the payload for the current version and entries
+# for older versions are simply never read again and age out. The version
+# lives in the database, so this stays correct with per-process caches.
+
+PATIENT_DETAIL_TIMEOUT = 60 * 60 * 24
+
+
+def bump_patient_version(**filters):
+    """
+    Replaces record_version for every patient matching `filters`, e.g.
+    bump_patient_version(pk=patient_id) or bump_patient_version(visits=visit_id).
+    """
+    return Patient.objects.filter(**filters).update(record_version=uuid.uuid4())
+
+
+def patient_record_tag(patient):
+    """
+    What a rendered record depends on besides its content: the version and,
+    in sparse vaccination storage, today's date (derived statuses move from
+    Pending to Missed without any write).
+    """
+    if sparse_storage():
+        return f"{patient.record_version}-{date.today().isoformat()}"
+    return str(patient.record_version)
+
+
+def patient_detail_key(patient_id, version, origin=''):
+    # Attachment URLs are absolute, so the payload depends on the scheme and
+    # host they were built with.
+    return f"patient-detail:{patient_id}:{version}:{origin}"
+
+
+def render_patient_detail(patient, request):
+    """
+    Returns the PatientDetailSerializer payload for an already-fetched
+    patient, from cache when its current record_version has been rendered.
+    """
+    # Imported here because serializers -> vaccinations -> cache.
+    from .serializers import PatientDetailSerializer
+
+    key = patient_detail_key(patient.pk, patient_record_tag(patient), request.build_absolute_uri('/'))
+    data = cache.get(key)
+    if data is None:
+        prefetch_related_objects([patient], *PatientDetailSerializer.prefetch_lookups())
+        data = PatientDetailSerializer(patient, context={'request': request}).data
+        cache.set(key, data, PATIENT_DETAIL_TIMEOUT)
+    return data
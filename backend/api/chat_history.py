@@ -0,0 +1,124 @@
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Q
+
+from .models import ChatSession
+from .utils import summarize_messages
+
+# Chat context built from the messages stored for a session.
+#
+# A turn replays only the session's latest messages verbatim, as many as
+# CHAT_HISTORY_MAX_MESSAGES and CHAT_HISTORY_TOKEN_BUDGET allow, so the
+# prompt (and the request body) stops growing with the conversation.
+# Messages that fall out of that window are folded into the session's
+# context_summary, which covers its first context_message_count messages.
+# Folding calls the model, so it runs in a background thread started by
+# the turn that finds the summary behind; until it lands, messages that
+# just left the window are missing from the prompt for a turn.
+
+
+def estimate_tokens(text):
+    # About four characters per token for Gemini on English text
+    return len(text or '') // 4 + 1
+
+
+def window_offset(messages, token_budget):
+    """
+    Index of the first of `messages` ((sender, text) pairs, oldest first)
+    in the longest suffix that fits `token_budget`. The latest message is
+    always kept.
+    """
+    used = 0
+    for i in range(len(messages) - 1, -1, -1):
+        used += estimate_tokens(messages[i][1])
+        if used > token_budget and i < len(messages) - 1:
+            return i + 1
+    return 0
+
+
+def _latest(session):
+    return session.messages.order_by('-timestamp', '-id').values_list('sender', 'text')[:settings.CHAT_HISTORY_MAX_MESSAGES]
+
+
+def _window_start(total, latest):
+    # `latest` is the session's last len(latest) messages, oldest first
+    return total - len(latest) + window_offset(latest, settings.CHAT_HISTORY_TOKEN_BUDGET)
+
+
+def _folded(session):
+    return session.context_message_count if session.context_summary else 0
+
+
+async def session_history(session):
+    """
+    Context for the next turn of `session`: (history, summary,
+    ai_message_count). `history` holds the verbatim window as
+    {'role', 'text'} dicts, `summary` covers what came before it (None when
+    nothing has been folded) and `ai_message_count` counts every AI
+    message in the session.
+    """
+    counts = await session.messages.aaggregate(total=Count('id'), ai=Count('id', filter=Q(sender='ai')))
+    latest = [row async for row in _latest(session)]
+    latest.reverse()
+    start = _window_start(counts['total'], latest)
+    folded = _folded(session)
+    if start > folded:
+        schedule_context_fold(session.pk)
+    # Never replay what the summary already covers
+    start = max(start, min(folded, counts['total']))
+
+    history = [{'role': sender, 'text': text} for sender, text in latest[start - (counts['total'] - len(latest)):]]
+    return history, session.context_summary if folded else None, counts['ai']
+
+
+def fold_context(session):
+    """Extends the session's context summary up to its current window start."""
+    latest = list(_latest(session))
+    latest.reverse()
+    start = _window_start(session.messages.count(), latest)
+    folded = _folded(session)
+    if start <= folded:
+        return
+    new_messages = [
+        {'role': sender, 'text': text}
+        for sender, text in session.messages.order_by('timestamp', 'id').values_list('sender', 'text')[folded:start]
+    ]
+    summary = summarize_messages(session.context_summary if folded else None, new_messages, session.patient_id)
+    # Conditional, so a concurrent fold that finished first is kept
+    ChatSession.objects.filter(pk=session.pk, context_message_count=session.context_message_count).update(
+        context_summary=summary, context_message_count=start
+    )
+
+
+_lock = threading.Lock()
+_folding = set()
+
+
+def schedule_context_fold(session_id):
+    """Folds the session's context in a background thread, unless one is running."""
+    with _lock:
+        if session_id in _folding:
+            return
+        _folding.add(session_id)
+    threading.Thread(target=_run_context_fold, args=(session_id,), daemon=True).start()
+
+
+def _run_context_fold(session_id):
+    try:
+        session = ChatSession.objects.filter(pk=session_id).first()
+        if session:
+            fold_context(session)
+    except Exception as e:
+        print(f"Chat History Fold Error: {e}")
+    finally:
+        with _lock:
+            _folding.discard(session_id)
+        connections.close_all()
+
+
+def trim_history(history):
+    """The latest part of a client-sent history that fits the same limits."""
+    history = history[-settings.CHAT_HISTORY_MAX_MESSAGES:] if settings.CHAT_HISTORY_MAX_MESSAGES else []
+    return history[window_offset([(m.get('role'), m.get('text')) for m in history], settings.CHAT_HISTORY_TOKEN_BUDGET):]
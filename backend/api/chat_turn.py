@@ -0,0 +1,121 @@
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+from .chat_history import session_history, trim_history
+from .models import Patient, Attachment, ChatSession, ChatMessage
+from .prompts import EARLIER_CONVERSATION_CONTEXT
+from .utils import aanalyze_scan_helper, get_pediatric_system_prompt
+
+# One AIChatView turn as an explicit pipeline.
+#
+# A ChatTurn is created per request and loads everything the turn needs
+# exactly once (patient, session, attachment with its scan analysis,
+# stored history), then builds the model messages and saves the user's
+# message. Each stage is timed; server_timing() reports them in
+# Server-Timing header form so they show up in the browser's network panel.
+
+
+class ChatTurn:
+    def __init__(self, data):
+        self.message = data.get('message', '')
+        self.patient_id = data.get('patientId')
+        self.session_id = data.get('sessionId')
+        self.patient_stats = data.get('patientStats', {})
+        self.mode = data.get('mode', 'patient')
+        self.attachment_id = data.get('attachmentId')
+        self.model_name = data.get('modelName', 'gemini-2.5-flash-lite')
+        self.history = data.get('history', [])
+
+        self.patient = None
+        self.session = None
+        self.attachment = None
+        self.structured_findings = None
+        self.earlier_summary = None
+        self.ai_message_count = None
+        self.messages = []
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + (time.perf_counter() - start) * 1000
+
+    def server_timing(self):
+        return ', '.join(f"{name};dur={ms:.1f}" for name, ms in self.timings.items())
+
+    async def prepare(self):
+        """Everything before the model call."""
+        with self.stage('load'):
+            await self.load()
+        with self.stage('scan'):
+            await self.analyze_attachment()
+        with self.stage('history'):
+            await self.load_history()
+        with self.stage('prompt'):
+            await self.build_messages()
+        with self.stage('save'):
+            await self.save_message('user', self.message, attachment=self.attachment)
+
+    async def load(self):
+        if self.attachment_id:
+            self.attachment = await Attachment.objects.select_related('scan_analysis').filter(id=self.attachment_id).afirst()
+
+        if not self.patient_id:
+            return
+        try:
+            self.patient = await Patient.objects.aget(pk=self.patient_id)
+        except Patient.DoesNotExist:
+            return
+
+        if self.session_id:
+            try:
+                self.session = await ChatSession.objects.aget(pk=self.session_id)
+            except ChatSession.DoesNotExist:
+                self.session = await ChatSession.objects.acreate(patient=self.patient)
+        else:
+            self.session = await ChatSession.objects.filter(patient=self.patient).order_by('-updated_at').afirst()
+            if not self.session:
+                self.session = await ChatSession.objects.acreate(patient=self.patient)
+
+    async def analyze_attachment(self):
+        if self.attachment:
+            self.structured_findings = await aanalyze_scan_helper(self.attachment)
+
+    async def load_history(self):
+        # Stored sessions are replayed from the database; a client-sent
+        # history is only used for chats that aren't saved.
+        if self.session:
+            self.history, self.earlier_summary, self.ai_message_count = await session_history(self.session)
+        else:
+            self.ai_message_count = sum(1 for m in self.history if m.get('role') == 'ai')
+            self.history = trim_history(self.history)
+
+    async def build_messages(self):
+        system_prompt_content = await sync_to_async(get_pediatric_system_prompt)(
+            patient_id=self.patient_id,
+            patient_stats=self.patient_stats,
+            mode=self.mode,
+            history=self.history,
+            scan_analysis=self.structured_findings,
+            ai_message_count=self.ai_message_count
+        )
+        if self.earlier_summary:
+            system_prompt_content += EARLIER_CONVERSATION_CONTEXT.format(summary=self.earlier_summary)
+
+        self.messages = [SystemMessage(content=system_prompt_content)]
+        for msg in self.history:
+            if msg.get('role') == 'user':
+                self.messages.append(HumanMessage(content=msg.get('text', '')))
+            elif msg.get('role') == 'ai':
+                self.messages.append(AIMessage(content=msg.get('text', '')))
+        self.messages.append(HumanMessage(content=self.message))
+
+    async def save_message(self, sender, text, attachment=None):
+        if self.session:
+            await ChatMessage.objects.acreate(session=self.session, sender=sender, text=text, attachment=attachment)
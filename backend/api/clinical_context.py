@@ -0,0 +1,88 @@
+import calendar
+from datetime import date
+
+from django.core.cache import cache
+
+from .models import Patient
+from .summaries import get_patient_summary
+
+# Per-patient clinical context for AI chat prompts.
+#
+# What a chat turn needs to know about the patient (age, latest vitals,
+# which of them are missing, overdue vaccines) is gathered in one place and
+# cached, so building the system prompt usually doesn't touch the database.
+# Visit, Vaccination and Patient signals and vaccinations_changed() drop the
+# entry; keys also carry today's date, since overdue vaccines and age move
+# on without any write. With the default per-process cache another process
+# can serve an entry until CLINICAL_CONTEXT_TIMEOUT; a shared CACHE_BACKEND
+# makes invalidation immediate everywhere.
+
+CLINICAL_CONTEXT_TIMEOUT = 60 * 10
+
+
+def clinical_context_key(patient_id, today=None):
+    return f"clinical-context:{patient_id}:{(today or date.today()).isoformat()}"
+
+
+def invalidate_clinical_context(*patient_ids):
+    cache.delete_many([clinical_context_key(pk) for pk in patient_ids])
+
+
+def age_text(dob, today):
+    """Age as 'Xy Ym Zd', the way the patient page shows it."""
+    years = today.year - dob.year
+    months = today.month - dob.month
+    days = today.day - dob.day
+    if days < 0:
+        months -= 1
+        previous_month = today.month - 1 or 12
+        days += calendar.monthrange(today.year if today.month > 1 else today.year - 1, previous_month)[1]
+    if months < 0:
+        years -= 1
+        months += 12
+    return f"{years}y {months}m {days}d"
+
+
+def build_clinical_context(patient_id, today=None):
+    # Imported here because vaccinations -> clinical_context.
+    from .vaccinations import overdue_vaccine_names
+
+    today = today or date.today()
+    dob = Patient.objects.filter(pk=patient_id).values_list('dob', flat=True).first()
+    if dob is None:
+        return None
+
+    summary = get_patient_summary(patient_id)
+    context = {
+        'age': age_text(dob, today),
+        'has_visit': bool(summary and summary.last_visit_date),
+        'missing': [],
+        'vitals': None,
+        'overdue_vaccines': [],
+    }
+    if context['has_visit']:
+        if not summary.latest_weight: context['missing'].append("Weight")
+        if not summary.latest_height: context['missing'].append("Height")
+        vitals = f"Weight: {summary.latest_weight} kg, Height: {summary.latest_height} cm"
+        if summary.latest_head_circumference:
+            vitals += f", Head Circumference: {summary.latest_head_circumference} cm"
+        context['vitals'] = vitals
+    if summary and summary.overdue_vaccine_count:
+        context['overdue_vaccines'] = overdue_vaccine_names(patient_id, today)
+    return context
+
+
+def get_clinical_context(patient_id):
+    """
+    {'age', 'has_visit', 'missing', 'vitals', 'overdue_vaccines'} for a
+    patient, from cache when possible. `missing` lists vitals absent from
+    the latest visit and `vitals` describes them (None without a visit).
+    None if the patient does not exist.
+    """
+    key = clinical_context_key(patient_id)
+    context = cache.get(key)
+    if context is None:
+        context = build_clinical_context(patient_id)
+        if context is not None:
+            cache.set(key, context, CLINICAL_CONTEXT_TIMEOUT)
+    return context
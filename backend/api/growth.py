@@ -0,0 +1,182 @@
+import csv
+from collections import defaultdict
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from .models import Patient, Visit
+
+# WHO Child Growth Standards (0-5 years) z-scores.
+#
+# The LMS tables in api/data/who_lms.csv are loaded once into NumPy arrays
+# and every function below works on whole arrays of measurements, so a
+# patient's history or a batch of patients is scored in a handful of
+# vectorized operations. Values outside the standards' range (or missing
+# measurements) come back as NaN.
+
+LMS_PATH = Path(__file__).resolve().parent / 'data' / 'who_lms.csv'
+
+DAYS_PER_MONTH = 30.4375
+
+# indicator -> (x axis, [(table, first age month, last age month)], restricted)
+# "restricted" indicators use WHO's adjusted tails beyond +/-3 SD.
+INDICATORS = {
+    'wfa': ('age', [('wfa', 0, 60)], True),
+    'hfa': ('age', [('lhfa_0_2', 0, 24), ('lhfa_2_5', 24, 60)], False),
+    'hcfa': ('age', [('hcfa', 0, 60)], False),
+    'bfa': ('age', [('bfa_0_2', 0, 24), ('bfa_2_5', 24, 60)], True),
+    'wfh': ('height', [('wfl', 0, 24), ('wfh', 24, 60)], True),
+}
+
+SEXES = ('Male', 'Female')
+
+
+@lru_cache(maxsize=None)
+def load_tables():
+    """{(table, sex): (x, L, M, S) arrays sorted by x}."""
+    rows = defaultdict(list)
+    with open(LMS_PATH, newline='') as f:
+        for row in csv.DictReader(f):
+            rows[(row['table'], row['sex'])].append((float(row['x']), float(row['l']), float(row['m']), float(row['s'])))
+    return {key: tuple(np.array(column) for column in zip(*sorted(values))) for key, values in rows.items()}
+
+
+def _lms(table, sex, x):
+    xs, l, m, s = load_tables()[(table, sex)]
+    inside = (x >= xs[0]) & (x <= xs[-1])
+    values = [np.where(inside, np.interp(x, xs, column), np.nan) for column in (l, m, s)]
+    return values
+
+
+def _lms_zscore(y, l, m, s, restricted):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = y / m
+        z = np.where(l == 0, np.log(ratio) / s, (np.power(ratio, l) - 1) / (l * s))
+        if restricted:
+            def sd(k):
+                return m * np.power(1 + l * s * k, 1 / l)
+            sd3, sd2, sd3neg, sd2neg = sd(3), sd(2), sd(-3), sd(-2)
+            z = np.where(z > 3, 3 + (y - sd3) / (sd3 - sd2), z)
+            z = np.where(z < -3, -3 + (y - sd3neg) / (sd2neg - sd3neg), z)
+    return z
+
+
+def zscores(indicator, sex, age_days, y, x=None):
+    """
+    Z-scores for one indicator. `sex` holds 'Male'/'Female', `age_days` the
+    age at measurement, `y` the measurement and, for 'wfh', `x` the length
+    or height in cm. All arguments are equal-length arrays (or scalars).
+    """
+    axis, segments, restricted = INDICATORS[indicator]
+    sex = np.asarray(sex)
+    months = np.asarray(age_days, dtype=float) / DAYS_PER_MONTH
+    y = np.asarray(y, dtype=float)
+    months, y, sex = np.broadcast_arrays(months, y, sex)
+    x = months if axis == 'age' else np.broadcast_to(np.asarray(x, dtype=float), months.shape)
+    y = np.where(y > 0, y, np.nan)
+
+    l = np.full(months.shape, np.nan)
+    m = np.full(months.shape, np.nan)
+    s = np.full(months.shape, np.nan)
+    for i, (table, first, last) in enumerate(segments):
+        upper = months <= last if i == len(segments) - 1 else months < last
+        in_segment = (months >= first) & upper
+        for value in SEXES:
+            mask = in_segment & (sex == value)
+            if mask.any():
+                l[mask], m[mask], s[mask] = _lms(table, value, x[mask])
+    return _lms_zscore(y, l, m, s, restricted)
+
+
+def normal_cdf(z):
+    # Abramowitz & Stegun 7.1.26 erf, absolute error below 1.5e-7
+    z = np.asarray(z, dtype=float)
+    t = np.abs(z) / np.sqrt(2)
+    k = 1 / (1 + 0.3275911 * t)
+    poly = k * (0.254829592 + k * (-0.284496736 + k * (1.421413741 + k * (-1.453152027 + k * 1.061405429))))
+    erf = 1 - poly * np.exp(-t * t)
+    return 0.5 * (1 + np.sign(z) * erf)
+
+
+def percentiles(z):
+    return 100 * normal_cdf(z)
+
+
+def growth_zscores(sex, age_days, weight=None, height=None, head_circumference=None):
+    """
+    Every indicator the given measurements allow, as {indicator: z array}.
+    Inputs are equal-length arrays; NaN or non-positive entries count as
+    missing.
+    """
+    result = {}
+    if weight is not None:
+        weight = np.asarray(weight, dtype=float)
+        result['wfa'] = zscores('wfa', sex, age_days, weight)
+    if height is not None:
+        height = np.asarray(height, dtype=float)
+        result['hfa'] = zscores('hfa', sex, age_days, height)
+    if head_circumference is not None:
+        result['hcfa'] = zscores('hcfa', sex, age_days, head_circumference)
+    if weight is not None and height is not None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bmi = weight / np.square(height / 100)
+        result['bfa'] = zscores('bfa', sex, age_days, bmi)
+        result['wfh'] = zscores('wfh', sex, age_days, weight, x=height)
+    return result
+
+
+def _as_list(values, digits=2):
+    return [None if np.isnan(v) else round(float(v), digits) for v in values]
+
+
+def growth_payload(dates, age_days, scores):
+    """JSON-ready parallel arrays with z-scores and percentiles."""
+    return {
+        'dates': list(dates),
+        'age_days': [int(d) for d in age_days],
+        'indicators': {
+            name: {'z': _as_list(z), 'percentile': _as_list(percentiles(z), 1)}
+            for name, z in scores.items()
+        },
+    }
+
+
+VISIT_MEASURES = ('patient_id', 'date', 'weight', 'height', 'head_circumference')
+
+
+def patients_growth(patient_ids):
+    """
+    Growth payloads for many patients from two queries and one vectorized
+    scoring pass over all their visits. Returns {patient_id: payload}.
+    """
+    patients = {pk: (dob, gender) for pk, dob, gender in Patient.objects.filter(pk__in=patient_ids).values_list('pk', 'dob', 'gender')}
+    payloads = {pk: growth_payload([], [], {}) for pk in patients}
+    rows = list(
+        Visit.objects.filter(patient_id__in=patients)
+        .order_by('patient_id', 'date').values_list(*VISIT_MEASURES)
+    )
+    if not rows:
+        return payloads
+
+    patient_col, dates, weight, height, hc = zip(*rows)
+    age_days = np.array([(day - patients[pk][0]).days for pk, day in zip(patient_col, dates)])
+    to_array = lambda values: np.array([np.nan if v is None else v for v in values], dtype=float)
+    scores = growth_zscores(
+        np.array([patients[pk][1] for pk in patient_col]), age_days,
+        weight=to_array(weight), height=to_array(height), head_circumference=to_array(hc),
+    )
+
+    # Rows are ordered by patient, so each patient is one contiguous slice.
+    starts = [0] + [i for i in range(1, len(rows)) if patient_col[i] != patient_col[i - 1]] + [len(rows)]
+    for start, end in zip(starts, starts[1:]):
+        payloads[patient_col[start]] = growth_payload(
+            dates[start:end], age_days[start:end],
+            {name: z[start:end] for name, z in scores.items()}
+        )
+    return payloads
+
+
+def patient_growth(patient_id):
+    """The growth payload for one patient, or None if it does not exist."""
+    return next(iter(patients_growth([patient_id]).values()), None)
@@ -0,0 +1,201 @@
+import csv
+import json
+import random
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+
+from .models import Patient, Visit, Vaccination
+from .serializers import PatientSerializer
+from .summaries import refresh_patient_summaries
+from .stats import record_patient_batch, record_visit_batch
+from .analytics import mark_days_dirty
+from .vaccinations import schedule_rows
+
+# Bulk patient import.
+#
+# Rows carry the PatientSerializer fields (name, dob, gender, father_height,
+# mother_height and the optional initial_* vitals / calculated_age) and are
+# written in batches with bulk_create. bulk_create skips the Patient and
+# Visit signals, so each batch creates the vaccination schedules and updates
+# summaries, stats and analytics days itself.
+
+DEFAULT_PATIENT_PASSWORD = 'password123'
+IMPORT_FORMATS = ['csv', 'ndjson']
+MAX_REPORTED_ERRORS = 100
+USERNAME_ATTEMPTS = 5
+
+
+def guess_format(filename):
+    return 'ndjson' if filename.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def iter_records(lines, fmt='csv'):
+    """
+    Yields (line_number, row dict) from an iterable of text lines without
+    reading the whole input. Blank CSV cells are treated as missing.
+    """
+    if fmt == 'ndjson':
+        for number, line in enumerate(lines, start=1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError:
+                    yield number, None
+        return
+
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, {key: value for key, value in row.items() if key and value not in ('', None)}
+
+
+def assign_usernames(names):
+    """
+    Usernames derived like PatientCreateView does (name lowercased, spaces
+    removed, random suffix on collision), checked against the database in
+    one query per round instead of one per patient.
+    """
+    bases = [name.lower().replace(' ', '') for name in names]
+    usernames = [None] * len(bases)
+    taken = set()
+    pending = list(range(len(bases)))
+    attempt = 0
+    while pending:
+        proposals = {
+            i: bases[i] if attempt == 0 else f'{bases[i]}{random.randint(100, 10 ** (attempt + 2) - 1)}'
+            for i in pending
+        }
+        existing = set(User.objects.filter(username__in=set(proposals.values())).values_list('username', flat=True))
+        retry = []
+        for i in pending:
+            if proposals[i] in existing or proposals[i] in taken:
+                retry.append(i)
+            else:
+                taken.add(proposals[i])
+                usernames[i] = proposals[i]
+        pending = retry
+        attempt += 1
+    return usernames
+
+
+def create_patient_users(names, password_hash):
+    """
+    Patient logins for `names`. A concurrent import can take a username
+    between assign_usernames' check and the insert; the batch's users are
+    then rolled back to a savepoint and assigned again.
+    """
+    for attempt in range(USERNAME_ATTEMPTS):
+        usernames = assign_usernames(names)
+        try:
+            with transaction.atomic():
+                return User.objects.bulk_create([User(username=username, password=password_hash) for username in usernames])
+        except IntegrityError:
+            if attempt == USERNAME_ATTEMPTS - 1:
+                raise
+
+
+def _read_chunk(records, size):
+    """Up to `size` records, plus the error that cut reading short, if any."""
+    chunk = []
+    try:
+        for record in islice(records, size):
+            chunk.append(record)
+    except (UnicodeDecodeError, csv.Error) as e:
+        return chunk, e
+    return chunk, None
+
+
+def _import_batch(rows, password_hash):
+    patients = []
+    initial_visits = []
+    for data in rows:
+        patient = Patient(
+            name=data['name'],
+            dob=data['dob'],
+            gender=data['gender'],
+            father_height=data['father_height'],
+            mother_height=data['mother_height'],
+        )
+        patients.append((patient, data))
+
+    with transaction.atomic():
+        users = []
+        if password_hash:
+            users = create_patient_users([patient.name for patient, _ in patients], password_hash)
+            for (patient, _), user in zip(patients, users):
+                patient.user = user
+
+        Patient.objects.bulk_create([patient for patient, _ in patients])
+
+        # Same initial visit PatientSerializer.create adds
+        for patient, data in patients:
+            weight = data.get('initial_weight')
+            height = data.get('initial_height')
+            head_circumference = data.get('initial_head_circumference')
+            if weight or height or head_circumference:
+                initial_visits.append(Visit(
+                    patient=patient,
+                    date=patient.created_at.date(),
+                    age=data.get('calculated_age') or 0,
+                    weight=weight or 0,
+                    height=height or 0,
+                    head_circumference=head_circumference,
+                    visit_type='Initial',
+                    diagnosis='Initial Registration',
+                    notes='Auto-generated from registration.'
+                ))
+        Visit.objects.bulk_create(initial_visits)
+
+        schedules = [row for patient, _ in patients for row in schedule_rows(patient.pk, patient.dob)]
+        Vaccination.objects.bulk_create(schedules, batch_size=1000)
+
+        refresh_patient_summaries([patient.pk for patient, _ in patients])
+        record_patient_batch([patient.created_at for patient, _ in patients])
+        record_visit_batch(initial_visits)
+        mark_days_dirty(*{patient.dob for patient, _ in patients}, *{visit.date for visit in initial_visits})
+
+    return {'users': len(users), 'visits': len(initial_visits), 'vaccinations': len(schedules)}
+
+
+def import_patients(records, batch_size=500, create_users=True, progress=None):
+    """
+    Imports (line_number, row) records from iter_records in batches of
+    `batch_size`, one transaction per batch. Invalid rows are skipped and
+    reported. With create_users, each patient gets a login with the default
+    password; the hash is computed once per import rather than per user.
+    Returns a dict of counts plus the first MAX_REPORTED_ERRORS errors.
+    If the input turns out to be unreadable part way (bad encoding or CSV),
+    the rows before that point are still imported and `error` says why the
+    import stopped.
+    """
+    password_hash = make_password(DEFAULT_PATIENT_PASSWORD) if create_users else None
+    result = {'created': 0, 'users': 0, 'visits': 0, 'vaccinations': 0, 'failed': 0, 'errors': [], 'error': None}
+
+    records = iter(records)
+    while True:
+        chunk, read_error = _read_chunk(records, batch_size)
+        if not chunk and not read_error:
+            return result
+
+        valid = []
+        for line, row in chunk:
+            serializer = PatientSerializer(data=row) if isinstance(row, dict) else None
+            if serializer is not None and serializer.is_valid():
+                valid.append(serializer.validated_data)
+                continue
+            result['failed'] += 1
+            if len(result['errors']) < MAX_REPORTED_ERRORS:
+                result['errors'].append({'line': line, 'errors': serializer.errors if serializer else 'Invalid JSON object'})
+
+        if valid:
+            counts = _import_batch(valid, password_hash)
+            result['created'] += len(valid)
+            for key, value in counts.items():
+                result[key] += value
+        if progress:
+            progress(result)
+        if read_error:
+            result['error'] = f'Unreadable file: {read_error}'
+            return result
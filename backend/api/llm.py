@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import os
+import threading
+import weakref
+
+from dotenv import load_dotenv
+from django.core.cache import caches
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+
+load_dotenv()
+
+API_KEY = os.getenv("GEMINI_API_KEY")
+
+# Process-wide registry of chat models and prompt chains.
+#
+# Each ChatGoogleGenerativeAI owns a genai client with its own HTTP
+# connection pools, so building one per call redoes client setup and opens
+# a fresh connection to Gemini every time. Models here are built once per
+# (model, temperature) and chains once per (template, model, temperature),
+# then shared; their sync HTTP clients are thread-safe and keep connections
+# alive between calls.
+#
+# Async HTTP clients belong to the event loop they were first used on.
+# Under ASGI that is the one server loop, but async_to_sync (WSGI) runs each
+# call on a new loop, so objects handed out inside a running loop are kept
+# per loop and dropped along with it.
+
+_lock = threading.RLock()
+_shared = {}
+_per_loop = weakref.WeakKeyDictionary()
+
+
+def _registry():
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _shared
+    return _per_loop.setdefault(loop, {})
+
+
+def _get(key, build):
+    with _lock:
+        registry = _registry()
+        if key not in registry:
+            registry[key] = build()
+        return registry[key]
+
+
+def chat_model(model, temperature):
+    return _get(('model', model, temperature), lambda: ChatGoogleGenerativeAI(
+        model=model,
+        google_api_key=API_KEY,
+        temperature=temperature
+    ))
+
+
+def prompt_chain(template, model, temperature):
+    """`template | model | StrOutputParser()`, with variables taken from the template."""
+    return _get(
+        ('chain', template, model, temperature),
+        lambda: PromptTemplate.from_template(template) | chat_model(model, temperature) | StrOutputParser()
+    )
+
+
+# Responses for deterministic-enough calls (low temperature summaries and
+# scan analyses) are cached by a hash of everything that went into them, so
+# an identical request is answered without calling Gemini again.
+
+def response_key(model, temperature, prompt, image=b''):
+    digest = hashlib.sha256()
+    for part in (model, repr(temperature), prompt):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    digest.update(image)
+    return f"llm-response:{digest.hexdigest()}"
+
+
+def cached_response(key, call):
+    """`call()`'s result, from the response cache if `key` was seen before."""
+    result = caches['llm'].get(key)
+    if result is None:
+        result = call()
+        caches['llm'].set(key, result)
+    return result
+
+
+async def acached_response(key, call):
+    result = await caches['llm'].aget(key)
+    if result is None:
+        result = await call()
+        await caches['llm'].aset(key, result)
+    return result
@@ -0,0 +1,46 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from api.models import Patient, Vaccination
+from api.pagination import iter_pk_chunks
+from api.schedule import SCHEDULE_OFFSETS, sparse_storage, derived_status
+from api.vaccinations import batched_record_changes, vaccinations_changed
+
+
+class Command(BaseCommand):
+    help = 'Deletes stored vaccination rows that sparse storage derives from the schedule'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Patients per chunk')
+        parser.add_argument('--dry-run', action='store_true', help='Report removable rows without deleting them')
+
+    def handle(self, *args, **options):
+        if not sparse_storage():
+            raise CommandError('VACCINATION_STORAGE is not sparse; compacting would drop pending vaccines')
+
+        today = date.today()
+        processed = removed = 0
+        for chunk in iter_pk_chunks(Patient.objects.all(), ('pk', 'dob'), options['batch_size']):
+            dobs = dict(chunk)
+            derivable = []
+            patients = set()
+            rows = (
+                Vaccination.objects.filter(patient_id__in=dobs, vaccine_name__in=SCHEDULE_OFFSETS, visit__isnull=True, given_at__isnull=True)
+                .values_list('pk', 'patient_id', 'vaccine_name', 'due_date', 'status')
+            )
+            for pk, patient_id, name, due_date, status in rows:
+                # Only rows identical to what would be derived
+                if due_date == dobs[patient_id] + SCHEDULE_OFFSETS[name] and status == derived_status(due_date, today):
+                    derivable.append(pk)
+                    patients.add(patient_id)
+
+            if derivable and not options['dry_run']:
+                with batched_record_changes():
+                    Vaccination.objects.filter(pk__in=derivable).delete()
+                    vaccinations_changed(patients)
+
+            processed += len(chunk)
+            removed += len(derivable)
+            self.stdout.write(f"Processed {processed} patients, {removed} derivable rows found")
+
+        verb = 'Would remove' if options['dry_run'] else 'Successfully removed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {removed} stored vaccinations'))
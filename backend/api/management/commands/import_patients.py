@@ -0,0 +1,39 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from api.imports import import_patients, iter_records, guess_format, IMPORT_FORMATS
+
+
+class Command(BaseCommand):
+    help = 'Imports patients from a CSV or NDJSON file (use - for stdin)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File with one patient per row/line')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Defaults to ndjson for .ndjson/.jsonl files, csv otherwise')
+        parser.add_argument('--batch-size', type=int, default=500, help='Patients per transaction')
+        parser.add_argument('--no-users', action='store_true', help='Skip creating patient logins')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+        try:
+            source = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f'Cannot open {path}: {e}')
+
+        with source:
+            result = import_patients(
+                iter_records(source, fmt),
+                batch_size=options['batch_size'],
+                create_users=not options['no_users'],
+                progress=lambda r: self.stdout.write(f"Imported {r['created']} patients, {r['failed']} rows failed"),
+            )
+
+        for error in result['errors']:
+            self.stderr.write(f"Line {error['line']}: {error['errors']}")
+        if result['error']:
+            self.stderr.write(f"Stopped early: {result['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully imported {result['created']} patients "
+            f"({result['users']} users, {result['visits']} initial visits, {result['vaccinations']} vaccinations); "
+            f"{result['failed']} rows failed"
+        ))
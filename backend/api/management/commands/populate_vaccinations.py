@@ -1,32 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque
 from django.core.management.base import BaseCommand
-from api.models import Patient, Vaccination, VACCINE_SCHEDULE_DATA
-from datetime import timedelta
+from django.db import connections, transaction
+from api.models import Patient, Vaccination
+from api.pagination import iter_pk_chunks
+from api.vaccinations import schedule_rows, vaccinations_changed
 
 class Command(BaseCommand):
     help = 'Populates vaccination schedule for existing patients'
 
-    def handle(self, *args, **kwargs):
-        patients = Patient.objects.all()
-        count = 0
-        for patient in patients:
-            # Check each scheduled item
-            created_count = 0
-            for item in VACCINE_SCHEDULE_DATA:
-                due_date = patient.dob + timedelta(days=item['age_days'])
-                for v_name in item['vaccines']:
-                    # Check if this specific vaccine record exists
-                    if not Vaccination.objects.filter(patient=patient, vaccine_name=v_name).exists():
-                         Vaccination.objects.create(
-                            patient=patient,
-                            vaccine_name=v_name,
-                            due_date=due_date
-                        )
-                         created_count += 1
-            
-            if created_count > 0:
-                self.stdout.write(f"Added {created_count} missing vaccines for {patient.name}")
-                count += 1
-            else:
-                 self.stdout.write(f"Schedule complete for {patient.name}")
-        
-        self.stdout.write(self.style.SUCCESS(f'Successfully populated schedule for {count} patients'))
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Patients per chunk')
+        parser.add_argument('--dry-run', action='store_true', help='Report missing vaccines without writing them')
+        parser.add_argument('--workers', type=int, default=1, help='Chunks processed in parallel (best on PostgreSQL; SQLite serializes writers)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+
+        total_patients = Patient.objects.count()
+        processed = created = patients_updated = 0
+
+        chunks = iter_pk_chunks(Patient.objects.all(), ('pk', 'dob'), batch_size)
+        if options['workers'] > 1:
+            results = self.process_in_pool(chunks, options['workers'])
+        else:
+            results = map(self.process_chunk, chunks)
+        for chunk_size, chunk_created, chunk_updated in results:
+            processed += chunk_size
+            created += chunk_created
+            patients_updated += chunk_updated
+            self.report(processed, total_patients, created)
+
+        verb = 'Would add' if self.dry_run else 'Added'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {created} missing vaccines for {patients_updated} of {processed} patients'
+        ))
+
+    def process_chunk(self, chunk):
+        """
+        Loads the existing (patient, vaccine) pairs for a chunk in one query
+        and inserts every missing scheduled vaccine with bulk_create.
+        """
+        existing = defaultdict(set)
+        pairs = Vaccination.objects.filter(patient_id__in=[pk for pk, _ in chunk]).values_list('patient_id', 'vaccine_name')
+        for patient_id, vaccine_name in pairs:
+            existing[patient_id].add(vaccine_name)
+
+        missing = []
+        updated = []
+        for patient_id, dob in chunk:
+            rows = schedule_rows(patient_id, dob, skip=existing[patient_id])
+            if rows:
+                missing.extend(rows)
+                updated.append(patient_id)
+
+        if missing and not self.dry_run:
+            with transaction.atomic():
+                Vaccination.objects.bulk_create(missing, batch_size=1000, ignore_conflicts=True)
+                vaccinations_changed(updated)
+        return len(chunk), len(missing), len(updated)
+
+    def process_in_pool(self, chunks, workers):
+        """
+        process_chunk results, in order, from `workers` threads. Chunks are
+        read as workers free up, so at most two per worker are in memory
+        (Executor.map would read every chunk up front).
+        """
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(self.process_chunk_in_thread, chunk))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def process_chunk_in_thread(self, chunk):
+        try:
+            return self.process_chunk(chunk)
+        finally:
+            connections.close_all()
+
+    def report(self, processed, total, created):
+        self.stdout.write(f"Processed {processed}/{total} patients, {created} missing vaccines found")
@@ -0,0 +1,29 @@
+from datetime import date
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from api.models import Patient
+from api.pagination import iter_pk_chunks
+from api.summaries import refresh_patient_summaries
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalized PatientSummary rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Patients recomputed per query')
+        parser.add_argument('--stale-only', action='store_true', help='Only refresh missing summaries or ones whose next vaccine due date has passed')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        patients = Patient.objects.all()
+        if options['stale_only']:
+            patients = patients.filter(
+                Q(summary__isnull=True) | Q(summary__next_vaccine_due_date__lte=date.today())
+            )
+
+        total = 0
+        for chunk in iter_pk_chunks(patients, ('pk',), batch_size):
+            total += refresh_patient_summaries([pk for pk, in chunk])
+            self.stdout.write(f"Refreshed {total} summaries")
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt {total} patient summaries'))
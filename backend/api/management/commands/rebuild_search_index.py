@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from api.search import rebuild_sqlite_fts
+
+
+class Command(BaseCommand):
+    help = 'Resyncs and reindexes the SQLite FTS5 search tables'
+
+    def handle(self, *args, **kwargs):
+        if connection.vendor != 'sqlite':
+            self.stdout.write(f"Nothing to rebuild: {connection.vendor} indexes are maintained by the database")
+            return
+        rebuild_sqlite_fts()
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt search index'))
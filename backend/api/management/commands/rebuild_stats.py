@@ -0,0 +1,19 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand
+from api.stats import rebuild_counters, compute_signal_buckets, replace_daily_buckets, SIGNAL_METRICS
+
+
+class Command(BaseCommand):
+    help = 'Recomputes dashboard counters and daily statistic buckets from source tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Only recompute daily buckets for the last N days (default: all)')
+
+    def handle(self, *args, **options):
+        totals = rebuild_counters()
+        self.stdout.write(f"Counters: {totals}")
+
+        start = date.today() - timedelta(days=options['days']) if options['days'] else None
+        rows = compute_signal_buckets(start=start)
+        count = replace_daily_buckets(rows, SIGNAL_METRICS, start=start)
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt {count} daily buckets'))
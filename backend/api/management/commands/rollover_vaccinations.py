@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.schedule import sparse_storage
+from api.vaccinations import rollover_missed_vaccinations
+
+
+class Command(BaseCommand):
+    help = 'Marks pending vaccinations past their grace period as Missed (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-days', type=int,
+            help='Days past due before a pending vaccine counts as missed '
+                 '(default VACCINATION_MISSED_GRACE_DAYS; dense storage only)'
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows updated per transaction')
+
+    def handle(self, *args, **options):
+        grace_days = options['grace_days']
+        # Sparse mode derives Missed on read from VACCINATION_MISSED_GRACE_DAYS;
+        # a different grace period here would only apply to the stored rows.
+        if sparse_storage() and grace_days is not None and grace_days != settings.VACCINATION_MISSED_GRACE_DAYS:
+            raise CommandError('--grace-days is not supported with sparse vaccination storage; set VACCINATION_MISSED_GRACE_DAYS instead')
+
+        changed = rollover_missed_vaccinations(grace_days=grace_days, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully marked {changed} vaccinations as Missed'))
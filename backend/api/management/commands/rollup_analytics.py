@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from api.analytics import rollup_pending_days, rollup_all
+
+
+class Command(BaseCommand):
+    help = 'Recomputes analytics day buckets for days changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every day instead of only changed ones')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Days recomputed per transaction')
+
+    def handle(self, *args, **options):
+        if options['full']:
+            rows = rollup_all()
+            self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt {rows} analytics buckets'))
+            return
+
+        days, rows = rollup_pending_days(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully rolled up {days} days ({rows} buckets)'))
@@ -0,0 +1,23 @@
+from collections import Counter
+from django.core.management.base import BaseCommand
+from api.screening import iter_patient_chunks, screen_chunk, replace_flags
+
+
+class Command(BaseCommand):
+    help = 'Screens every patient for growth faltering and rewrites the growth flags'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='Patients per chunk')
+
+    def handle(self, *args, **options):
+        processed = 0
+        kinds = Counter()
+        for chunk in iter_patient_chunks(options['batch_size']):
+            flags = screen_chunk(chunk)
+            replace_flags([row[0] for row in chunk], flags)
+            processed += len(chunk)
+            kinds.update(flag.kind for flag in flags)
+            self.stdout.write(f"Screened {processed} patients, {sum(kinds.values())} flags")
+
+        summary = ', '.join(f'{kind}: {count}' for kind, count in sorted(kinds.items())) or 'none'
+        self.stdout.write(self.style.SUCCESS(f'Successfully screened {processed} patients ({summary})'))
@@ -0,0 +1,27 @@
+# Generated by Django 6.0.1 on 2026-10-17 01:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_chatmessage_attachment"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="patient",
+            index=models.Index(
+                fields=["-created_at", "-id"], name="patient_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="visit",
+            index=models.Index(
+                fields=["patient", "-date"], name="visit_patient_date_idx"
+            ),
+        ),
+    ]
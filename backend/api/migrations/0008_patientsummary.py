@@ -0,0 +1,61 @@
+# Generated by Django 6.0.1 on 2026-10-17 01:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_patient_list_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PatientSummary",
+            fields=[
+                (
+                    "patient",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="summary",
+                        serialize=False,
+                        to="api.patient",
+                    ),
+                ),
+                ("last_visit_date", models.DateField(blank=True, null=True)),
+                (
+                    "latest_weight",
+                    models.FloatField(blank=True, help_text="Weight in kg", null=True),
+                ),
+                (
+                    "latest_height",
+                    models.FloatField(blank=True, help_text="Height in cm", null=True),
+                ),
+                (
+                    "latest_head_circumference",
+                    models.FloatField(
+                        blank=True, help_text="Head Circumference in cm", null=True
+                    ),
+                ),
+                (
+                    "overdue_vaccine_count",
+                    models.IntegerField(
+                        default=0,
+                        help_text="Pending vaccines due on or before refreshed_on",
+                    ),
+                ),
+                (
+                    "next_vaccine_due_date",
+                    models.DateField(
+                        blank=True,
+                        help_text="Earliest pending due date after refreshed_on",
+                        null=True,
+                    ),
+                ),
+                ("refreshed_on", models.DateField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
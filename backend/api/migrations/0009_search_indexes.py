@@ -0,0 +1,92 @@
+from django.db import migrations
+
+# Full-text search support for api/search.py.
+# PostgreSQL: pg_trgm + expression GIN indexes.
+# SQLite: external-content FTS5 tables kept in sync by triggers.
+
+VISIT_TSVECTOR = "to_tsvector('english', coalesce(diagnosis, '') || ' ' || coalesce(notes, ''))"
+MESSAGE_TSVECTOR = "to_tsvector('english', text)"
+
+POSTGRES_FORWARDS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS api_patient_name_trgm_idx ON api_patient USING gin (name gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS api_visit_search_idx ON api_visit USING gin ({VISIT_TSVECTOR})",
+    f"CREATE INDEX IF NOT EXISTS api_chatmessage_search_idx ON api_chatmessage USING gin ({MESSAGE_TSVECTOR})",
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS api_patient_name_trgm_idx",
+    "DROP INDEX IF EXISTS api_visit_search_idx",
+    "DROP INDEX IF EXISTS api_chatmessage_search_idx",
+]
+
+# (source table, fts table, content_rowid, indexed columns)
+SQLITE_FTS_SOURCES = [
+    ("api_patient", "api_patient_fts", "rowid", ["name"]),
+    ("api_visit", "api_visit_fts", "rowid", ["diagnosis", "notes"]),
+    ("api_chatmessage", "api_chatmessage_fts", "id", ["text"]),
+]
+
+
+def sqlite_forwards():
+    statements = []
+    for source, fts, rowid, columns in SQLITE_FTS_SOURCES:
+        cols = ", ".join(columns)
+        new_vals = ", ".join(f"new.{c}" for c in columns)
+        old_vals = ", ".join(f"old.{c}" for c in columns)
+        content_rowid = f", content_rowid='{rowid}'" if rowid != "rowid" else ""
+        statements += [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{source}'{content_rowid}, tokenize='unicode61 remove_diacritics 2')",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {source} BEGIN "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.{rowid}, {new_vals}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {source} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.{rowid}, {old_vals}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {source} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.{rowid}, {old_vals}); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.{rowid}, {new_vals}); END",
+            f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+        ]
+    return statements
+
+
+def sqlite_backwards():
+    statements = []
+    for _source, fts, _rowid, _columns in SQLITE_FTS_SOURCES:
+        statements += [f"DROP TRIGGER IF EXISTS {fts}_{suffix}" for suffix in ("ai", "ad", "au")]
+        statements.append(f"DROP TABLE IF EXISTS {fts}")
+    return statements
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        statements = POSTGRES_FORWARDS
+    elif vendor == "sqlite":
+        statements = sqlite_forwards()
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        statements = POSTGRES_BACKWARDS
+    elif vendor == "sqlite":
+        statements = sqlite_backwards()
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_patientsummary"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
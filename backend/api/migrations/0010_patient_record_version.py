@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-17 01:25
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="patient",
+            name="record_version",
+            field=models.UUIDField(
+                default=uuid.uuid4,
+                editable=False,
+                help_text="Opaque token replaced whenever the patient's record changes",
+            ),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 6.0.1 on 2026-10-17 01:27
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def seed_stats(apps, schema_editor):
+    # Seed counters and daily buckets from existing rows so the dashboard
+    # keeps its numbers; signals maintain them from here on.
+    Patient = apps.get_model("api", "Patient")
+    Visit = apps.get_model("api", "Visit")
+    ClinicCounter = apps.get_model("api", "ClinicCounter")
+    DailyStat = apps.get_model("api", "DailyStat")
+
+    visit_totals = Visit.objects.aggregate(count=Count("id"), age_sum=Sum("age"))
+    ClinicCounter.objects.bulk_create([
+        ClinicCounter(name="patients", value=Patient.objects.count()),
+        ClinicCounter(name="visits", value=visit_totals["count"]),
+        ClinicCounter(name="visit_age_sum", value=visit_totals["age_sum"] or 0),
+    ])
+
+    buckets = defaultdict(float)
+    for row in Visit.objects.values("date", "visit_type").annotate(n=Count("id")).order_by():
+        buckets[(row["date"], "visits", "")] += row["n"]
+        for tag in (row["visit_type"] or "").split(","):
+            if tag.strip():
+                buckets[(row["date"], "visits_by_type", tag.strip())] += row["n"]
+    days = Patient.objects.annotate(day=TruncDate("created_at")).values("day")
+    for row in days.annotate(n=Count("id")).order_by():
+        buckets[(row["day"], "new_patients", "")] += row["n"]
+    DailyStat.objects.bulk_create(
+        [DailyStat(day=day, metric=metric, key=key, value=value) for (day, metric, key), value in buckets.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_patient_record_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ClinicCounter",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=50, primary_key=True, serialize=False),
+                ),
+                ("value", models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="DailyStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("metric", models.CharField(max_length=50)),
+                ("key", models.CharField(blank=True, default="", max_length=200)),
+                ("value", models.FloatField(default=0)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("metric", "day", "key"),
+                        name="dailystat_metric_day_key_uniq",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(seed_stats, migrations.RunPython.noop),
+    ]
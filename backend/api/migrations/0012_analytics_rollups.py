@@ -0,0 +1,53 @@
+# Generated by Django 6.0.1 on 2026-10-17 01:28
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def mark_existing_days(apps, schema_editor):
+    # Queue every day that has data so the first rollup_analytics run
+    # builds the analytics buckets for existing records.
+    Patient = apps.get_model("api", "Patient")
+    Visit = apps.get_model("api", "Visit")
+    Vaccination = apps.get_model("api", "Vaccination")
+    PendingRollup = apps.get_model("api", "PendingRollup")
+
+    days = set(Visit.objects.values_list("date", flat=True).distinct())
+    days |= set(Vaccination.objects.filter(given_at__isnull=False).values_list("given_at", flat=True).distinct())
+    days |= set(Patient.objects.values_list("dob", flat=True).distinct())
+    now = timezone.now()
+    PendingRollup.objects.bulk_create(
+        [PendingRollup(day=day, marked_at=now) for day in days], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_cliniccounter_dailystat"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PendingRollup",
+            fields=[
+                ("day", models.DateField(primary_key=True, serialize=False)),
+                ("marked_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="patient",
+            index=models.Index(fields=["dob"], name="patient_dob_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="vaccination",
+            index=models.Index(fields=["given_at"], name="vaccination_given_at_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="visit",
+            index=models.Index(fields=["date"], name="visit_date_idx"),
+        ),
+        migrations.RunPython(mark_existing_days, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.1 on 2026-10-17 01:30
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicate_vaccinations(apps, schema_editor):
+    # Keep one row per (patient, vaccine_name): a Given one if any (latest
+    # given_at first), otherwise the earliest due.
+    Vaccination = apps.get_model("api", "Vaccination")
+    duplicates = (
+        Vaccination.objects.values("patient_id", "vaccine_name")
+        .annotate(n=Count("id")).filter(n__gt=1).order_by()
+    )
+    for dup in duplicates:
+        rows = list(Vaccination.objects.filter(patient_id=dup["patient_id"], vaccine_name=dup["vaccine_name"]))
+        rows.sort(key=lambda v: (v.status != "Given", -(v.given_at.toordinal() if v.given_at else 0), v.due_date))
+        Vaccination.objects.filter(pk__in=[v.pk for v in rows[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_analytics_rollups"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_vaccinations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="vaccination",
+            constraint=models.UniqueConstraint(
+                fields=("patient", "vaccine_name"),
+                name="vaccination_patient_vaccine_uniq",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0.1 on 2026-10-17 01:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_vaccination_patient_vaccine_uniq"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="vaccination",
+            index=models.Index(
+                fields=["status", "due_date", "patient"],
+                name="vaccination_worklist_idx",
+            ),
+        ),
+    ]
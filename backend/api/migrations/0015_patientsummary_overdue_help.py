@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-17 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_vaccination_worklist_idx"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="patientsummary",
+            name="overdue_vaccine_count",
+            field=models.IntegerField(
+                default=0,
+                help_text="Pending or missed vaccines due on or before refreshed_on",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0.1 on 2026-10-17 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_patientsummary_overdue_help"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="vaccination",
+            index=models.Index(
+                fields=["patient", "status", "due_date"],
+                name="vaccination_patient_status_idx",
+            ),
+        ),
+    ]
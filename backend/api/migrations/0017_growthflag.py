@@ -0,0 +1,103 @@
+# Generated by Django 6.0.1 on 2026-10-17 01:44
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0016_vaccination_patient_status_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GrowthFlag",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            (
+                                "weight_crossing",
+                                "Weight-for-age fell across two major percentile lines",
+                            ),
+                            (
+                                "height_crossing",
+                                "Height-for-age fell across two major percentile lines",
+                            ),
+                            ("low_weight_for_height", "Weight-for-height below -2 SD"),
+                            (
+                                "below_target_height",
+                                "Height more than 2 SD below mid-parental target",
+                            ),
+                        ],
+                        max_length=30,
+                    ),
+                ),
+                (
+                    "z_score",
+                    models.FloatField(help_text="Latest z-score for the indicator"),
+                ),
+                (
+                    "reference_z",
+                    models.FloatField(
+                        blank=True,
+                        help_text="Earlier peak z-score or mid-parental target z-score",
+                        null=True,
+                    ),
+                ),
+                (
+                    "detected_on",
+                    models.DateField(
+                        help_text="Date of the visit that raised the flag"
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "patient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="growth_flags",
+                        to="api.patient",
+                    ),
+                ),
+                (
+                    "visit",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="growth_flags",
+                        to="api.visit",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["kind", "-detected_on"],
+                        name="growthflag_kind_detected_idx",
+                    ),
+                    models.Index(
+                        fields=["-detected_on"], name="growthflag_detected_idx"
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("patient", "kind"), name="growthflag_patient_kind_uniq"
+                    )
+                ],
+            },
+        ),
+    ]
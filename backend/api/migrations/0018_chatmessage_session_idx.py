@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-17 01:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0017_growthflag"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=models.Index(
+                fields=["session", "timestamp"], name="chatmessage_session_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+import importlib
+
+from django.db import migrations
+
+# On SQLite, 0010's AddField rebuilds api_patient (create new table, copy,
+# drop, rename), and dropping the old table drops the FTS triggers 0009
+# created on it, so new and edited patients never reached api_patient_fts.
+# Re-running 0009's statements recreates whatever triggers are missing
+# (they are all IF NOT EXISTS) and rebuilds the FTS tables from their
+# sources. Any later migration that rebuilds api_patient, api_visit or
+# api_chatmessage on SQLite needs the same step after it.
+
+search_indexes = importlib.import_module("api.migrations.0009_search_indexes")
+
+
+def restore_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in search_indexes.sqlite_forwards():
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0018_chatmessage_session_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+    ]
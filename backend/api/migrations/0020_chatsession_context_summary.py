@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-17 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0019_restore_patient_search_triggers"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatsession",
+            name="context_message_count",
+            field=models.IntegerField(
+                default=0, help_text="Number of leading messages context_summary covers"
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatsession",
+            name="context_summary",
+            field=models.TextField(
+                blank=True,
+                help_text="Summary of the messages before the chat context window",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def reset_session_summaries(apps, schema_editor):
+    # Before stored-message summaries, cached_message_count counted the
+    # client-side history, client-only greeting included, not stored
+    # ChatMessage rows. Read as an offset into the stored messages it skips
+    # real messages or reports a stale summary as current, so existing
+    # summaries are dropped and rebuilt from the stored messages on the
+    # next summary request.
+    ChatSession = apps.get_model("api", "ChatSession")
+    ChatSession.objects.exclude(summary__isnull=True, cached_message_count=0).update(summary=None, cached_message_count=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0020_chatsession_context_summary"),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_session_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+import importlib
+
+from django.db import migrations
+
+# The SQLite FTS tables for patients and visits were keyed on the implicit
+# rowid of their UUID-keyed sources, which VACUUM and table rebuilds
+# renumber. They are replaced by FTS tables over <table>_search copies
+# with an INTEGER PRIMARY KEY and the source UUID (see api/search.py).
+# The chat message index already uses api_chatmessage.id and is kept.
+
+search_indexes = importlib.import_module("api.migrations.0009_search_indexes")
+
+REKEYED = ("api_patient", "api_visit")
+
+
+def drop_statements(tables, triggers):
+    return [f"DROP TRIGGER IF EXISTS {name}" for name in triggers] + [f"DROP TABLE IF EXISTS {name}" for name in tables]
+
+
+def rekey_search_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    from api.search import ensure_sqlite_search
+
+    for source in REKEYED:
+        fts = f"{source}_fts"
+        for statement in drop_statements([fts], [f"{fts}_{suffix}" for suffix in ("ai", "ad", "au")]):
+            schema_editor.execute(statement)
+    ensure_sqlite_search(schema_editor.connection)
+
+
+def restore_rowid_search_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for source in REKEYED:
+        fts, content = f"{source}_fts", f"{source}_search"
+        triggers = [f"{name}_{suffix}" for name in (fts, content) for suffix in ("ai", "ad", "au")]
+        for statement in drop_statements([fts, content], triggers):
+            schema_editor.execute(statement)
+    for statement in search_indexes.sqlite_forwards():
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0021_reset_chat_session_summaries"),
+    ]
+
+    operations = [
+        migrations.RunPython(rekey_search_tables, restore_rowid_search_tables),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from datetime import date
 import uuid
 
 class Patient(models.Model):
@@ -10,10 +11,42 @@ class Patient(models.Model):
     mother_height = models.FloatField(help_text="Height in cm")
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.OneToOneField('auth.User', on_delete=models.SET_NULL, null=True, blank=True, related_name='patient_profile')
+    record_version = models.UUIDField(default=uuid.uuid4, editable=False, help_text="Opaque token replaced whenever the patient's record changes")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='patient_created_idx'),
+            models.Index(fields=['dob'], name='patient_dob_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+class PatientSummary(models.Model):
+    """
+    Denormalized per-patient snapshot of the latest visit and vaccine status,
+    kept current by signals (see api/signals.py) and rebuilt by the
+    rebuild_patient_summaries command.
+    """
+    patient = models.OneToOneField(Patient, primary_key=True, related_name='summary', on_delete=models.CASCADE)
+    last_visit_date = models.DateField(null=True, blank=True)
+    latest_weight = models.FloatField(null=True, blank=True, help_text="Weight in kg")
+    latest_height = models.FloatField(null=True, blank=True, help_text="Height in cm")
+    latest_head_circumference = models.FloatField(null=True, blank=True, help_text="Head Circumference in cm")
+    overdue_vaccine_count = models.IntegerField(default=0, help_text="Pending or missed vaccines due on or before refreshed_on")
+    next_vaccine_due_date = models.DateField(null=True, blank=True, help_text="Earliest pending due date after refreshed_on")
+    refreshed_on = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_stale(self):
+        # The overdue count only changes without a write when a pending
+        # vaccine's due date passes.
+        return self.next_vaccine_due_date is not None and self.next_vaccine_due_date <= date.today()
+
+    def __str__(self):
+        return f"Summary for {self.patient_id}"
+
 class ChatSession(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     patient = models.ForeignKey(Patient, related_name='chat_sessions', on_delete=models.CASCADE)
@@ -22,6 +55,8 @@ class ChatSession(models.Model):
     name = models.CharField(max_length=200, default="New Chat")
     summary = models.TextField(blank=True, null=True)
     cached_message_count = models.IntegerField(default=0)
+    context_summary = models.TextField(blank=True, null=True, help_text="Summary of the messages before the chat context window")
+    context_message_count = models.IntegerField(default=0, help_text="Number of leading messages context_summary covers")
 
     class Meta:
         ordering = ['-updated_at']
@@ -38,6 +73,10 @@ class ChatMessage(models.Model):
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # A session's latest messages, for building chat context
+            models.Index(fields=['session', 'timestamp'], name='chatmessage_session_idx'),
+        ]
 
     def __str__(self):
         return f"{self.session.id} ({self.sender}): {self.text[:30]}"
@@ -61,6 +100,12 @@ class Visit(models.Model):
     prescription = models.TextField(blank=True, null=True)
     follow_up_date = models.DateField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient', '-date'], name='visit_patient_date_idx'),
+            models.Index(fields=['date'], name='visit_date_idx'),
+        ]
+
     def __str__(self):
         return f"{self.patient.name} - {self.date}"
 
@@ -71,6 +116,8 @@ class Vaccination(models.Model):
         ('Given', 'Given'),
         ('Missed', 'Missed'),
     ]
+    # Not given and past due; Missed rows are set by rollover_vaccinations
+    OVERDUE_STATUSES = ['Pending', 'Missed']
     
     patient = models.ForeignKey(Patient, related_name='vaccinations', on_delete=models.CASCADE)
     vaccine_name = models.CharField(max_length=100)
@@ -79,6 +126,16 @@ class Vaccination(models.Model):
     visit = models.ForeignKey(Visit, related_name='given_vaccines', on_delete=models.SET_NULL, null=True, blank=True)
     given_at = models.DateField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['given_at'], name='vaccination_given_at_idx'),
+            models.Index(fields=['status', 'due_date', 'patient'], name='vaccination_worklist_idx'),
+            models.Index(fields=['patient', 'status', 'due_date'], name='vaccination_patient_status_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'vaccine_name'], name='vaccination_patient_vaccine_uniq'),
+        ]
+
     def __str__(self):
         return f"{self.patient.name} - {self.vaccine_name}"
 
@@ -109,3 +166,78 @@ class ScanResult(models.Model):
     def __str__(self):
         return f"Analysis for {self.attachment.name}"
 
+
+class ClinicCounter(models.Model):
+    """
+    Running clinic-wide totals (patients, visits, sum of visit ages) kept
+    up to date by signals so the dashboard never aggregates whole tables.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+class DailyStat(models.Model):
+    """
+    One pre-aggregated value per (day, metric, key), e.g.
+    ('2025-01-01', 'visits_by_type', 'Sick') -> 12.
+    """
+    day = models.DateField()
+    metric = models.CharField(max_length=50)
+    key = models.CharField(max_length=200, blank=True, default='')
+    value = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['metric', 'day', 'key'], name='dailystat_metric_day_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.metric}[{self.key}] = {self.value}"
+
+class PendingRollup(models.Model):
+    """
+    A day whose analytics buckets are out of date. Signals add days as
+    visits, vaccinations and patients change; the rollup_analytics command
+    recomputes just those days and removes them.
+    """
+    day = models.DateField(primary_key=True)
+    marked_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.day)
+
+class GrowthFlag(models.Model):
+    """
+    A growth concern found by the screen_growth command for a patient's
+    latest measurements. Each run replaces the flags of the patients it
+    screens.
+    """
+    KIND_CHOICES = [
+        ('weight_crossing', 'Weight-for-age fell across two major percentile lines'),
+        ('height_crossing', 'Height-for-age fell across two major percentile lines'),
+        ('low_weight_for_height', 'Weight-for-height below -2 SD'),
+        ('below_target_height', 'Height more than 2 SD below mid-parental target'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    patient = models.ForeignKey(Patient, related_name='growth_flags', on_delete=models.CASCADE)
+    visit = models.ForeignKey(Visit, related_name='growth_flags', on_delete=models.SET_NULL, null=True, blank=True)
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    z_score = models.FloatField(help_text="Latest z-score for the indicator")
+    reference_z = models.FloatField(null=True, blank=True, help_text="Earlier peak z-score or mid-parental target z-score")
+    detected_on = models.DateField(help_text="Date of the visit that raised the flag")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'kind'], name='growthflag_patient_kind_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', '-detected_on'], name='growthflag_kind_detected_idx'),
+            models.Index(fields=['-detected_on'], name='growthflag_detected_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient.name}: {self.kind}"
@@ -0,0 +1,47 @@
+import base64
+import json
+
+from rest_framework.pagination import CursorPagination
+
+
+class PatientCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the compact patient list.
+    Pages are addressed by an opaque cursor on (created_at, id) so every page
+    costs the same index range scan regardless of how deep the client pages.
+    """
+    page_size = 50
+    page_size_query_param = 'limit'
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the position dict, or None for a missing or malformed cursor."""
+    if not cursor:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+
+
+def iter_pk_chunks(queryset, fields, batch_size):
+    """
+    Yields `queryset` as lists of `fields` tuples, `batch_size` rows at a
+    time, walking pk order with keyset pagination so every chunk is an
+    index range scan. `fields` must start with 'pk'.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        batch = queryset.filter(pk__gt=last_pk) if last_pk else queryset
+        chunk = list(batch.values_list(*fields)[:batch_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1][0]
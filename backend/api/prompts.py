@@ -48,6 +48,12 @@ The user has uploaded a medical scan.
 3. If there are concerning findings, advise seeing a specialist.
 """
 
+EARLIER_CONVERSATION_CONTEXT = """
+
+**EARLIER IN THIS CONVERSATION** (summarized; the most recent messages follow verbatim):
+{summary}
+"""
+
 SCAN_ANALYSIS_PROMPT = "Analyze this medical scan. Identify the modality (X-Ray, MRI, CT, etc.), allow detailed findings, and an overall impression. Output ONLY JSON."
 
 SCAN_JSON_FORMAT_PROMPT = "Return JSON with keys: 'modality', 'findings', 'impression'. Do not use markdown."
@@ -0,0 +1,86 @@
+import uuid
+from datetime import date, timedelta
+
+from django.conf import settings
+
+from .constants import VACCINE_SCHEDULE_DATA
+from .models import Vaccination
+
+# The vaccination schedule compiled once into in-memory tables.
+#
+# With VACCINATION_STORAGE = 'sparse' the schedule is not materialized per
+# patient: only exceptions (given, ad-hoc, or otherwise edited rows) are
+# stored, and every scheduled vaccine without a stored row is derived on
+# read from the patient's dob. Derived entries get a stable id so the API
+# output has the same shape as in 'dense' mode.
+
+SCHEDULE_GROUPS = tuple(
+    (timedelta(days=item['age_days']), tuple(item['vaccines']))
+    for item in VACCINE_SCHEDULE_DATA
+)
+SCHEDULE = tuple((name, offset) for offset, names in SCHEDULE_GROUPS for name in names)
+SCHEDULE_OFFSETS = dict(SCHEDULE)
+
+
+def sparse_storage():
+    return settings.VACCINATION_STORAGE == 'sparse'
+
+
+def derived_status(due_date, today):
+    # Same cut-off rollover_vaccinations applies to stored rows. Derived
+    # entries are never rolled over, so the setting is the only grace
+    # period in sparse mode (rollover_vaccinations rejects --grace-days).
+    cutoff = today - timedelta(days=settings.VACCINATION_MISSED_GRACE_DAYS)
+    return 'Missed' if due_date < cutoff else 'Pending'
+
+
+def derived_vaccination_id(patient_id, vaccine_name):
+    return uuid.uuid5(uuid.UUID(str(patient_id)), vaccine_name)
+
+
+def merge_schedule(patient_id, dob, stored, today=None):
+    """
+    A patient's full vaccination list: stored rows in place of their
+    scheduled entries, derived unsaved rows for the rest (schedule order),
+    then stored ad-hoc rows.
+    """
+    today = today or date.today()
+    by_name = {v.vaccine_name: v for v in stored}
+    merged = []
+    for name, offset in SCHEDULE:
+        vaccination = by_name.pop(name, None)
+        if vaccination is None:
+            due_date = dob + offset
+            vaccination = Vaccination(
+                id=derived_vaccination_id(patient_id, name),
+                patient_id=patient_id,
+                vaccine_name=name,
+                due_date=due_date,
+                status=derived_status(due_date, today)
+            )
+        merged.append(vaccination)
+    merged.extend(by_name.values())
+    return merged
+
+
+def patient_vaccinations(patient, today=None):
+    """
+    What the API shows as a patient's vaccinations. Uses the (possibly
+    prefetched) patient.vaccinations either way.
+    """
+    stored = list(patient.vaccinations.all())
+    if not sparse_storage():
+        return stored
+    return merge_schedule(patient.pk, patient.dob, stored, today)
+
+
+def due_state(vaccinations, today):
+    """(overdue count, next pending due date after today) for a list of rows."""
+    overdue = 0
+    next_due = None
+    for v in vaccinations:
+        if v.status in Vaccination.OVERDUE_STATUSES and v.due_date <= today:
+            overdue += 1
+        elif v.status == 'Pending' and v.due_date > today and (next_due is None or v.due_date < next_due):
+            next_due = v.due_date
+    return overdue, next_due
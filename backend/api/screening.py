@@ -0,0 +1,142 @@
+import numpy as np
+from django.db import transaction
+
+from .growth import growth_zscores
+from .models import GrowthFlag, Patient, Visit
+from .pagination import iter_pk_chunks
+
+# Clinic-wide growth faltering screen.
+#
+# Patients are screened a chunk at a time: one query for the chunk's
+# visits, one vectorized z-score pass over all of them, and per-patient
+# reductions done with grouped NumPy operations instead of Python loops
+# over visits. Only the chunk is ever held in memory.
+
+# Major percentile lines (2nd, 9th, 25th, 50th, 75th, 91st, 98th) in z.
+PERCENTILE_LINES = np.array([-2, -4 / 3, -2 / 3, 0, 2 / 3, 4 / 3, 2])
+
+# WHO 2007 growth reference height at 19 years (median cm, SD cm), used to
+# express parental heights as z-scores for the mid-parental target.
+ADULT_HEIGHT = {'Male': (176.5, 7.2), 'Female': (163.2, 6.9)}
+
+# WHO cut-offs for biologically implausible z-scores (low, high). Scores
+# outside them are data-entry errors (weight typed in grams, height in
+# mm) and are treated as missing, so they never become a peak or a
+# latest value.
+IMPLAUSIBLE_Z = {'wfa': (-6, 5), 'hfa': (-6, 6), 'wfh': (-5, 5)}
+
+# Keeps each patient's running maximum separate in one global accumulate;
+# plausible z-scores stay well inside each patient's band.
+_GROUP_STRIDE = 1000.0
+_MISSING = -100.0
+
+PATIENT_FIELDS = ('pk', 'dob', 'gender', 'father_height', 'mother_height')
+VISIT_FIELDS = ('patient_id', 'pk', 'date', 'weight', 'height')
+
+
+def iter_patient_chunks(batch_size=2000):
+    """Keyset chunks of PATIENT_FIELDS tuples, ordered by pk."""
+    return iter_pk_chunks(Patient.objects.all(), PATIENT_FIELDS, batch_size)
+
+
+def _latest_valid(values, starts):
+    """Index of each group's last non-NaN value, -1 if it has none."""
+    positions = np.where(np.isnan(values), -1, np.arange(len(values)))
+    latest = np.maximum.reduceat(positions, starts)
+    return np.where(latest >= starts, latest, -1)
+
+
+def _drop_implausible(scores):
+    """`scores` with values outside IMPLAUSIBLE_Z replaced by NaN."""
+    plausible = {}
+    for indicator, z in scores.items():
+        low, high = IMPLAUSIBLE_Z.get(indicator, (-np.inf, np.inf))
+        plausible[indicator] = np.where((z < low) | (z > high), np.nan, z)
+    return plausible
+
+
+def _running_peak(values, group):
+    """Running maximum of `values` restarting at every group."""
+    shifted = np.where(np.isnan(values), _MISSING, values) + group * _GROUP_STRIDE
+    peak = np.maximum.accumulate(shifted) - group * _GROUP_STRIDE
+    return np.where(peak <= _MISSING, np.nan, peak)
+
+
+def _target_z(genders, father_heights, mother_heights):
+    def parent_z(heights, sex):
+        mean, sd = ADULT_HEIGHT[sex]
+        heights = np.array([h or np.nan for h in heights], dtype=float)
+        return (heights - mean) / sd
+    return (parent_z(father_heights, 'Male') + parent_z(mother_heights, 'Female')) / 2
+
+
+def screen_chunk(patients):
+    """
+    Growth flags for a chunk of PATIENT_FIELDS tuples, based on each
+    patient's latest valid measurement. Returns unsaved GrowthFlag rows.
+    """
+    info = {row[0]: row for row in patients}
+    rows = list(
+        Visit.objects.filter(patient_id__in=info)
+        .order_by('patient_id', 'date').values_list(*VISIT_FIELDS)
+    )
+    if not rows:
+        return []
+
+    patient_col, visit_ids, dates, weight, height = zip(*rows)
+    starts = np.array([0] + [i for i in range(1, len(rows)) if patient_col[i] != patient_col[i - 1]])
+    ends = np.append(starts[1:], len(rows))
+    group = np.repeat(np.arange(len(starts)), ends - starts)
+    owners = [info[patient_col[i]] for i in starts]
+
+    sex = np.array([owners[g][2] for g in group])
+    age_days = np.array([(day - owners[g][1]).days for g, day in zip(group, dates)])
+    to_array = lambda values: np.array([np.nan if v is None else v for v in values], dtype=float)
+    scores = _drop_implausible(growth_zscores(sex, age_days, weight=to_array(weight), height=to_array(height)))
+
+    flags = []
+
+    def add(kind, idx, z, reference):
+        for g in np.flatnonzero(idx >= 0):
+            i = idx[g]
+            flags.append(GrowthFlag(
+                patient_id=owners[g][0],
+                visit_id=visit_ids[i],
+                kind=kind,
+                z_score=round(float(z[g]), 2),
+                reference_z=None if reference is None or np.isnan(reference[g]) else round(float(reference[g]), 2),
+                detected_on=dates[i],
+            ))
+
+    # Falls across two or more major percentile lines from the earlier peak
+    for kind, indicator in (('weight_crossing', 'wfa'), ('height_crossing', 'hfa')):
+        z = scores[indicator]
+        latest = _latest_valid(z, starts)
+        peak = _running_peak(z, group)
+        safe = np.maximum(latest, 0)
+        latest_z = np.where(latest >= 0, z[safe], np.nan)
+        peak_z = np.where(latest >= 0, peak[safe], np.nan)
+        crossed = (
+            np.searchsorted(PERCENTILE_LINES, np.nan_to_num(peak_z, nan=-np.inf))
+            - np.searchsorted(PERCENTILE_LINES, np.nan_to_num(latest_z, nan=np.inf))
+        )
+        add(kind, np.where(crossed >= 2, latest, -1), latest_z, peak_z)
+
+    # Wasting
+    latest = _latest_valid(scores['wfh'], starts)
+    wfh = np.where(latest >= 0, scores['wfh'][np.maximum(latest, 0)], np.nan)
+    add('low_weight_for_height', np.where(wfh < -2, latest, -1), wfh, None)
+
+    # Height far below the mid-parental target
+    latest = _latest_valid(scores['hfa'], starts)
+    hfa = np.where(latest >= 0, scores['hfa'][np.maximum(latest, 0)], np.nan)
+    target = _target_z([o[2] for o in owners], [o[3] for o in owners], [o[4] for o in owners])
+    add('below_target_height', np.where(hfa - target < -2, latest, -1), hfa, target)
+
+    return flags
+
+
+def replace_flags(patient_ids, flags):
+    with transaction.atomic():
+        GrowthFlag.objects.filter(patient_id__in=patient_ids).delete()
+        GrowthFlag.objects.bulk_create(flags, batch_size=1000)
@@ -0,0 +1,268 @@
+import re
+import uuid
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Patient, Visit, ChatMessage
+
+# Search over patients, visits and chat messages.
+#
+# PostgreSQL: expression GIN indexes (pg_trgm on Patient.name, full-text on
+# Visit diagnosis/notes and ChatMessage.text) created by migration 0009.
+# SQLite: external-content FTS5 tables kept in sync by triggers (see
+# below). Other backends fall back to icontains scans.
+# The tsvector expressions below must match the indexed ones exactly.
+#
+# FTS5 rows are keyed by an INTEGER column. api_chatmessage has one, so
+# its FTS table reads the messages directly. The UUID-keyed tables are
+# copied by triggers into <table>_search, an ordinary table with an
+# INTEGER PRIMARY KEY for the FTS rows and the source UUID in source_id,
+# so nothing depends on the implicit rowid of the source (VACUUM and
+# table rebuilds renumber it). Rebuilding a table on SQLite also drops its
+# triggers; ensure_sqlite_search() puts them back after every migrate.
+
+SEARCH_TYPES = ('patient', 'visit', 'message')
+
+VISIT_TSVECTOR = "to_tsvector('english', coalesce(diagnosis, '') || ' ' || coalesce(notes, ''))"
+MESSAGE_TSVECTOR = "to_tsvector('english', text)"
+
+# (source table, indexed columns, copied into <source>_search)
+SQLITE_FTS_SOURCES = [
+    ('api_patient', ('name',), True),
+    ('api_visit', ('diagnosis', 'notes'), True),
+    ('api_chatmessage', ('text',), False),
+]
+
+
+def _sqlite_schema(source, columns, copied):
+    """(name, CREATE statement) for each SQLite object searching `source` needs."""
+    fts = f"{source}_fts"
+    content = f"{source}_search" if copied else source
+    cols = ", ".join(columns)
+    new_vals = ", ".join(f"new.{c}" for c in columns)
+    old_vals = ", ".join(f"old.{c}" for c in columns)
+    schema = []
+    if copied:
+        assignments = ", ".join(f"{c} = new.{c}" for c in columns)
+        schema += [
+            (content, f"CREATE TABLE IF NOT EXISTS {content} (id INTEGER PRIMARY KEY, source_id char(32) NOT NULL UNIQUE, {cols})"),
+            (f"{content}_ai", f"CREATE TRIGGER IF NOT EXISTS {content}_ai AFTER INSERT ON {source} BEGIN "
+                              f"INSERT INTO {content}(source_id, {cols}) VALUES (new.id, {new_vals}); END"),
+            (f"{content}_ad", f"CREATE TRIGGER IF NOT EXISTS {content}_ad AFTER DELETE ON {source} BEGIN "
+                              f"DELETE FROM {content} WHERE source_id = old.id; END"),
+            (f"{content}_au", f"CREATE TRIGGER IF NOT EXISTS {content}_au AFTER UPDATE OF {cols} ON {source} BEGIN "
+                              f"UPDATE {content} SET {assignments} WHERE source_id = new.id; END"),
+        ]
+    schema += [
+        (fts, f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{content}', content_rowid='id', "
+              f"tokenize='unicode61 remove_diacritics 2')"),
+        (f"{fts}_ai", f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {content} BEGIN "
+                      f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_vals}); END"),
+        (f"{fts}_ad", f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {content} BEGIN "
+                      f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_vals}); END"),
+        (f"{fts}_au", f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {content} BEGIN "
+                      f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_vals}); "
+                      f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_vals}); END"),
+    ]
+    return schema
+
+
+def _sqlite_sync(source, columns, copied):
+    """Statements bringing the search tables for `source` back in line with it."""
+    fts = f"{source}_fts"
+    if not copied:
+        return [f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"]
+    content = f"{source}_search"
+    cols = ", ".join(columns)
+    refresh = ", ".join(f"{c} = (SELECT s.{c} FROM {source} s WHERE s.id = {content}.source_id)" for c in columns)
+    differs = " OR ".join(f"s.{c} IS NOT {content}.{c}" for c in columns)
+    # Going through the copy's triggers keeps the FTS table in step
+    return [
+        f"DELETE FROM {content} WHERE source_id NOT IN (SELECT id FROM {source})",
+        f"UPDATE {content} SET {refresh} WHERE EXISTS "
+        f"(SELECT 1 FROM {source} s WHERE s.id = {content}.source_id AND ({differs}))",
+        f"INSERT INTO {content}(source_id, {cols}) SELECT id, {cols} FROM {source} "
+        f"WHERE id NOT IN (SELECT source_id FROM {content})",
+    ]
+
+
+def ensure_sqlite_search(conn=connection):
+    """
+    Creates whatever part of the SQLite search schema is missing. A source
+    that was missing any of it is resynced, since writes made while its
+    triggers were gone never reached the index.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        existing = {name for name, in cursor.fetchall()}
+        for source in SQLITE_FTS_SOURCES:
+            missing = [statement for name, statement in _sqlite_schema(*source) if name not in existing]
+            for statement in missing:
+                cursor.execute(statement)
+            if missing:
+                for statement in _sqlite_sync(*source):
+                    cursor.execute(statement)
+
+
+def rebuild_sqlite_fts():
+    """Resyncs every SQLite search table with its source and reindexes it."""
+    ensure_sqlite_search()
+    with connection.cursor() as cursor:
+        for source in SQLITE_FTS_SOURCES:
+            for statement in _sqlite_sync(*source):
+                cursor.execute(statement)
+            fts = f"{source[0]}_fts"
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def _fts5_query(query):
+    # Quote every term so user input can't inject FTS5 syntax; prefix-match
+    # each one so "bronch" finds "bronchiolitis".
+    terms = re.findall(r'\w+', query)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _uuid(value):
+    return str(value if isinstance(value, uuid.UUID) else uuid.UUID(str(value)))
+
+
+def _hit(type_, id_, patient_id, title, snippet, score, **extra):
+    return {
+        'type': type_,
+        'id': str(id_),
+        'patient_id': _uuid(patient_id),
+        'title': title,
+        'snippet': snippet,
+        'score': float(score),
+        **extra,
+    }
+
+
+def _search_sqlite(query, types, limit):
+    match = _fts5_query(query)
+    if not match:
+        return []
+    hits = []
+    with connection.cursor() as cursor:
+        if 'patient' in types:
+            cursor.execute(
+                "SELECT p.id, p.name, p.dob, bm25(api_patient_fts) AS rank "
+                "FROM api_patient_fts JOIN api_patient_search c ON c.id = api_patient_fts.rowid "
+                "JOIN api_patient p ON p.id = c.source_id "
+                "WHERE api_patient_fts MATCH %s ORDER BY rank LIMIT %s",
+                [match, limit]
+            )
+            for id_, name, dob, rank in cursor.fetchall():
+                hits.append(_hit('patient', _uuid(id_), id_, name, f"DOB {dob}", -rank))
+        if 'visit' in types:
+            cursor.execute(
+                "SELECT v.id, v.patient_id, p.name, v.date, "
+                "snippet(api_visit_fts, -1, '**', '**', '…', 16), bm25(api_visit_fts) AS rank "
+                "FROM api_visit_fts JOIN api_visit_search c ON c.id = api_visit_fts.rowid "
+                "JOIN api_visit v ON v.id = c.source_id "
+                "JOIN api_patient p ON p.id = v.patient_id "
+                "WHERE api_visit_fts MATCH %s ORDER BY rank LIMIT %s",
+                [match, limit]
+            )
+            for id_, patient_id, name, visit_date, snippet, rank in cursor.fetchall():
+                hits.append(_hit('visit', _uuid(id_), patient_id, f"{name} - {visit_date}", snippet, -rank))
+        if 'message' in types:
+            cursor.execute(
+                "SELECT m.id, s.patient_id, p.name, m.session_id, "
+                "snippet(api_chatmessage_fts, 0, '**', '**', '…', 16), bm25(api_chatmessage_fts) AS rank "
+                "FROM api_chatmessage_fts JOIN api_chatmessage m ON m.id = api_chatmessage_fts.rowid "
+                "JOIN api_chatsession s ON s.id = m.session_id "
+                "JOIN api_patient p ON p.id = s.patient_id "
+                "WHERE api_chatmessage_fts MATCH %s ORDER BY rank LIMIT %s",
+                [match, limit]
+            )
+            for id_, patient_id, name, session_id, snippet, rank in cursor.fetchall():
+                hits.append(_hit('message', id_, patient_id, name, snippet, -rank, session_id=_uuid(session_id)))
+    return hits
+
+
+def _search_postgres(query, types, limit):
+    hits = []
+    with connection.cursor() as cursor:
+        if 'patient' in types:
+            cursor.execute(
+                "SELECT id, name, dob, similarity(name, %s) AS rank FROM api_patient "
+                "WHERE name %% %s OR name ILIKE %s ORDER BY rank DESC LIMIT %s",
+                [query, query, f'%{query}%', limit]
+            )
+            for id_, name, dob, rank in cursor.fetchall():
+                hits.append(_hit('patient', id_, id_, name, f"DOB {dob}", rank))
+        if 'visit' in types:
+            cursor.execute(
+                "SELECT v.id, v.patient_id, p.name, v.date, "
+                "ts_headline('english', coalesce(v.diagnosis, '') || ' ' || coalesce(v.notes, ''), q, "
+                "'StartSel=**, StopSel=**, MaxWords=24, MinWords=8') AS snippet, rank "
+                "FROM (SELECT v.*, ts_rank(" + VISIT_TSVECTOR + ", q) AS rank, q "
+                "      FROM api_visit v, websearch_to_tsquery('english', %s) q "
+                "      WHERE " + VISIT_TSVECTOR + " @@ q ORDER BY rank DESC LIMIT %s) v "
+                "JOIN api_patient p ON p.id = v.patient_id ORDER BY rank DESC",
+                [query, limit]
+            )
+            for id_, patient_id, name, visit_date, snippet, rank in cursor.fetchall():
+                hits.append(_hit('visit', id_, patient_id, f"{name} - {visit_date}", snippet, rank))
+        if 'message' in types:
+            cursor.execute(
+                "SELECT m.id, s.patient_id, p.name, m.session_id, "
+                "ts_headline('english', m.text, q, 'StartSel=**, StopSel=**, MaxWords=24, MinWords=8') AS snippet, rank "
+                "FROM (SELECT m.*, ts_rank(" + MESSAGE_TSVECTOR + ", q) AS rank, q "
+                "      FROM api_chatmessage m, websearch_to_tsquery('english', %s) q "
+                "      WHERE " + MESSAGE_TSVECTOR + " @@ q ORDER BY rank DESC LIMIT %s) m "
+                "JOIN api_chatsession s ON s.id = m.session_id "
+                "JOIN api_patient p ON p.id = s.patient_id ORDER BY rank DESC",
+                [query, limit]
+            )
+            for id_, patient_id, name, session_id, snippet, rank in cursor.fetchall():
+                hits.append(_hit('message', id_, patient_id, name, snippet, rank, session_id=_uuid(session_id)))
+    return hits
+
+
+def _search_fallback(query, types, limit):
+    hits = []
+    if 'patient' in types:
+        for p in Patient.objects.filter(name__icontains=query)[:limit]:
+            hits.append(_hit('patient', p.id, p.id, p.name, f"DOB {p.dob}", 0))
+    if 'visit' in types:
+        visits = Visit.objects.filter(Q(diagnosis__icontains=query) | Q(notes__icontains=query)).select_related('patient')
+        for v in visits[:limit]:
+            hits.append(_hit('visit', v.id, v.patient_id, f"{v.patient.name} - {v.date}", v.diagnosis or '', 0))
+    if 'message' in types:
+        messages = ChatMessage.objects.filter(text__icontains=query).select_related('session__patient')
+        for m in messages[:limit]:
+            hits.append(_hit('message', m.id, m.session.patient_id, m.session.patient.name, m.text[:120], 0, session_id=str(m.session_id)))
+    return hits
+
+
+def _normalize_scores(hits):
+    # bm25, similarity and ts_rank are on unrelated scales, so each type is
+    # ranked on its own: scores become a fraction of that type's best hit.
+    best = {}
+    for hit in hits:
+        best[hit['type']] = max(best.get(hit['type'], 0), hit['score'])
+    for hit in hits:
+        if best[hit['type']] > 0:
+            hit['score'] /= best[hit['type']]
+    return hits
+
+
+def search_records(query, types=SEARCH_TYPES, limit=20):
+    """
+    Returns up to `limit` hits per type, merged and ordered by score
+    (higher is better; the best hit of each type scores 1.0). Each hit
+    carries its type, id, patient_id, a title and a highlighted snippet.
+    """
+    query = query.strip()
+    if not query:
+        return []
+    if connection.vendor == 'postgresql':
+        hits = _search_postgres(query, types, limit)
+    elif connection.vendor == 'sqlite':
+        hits = _search_sqlite(query, types, limit)
+    else:
+        hits = _search_fallback(query, types, limit)
+    return sorted(_normalize_scores(hits), key=lambda h: h['score'], reverse=True)
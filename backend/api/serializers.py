@@ -1,5 +1,9 @@
+from django.db import transaction
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import Patient, Visit, Attachment, Vaccination, ScanResult
+from .vaccinations import reconcile_visit_vaccines, batched_record_changes
+from .schedule import patient_vaccinations
 
 class ScanResultSerializer(serializers.ModelSerializer):
     class Meta:
@@ -33,60 +37,19 @@ class VisitSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         vaccines_data = validated_data.pop('vaccines', [])
-        visit = Visit.objects.create(**validated_data)
-        
-        if vaccines_data:
-            if isinstance(vaccines_data, str):
-                vaccines_data = vaccines_data.split(',')
-            
-            for v_name in vaccines_data:
-                v_name = v_name.strip()
-                vac_record = Vaccination.objects.filter(patient=visit.patient, vaccine_name=v_name).first()
-                if vac_record:
-                    vac_record.status = 'Given'
-                    vac_record.visit = visit
-                    vac_record.given_at = visit.date
-                    vac_record.save()
-                else:
-                    Vaccination.objects.create(
-                        patient=visit.patient,
-                        vaccine_name=v_name,
-                        due_date=visit.date,
-                        status='Given',
-                        visit=visit,
-                        given_at=visit.date
-                    )
+        # The visit's and its vaccines' bookkeeping is done once, at the end
+        with transaction.atomic(), batched_record_changes():
+            visit = Visit.objects.create(**validated_data)
+            if vaccines_data:
+                reconcile_visit_vaccines(visit, vaccines_data)
         return visit
 
     def update(self, instance, validated_data):
         vaccines_data = validated_data.pop('vaccines', None)
-        instance = super().update(instance, validated_data)
-
-        if vaccines_data is not None:
-            instance.given_vaccines.update(status='Pending', visit=None, given_at=None)
-
-            if isinstance(vaccines_data, str):
-                vaccines_data = vaccines_data.split(',')
-
-            for v_name in vaccines_data:
-                v_name = v_name.strip()
-                vac_record = Vaccination.objects.filter(patient=instance.patient, vaccine_name=v_name).first()
-                if vac_record:
-                    vac_record.status = 'Given'
-                    vac_record.visit = instance
-                    vac_record.given_at = instance.date
-                    vac_record.save()
-                else:
-                    # Create ad-hoc record
-                    Vaccination.objects.create(
-                        patient=instance.patient,
-                        vaccine_name=v_name,
-                        due_date=instance.date,
-                        status='Given',
-                        visit=instance,
-                        given_at=instance.date
-                    )
-        
+        with transaction.atomic(), batched_record_changes():
+            instance = super().update(instance, validated_data)
+            if vaccines_data is not None:
+                reconcile_visit_vaccines(instance, vaccines_data)
         return instance
 
 class PatientSerializer(serializers.ModelSerializer):
@@ -124,10 +87,42 @@ class PatientSerializer(serializers.ModelSerializer):
              
         return patient
 
+class PatientListItemSerializer(serializers.ModelSerializer):
+    """
+    Compact row for the patient list, read from the denormalized
+    PatientSummary so no per-row queries are issued.
+    """
+    last_visit_date = serializers.DateField(source='summary.last_visit_date', read_only=True)
+    latest_weight = serializers.FloatField(source='summary.latest_weight', read_only=True)
+    latest_height = serializers.FloatField(source='summary.latest_height', read_only=True)
+    latest_head_circumference = serializers.FloatField(source='summary.latest_head_circumference', read_only=True)
+    pending_vaccine_count = serializers.IntegerField(source='summary.overdue_vaccine_count', read_only=True)
+
+    class Meta:
+        model = Patient
+        fields = ['id', 'name', 'dob', 'gender', 'created_at', 'last_visit_date', 'latest_weight', 'latest_height', 'latest_head_circumference', 'pending_vaccine_count']
+
 class PatientDetailSerializer(serializers.ModelSerializer):
     visits = VisitSerializer(many=True, read_only=True)
-    vaccinations = VaccinationSerializer(many=True, read_only=True)
+    vaccinations = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Patient
         fields = ['id', 'name', 'dob', 'gender', 'father_height', 'mother_height', 'created_at', 'visits', 'vaccinations']
+
+    def get_vaccinations(self, obj):
+        # Includes the derived schedule entries in sparse storage mode
+        return VaccinationSerializer(patient_vaccinations(obj), many=True).data
+
+    @staticmethod
+    def prefetch_lookups():
+        """
+        Everything the nested serializers touch, loaded in a fixed number of
+        queries: visits (oldest first), their attachments joined with
+        scan_analysis, their given vaccines, and the patient's vaccinations.
+        """
+        visits = Visit.objects.order_by('date').prefetch_related(
+            Prefetch('attachments', queryset=Attachment.objects.select_related('scan_analysis')),
+            'given_vaccines',
+        )
+        return [Prefetch('visits', queryset=visits), 'vaccinations']
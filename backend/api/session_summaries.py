@@ -0,0 +1,94 @@
+import threading
+
+from django.conf import settings
+from django.db import connections
+
+from .models import ChatSession
+from .utils import summarize_messages, asummarize_messages
+
+# Rolling chat session summaries.
+#
+# ChatSession.summary covers the session's first cached_message_count
+# stored messages; bringing it up to date only summarizes the messages
+# after that, with INCREMENTAL_SUMMARY_TEMPLATE. Every AI message schedules
+# that update in the background, debounced per session by
+# CHAT_SUMMARY_DEBOUNCE_SECONDS, so by the time a doctor asks for the
+# summary it is usually already current.
+
+DEFAULT_SUMMARY_MODEL = "gemini-flash-latest"
+
+
+def _pending(session):
+    first = session.cached_message_count if session.summary else 0
+    messages = session.messages.order_by('timestamp', 'id').values_list('sender', 'text')[first:]
+    return first, messages
+
+
+def _saved(session):
+    # Only moves the summary forward from what this update started from; a
+    # concurrent update that got there first wins.
+    return ChatSession.objects.filter(pk=session.pk, cached_message_count=session.cached_message_count)
+
+
+def summarize_session(session, model=DEFAULT_SUMMARY_MODEL):
+    """
+    Brings the session summary up to date with its stored messages and
+    returns it. None if the session has no messages.
+    """
+    first, pending = _pending(session)
+    new_messages = [{'role': sender, 'text': text} for sender, text in pending]
+    if not new_messages:
+        return session.summary
+    summary = summarize_messages(session.summary if first else None, new_messages, session.patient_id, model=model)
+    count = first + len(new_messages)
+    _saved(session).update(summary=summary, cached_message_count=count)
+    session.summary, session.cached_message_count = summary, count
+    return summary
+
+
+async def asummarize_session(session, model=DEFAULT_SUMMARY_MODEL):
+    first, pending = _pending(session)
+    new_messages = [{'role': sender, 'text': text} async for sender, text in pending]
+    if not new_messages:
+        return session.summary
+    summary = await asummarize_messages(session.summary if first else None, new_messages, session.patient_id, model=model)
+    count = first + len(new_messages)
+    await _saved(session).aupdate(summary=summary, cached_message_count=count)
+    session.summary, session.cached_message_count = summary, count
+    return summary
+
+
+_lock = threading.Lock()
+_timers = {}
+
+
+def schedule_session_summary(session_id):
+    """
+    (Re)starts the session's debounce timer; the summary is updated once
+    no AI message has arrived for CHAT_SUMMARY_DEBOUNCE_SECONDS.
+    """
+    delay = settings.CHAT_SUMMARY_DEBOUNCE_SECONDS
+    if delay <= 0:
+        return
+    with _lock:
+        timer = _timers.pop(session_id, None)
+        if timer:
+            timer.cancel()
+        timer = threading.Timer(delay, _run_scheduled_summary, args=(session_id,))
+        timer.daemon = True
+        _timers[session_id] = timer
+        timer.start()
+
+
+def _run_scheduled_summary(session_id):
+    with _lock:
+        if _timers.get(session_id) is threading.current_thread():
+            del _timers[session_id]
+    try:
+        session = ChatSession.objects.filter(pk=session_id).first()
+        if session:
+            summarize_session(session)
+    except Exception as e:
+        print(f"Background Summary Error: {e}")
+    finally:
+        connections.close_all()
@@ -1,19 +1,178 @@
-from django.db.models.signals import post_save
+import uuid
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
 from django.dispatch import receiver
-from datetime import timedelta
-from .models import Patient, Vaccination
-from .constants import VACCINE_SCHEDULE_DATA
+from django.utils import timezone
+from .models import Patient, Visit, Vaccination, Attachment, ScanResult, ChatSession, ChatMessage
+from .summaries import refresh_patient_summary
+from .cache import bump_patient_version
+from .clinical_context import invalidate_clinical_context
+from .stats import record_visit, record_patient
+from .analytics import mark_days_dirty
+from .session_summaries import schedule_session_summary
+from .vaccinations import schedule_rows, defer_record_changes
+from .search import ensure_sqlite_search
 
 @receiver(post_save, sender=Patient)
 def create_vaccination_schedule(sender, instance, created, **kwargs):
     if created:
-        vaccinations = []
-        for item in VACCINE_SCHEDULE_DATA:
-            due_date = instance.dob + timedelta(days=item['age_days'])
-            for v_name in item['vaccines']:
-                vaccinations.append(Vaccination(
-                    patient=instance,
-                    vaccine_name=v_name,
-                    due_date=due_date
-                ))
-        Vaccination.objects.bulk_create(vaccinations)
+        Vaccination.objects.bulk_create(schedule_rows(instance.pk, instance.dob))
+        # bulk_create skips the Vaccination signals below
+        refresh_patient_summary(instance.pk)
+
+@receiver(post_save, sender=Visit)
+@receiver(post_save, sender=Vaccination)
+def update_patient_summary(sender, instance, **kwargs):
+    if defer_record_changes([instance.patient_id]):
+        return
+    refresh_patient_summary(instance.patient_id)
+
+@receiver(post_delete, sender=Visit)
+@receiver(post_delete, sender=Vaccination)
+def update_patient_summary_on_delete(sender, instance, origin=None, **kwargs):
+    # Deleting the patient cascades here; its summary is going away too.
+    if isinstance(origin, Patient) or defer_record_changes([instance.patient_id]):
+        return
+    refresh_patient_summary(instance.patient_id)
+
+@receiver(pre_save, sender=Patient)
+def replace_record_version(sender, instance, **kwargs):
+    instance.record_version = uuid.uuid4()
+
+@receiver(post_save, sender=Visit)
+@receiver(post_save, sender=Vaccination)
+@receiver(post_delete, sender=Visit)
+@receiver(post_delete, sender=Vaccination)
+def invalidate_patient_record(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Patient) or defer_record_changes([instance.patient_id]):
+        return
+    bump_patient_version(pk=instance.patient_id)
+
+@receiver(post_save, sender=Visit)
+@receiver(post_save, sender=Vaccination)
+@receiver(post_delete, sender=Visit)
+@receiver(post_delete, sender=Vaccination)
+def invalidate_patient_clinical_context(sender, instance, **kwargs):
+    if defer_record_changes([instance.patient_id]):
+        return
+    invalidate_clinical_context(instance.patient_id)
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def invalidate_clinical_context_for_patient(sender, instance, **kwargs):
+    invalidate_clinical_context(instance.pk)
+
+@receiver(post_save, sender=Attachment)
+@receiver(post_delete, sender=Attachment)
+def invalidate_patient_record_for_attachment(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Patient) or not instance.visit_id:
+        return
+    bump_patient_version(visits=instance.visit_id)
+
+@receiver(post_save, sender=ScanResult)
+@receiver(post_delete, sender=ScanResult)
+def invalidate_patient_record_for_scan(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Patient):
+        return
+    bump_patient_version(visits__attachments=instance.attachment_id)
+
+@receiver(post_save, sender=ChatMessage)
+def touch_chat_session(sender, instance, created, **kwargs):
+    # Keeps ChatSession.updated_at at the last activity, which orders the
+    # session list and validates its conditional GETs.
+    if created:
+        ChatSession.objects.filter(pk=instance.session_id).update(updated_at=timezone.now())
+
+@receiver(post_save, sender=ChatMessage)
+def summarize_chat_session(sender, instance, created, **kwargs):
+    # Once the reply is committed, so the background job can see it
+    if created and instance.sender == 'ai':
+        transaction.on_commit(lambda: schedule_session_summary(instance.session_id))
+
+@receiver(post_save, sender=ScanResult)
+@receiver(post_delete, sender=ScanResult)
+def touch_chat_sessions_for_scan(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, (Patient, ChatSession)):
+        return
+    ChatSession.objects.filter(
+        Q(attachments=instance.attachment_id) | Q(messages__attachment=instance.attachment_id)
+    ).update(updated_at=timezone.now())
+
+@receiver(pre_save, sender=Visit)
+def remember_visit_stats(sender, instance, **kwargs):
+    # UUID primary keys are set before the first save, so ask the state.
+    instance._stats_previous = None
+    if not instance._state.adding:
+        instance._stats_previous = Visit.objects.filter(pk=instance.pk).values_list('date', 'age', 'visit_type').first()
+
+@receiver(post_save, sender=Visit)
+def update_visit_stats(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_stats_previous', None)
+    current = (instance.date, instance.age, instance.visit_type)
+    if previous and previous != current:
+        record_visit(*previous, sign=-1)
+    if created or (previous and previous != current):
+        record_visit(*current)
+
+@receiver(post_delete, sender=Visit)
+def remove_visit_stats(sender, instance, **kwargs):
+    record_visit(instance.date, instance.age, instance.visit_type, sign=-1)
+
+@receiver(post_save, sender=Patient)
+def update_patient_stats(sender, instance, created, **kwargs):
+    if created:
+        record_patient(instance.created_at)
+
+@receiver(post_delete, sender=Patient)
+def remove_patient_stats(sender, instance, **kwargs):
+    record_patient(instance.created_at, sign=-1)
+
+@receiver(pre_save, sender=Vaccination)
+def remember_vaccination_given_at(sender, instance, **kwargs):
+    instance._previous_given_at = None
+    if not instance._state.adding:
+        instance._previous_given_at = Vaccination.objects.filter(pk=instance.pk).values_list('given_at', flat=True).first()
+
+@receiver(pre_save, sender=Patient)
+def remember_patient_dob(sender, instance, **kwargs):
+    instance._previous_dob = None
+    if not instance._state.adding:
+        instance._previous_dob = Patient.objects.filter(pk=instance.pk).values_list('dob', flat=True).first()
+
+@receiver(post_save, sender=Visit)
+@receiver(post_delete, sender=Visit)
+def mark_visit_days_dirty(sender, instance, **kwargs):
+    previous = getattr(instance, '_stats_previous', None)
+    days = (instance.date, previous[0] if previous else None)
+    if not defer_record_changes([], days):
+        mark_days_dirty(*days)
+
+@receiver(post_save, sender=Vaccination)
+@receiver(post_delete, sender=Vaccination)
+def mark_vaccination_days_dirty(sender, instance, **kwargs):
+    days = (instance.given_at, getattr(instance, '_previous_given_at', None))
+    if not defer_record_changes([], days):
+        mark_days_dirty(*days)
+
+@receiver(post_save, sender=Patient)
+def refresh_summary_on_dob_change(sender, instance, created, **kwargs):
+    # Derived (sparse) schedule entries move with the dob
+    previous = getattr(instance, '_previous_dob', None)
+    if not created and previous and previous != instance.dob:
+        refresh_patient_summary(instance.pk)
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def mark_patient_days_dirty(sender, instance, **kwargs):
+    mark_days_dirty(instance.dob, getattr(instance, '_previous_dob', None))
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    # Rebuilding a table on SQLite drops its triggers, including the ones
+    # that keep the search tables in step; put back whatever is missing.
+    connection = connections[using]
+    if sender.name != 'api' or connection.vendor != 'sqlite':
+        return
+    if 'api_patient_search' in connection.introspection.table_names():
+        ensure_sqlite_search(connection)
@@ -0,0 +1,178 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import transaction, IntegrityError
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ClinicCounter, DailyStat, Patient, Visit
+
+# Incremental clinic statistics.
+#
+# ClinicCounter holds running totals and DailyStat holds per-day buckets.
+# Signals in api/signals.py apply +1/-1 deltas on create/update/delete; the
+# rebuild_stats command recomputes both from the source tables.
+#
+# Visit counts include the registration ('Initial') visit, as the dashboard
+# always has; api/analytics.py subtracts it using the visits_by_type bucket.
+
+PATIENTS = 'patients'
+VISITS = 'visits'
+VISIT_AGE_SUM = 'visit_age_sum'
+
+DAILY_VISITS = 'visits'
+DAILY_NEW_PATIENTS = 'new_patients'
+DAILY_VISITS_BY_TYPE = 'visits_by_type'
+# Vaccinations rollover_vaccinations moved to Missed, by run date. Written
+# by the job itself, not rebuilt from source tables.
+DAILY_MISSED_ROLLOVER = 'missed_rollover'
+
+SIGNAL_METRICS = [DAILY_VISITS, DAILY_NEW_PATIENTS, DAILY_VISITS_BY_TYPE]
+
+
+def visit_type_tags(visit_type):
+    # visit_type holds the form's tags joined with ", "
+    return [tag.strip() for tag in (visit_type or '').split(',') if tag.strip()]
+
+
+def _increment(model, lookup, delta):
+    """
+    Adds `delta` to model.value for the row matching `lookup`, creating it
+    if needed. Safe under concurrent writers.
+    """
+    if model.objects.filter(**lookup).update(value=F('value') + delta):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(value=delta, **lookup)
+    except IntegrityError:
+        model.objects.filter(**lookup).update(value=F('value') + delta)
+
+
+def record_visit(day, age, visit_type, sign=1):
+    with transaction.atomic():
+        _increment(ClinicCounter, {'name': VISITS}, sign)
+        _increment(ClinicCounter, {'name': VISIT_AGE_SUM}, sign * (age or 0))
+        _increment(DailyStat, {'day': day, 'metric': DAILY_VISITS, 'key': ''}, sign)
+        for tag in visit_type_tags(visit_type):
+            _increment(DailyStat, {'day': day, 'metric': DAILY_VISITS_BY_TYPE, 'key': tag}, sign)
+
+
+def record_patient(created_at, sign=1):
+    with transaction.atomic():
+        _increment(ClinicCounter, {'name': PATIENTS}, sign)
+        _increment(DailyStat, {'day': timezone.localdate(created_at), 'metric': DAILY_NEW_PATIENTS, 'key': ''}, sign)
+
+
+def record_patient_batch(created_ats):
+    """record_patient for rows written with bulk_create, one update per day."""
+    days = Counter(timezone.localdate(created_at) for created_at in created_ats)
+    if not days:
+        return
+    with transaction.atomic():
+        _increment(ClinicCounter, {'name': PATIENTS}, sum(days.values()))
+        for day, count in days.items():
+            _increment(DailyStat, {'day': day, 'metric': DAILY_NEW_PATIENTS, 'key': ''}, count)
+
+
+def record_visit_batch(visits):
+    """record_visit for rows written with bulk_create, one update per bucket."""
+    buckets = Counter()
+    age_sum = 0
+    for visit in visits:
+        age_sum += visit.age or 0
+        buckets[(visit.date, DAILY_VISITS, '')] += 1
+        for tag in visit_type_tags(visit.visit_type):
+            buckets[(visit.date, DAILY_VISITS_BY_TYPE, tag)] += 1
+    if not buckets:
+        return
+    with transaction.atomic():
+        _increment(ClinicCounter, {'name': VISITS}, len(visits))
+        _increment(ClinicCounter, {'name': VISIT_AGE_SUM}, age_sum)
+        for (day, metric, key), count in buckets.items():
+            _increment(DailyStat, {'day': day, 'metric': metric, 'key': key}, count)
+
+
+def record_missed_rollover(day, changed):
+    _increment(DailyStat, {'day': day, 'metric': DAILY_MISSED_ROLLOVER, 'key': ''}, changed)
+
+
+def get_dashboard_totals():
+    counters = ClinicCounter.objects.in_bulk([PATIENTS, VISITS, VISIT_AGE_SUM])
+    value = lambda name: counters[name].value if name in counters else 0
+    total_visits = int(value(VISITS))
+    return {
+        'total_patients': int(value(PATIENTS)),
+        'total_visits': total_visits,
+        'avg_patient_age': round(value(VISIT_AGE_SUM) / total_visits, 1) if total_visits else 0,
+    }
+
+
+def get_daily_series(metrics, start, end):
+    """
+    Returns {metric: {key: [value per day]}} for start..end inclusive, with
+    missing days filled with zero.
+    """
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    index = {day: i for i, day in enumerate(days)}
+    series = {metric: defaultdict(lambda: [0] * len(days)) for metric in metrics}
+    rows = DailyStat.objects.filter(metric__in=metrics, day__range=(start, end)).values_list('metric', 'key', 'day', 'value')
+    for metric, key, day, value in rows:
+        if value:
+            series[metric][key][index[day]] = int(value) if float(value).is_integer() else value
+    return days, {metric: dict(values) for metric, values in series.items()}
+
+
+def rebuild_counters():
+    visit_totals = Visit.objects.aggregate(count=Count('id'), age_sum=Sum('age'))
+    totals = {
+        PATIENTS: Patient.objects.count(),
+        VISITS: visit_totals['count'],
+        VISIT_AGE_SUM: visit_totals['age_sum'] or 0,
+    }
+    with transaction.atomic():
+        for name, value in totals.items():
+            ClinicCounter.objects.update_or_create(name=name, defaults={'value': value})
+    return totals
+
+
+def compute_signal_buckets(start=None, end=None):
+    """
+    Recomputes the signal-maintained daily buckets from source tables.
+    Returns a list of unsaved DailyStat rows.
+    """
+    visits = Visit.objects.all()
+    patients = Patient.objects.annotate(day=TruncDate('created_at'))
+    if start:
+        visits = visits.filter(date__gte=start)
+        patients = patients.filter(day__gte=start)
+    if end:
+        visits = visits.filter(date__lte=end)
+        patients = patients.filter(day__lte=end)
+
+    buckets = defaultdict(float)
+    for row in visits.values('date', 'visit_type').annotate(n=Count('id')).order_by():
+        buckets[(row['date'], DAILY_VISITS, '')] += row['n']
+        for tag in visit_type_tags(row['visit_type']):
+            buckets[(row['date'], DAILY_VISITS_BY_TYPE, tag)] += row['n']
+    for row in patients.values('day').annotate(n=Count('id')).order_by():
+        buckets[(row['day'], DAILY_NEW_PATIENTS, '')] += row['n']
+
+    return [DailyStat(day=day, metric=metric, key=key, value=value) for (day, metric, key), value in buckets.items()]
+
+
+def replace_daily_buckets(rows, metrics, start=None, end=None, batch_size=1000):
+    """
+    Atomically swaps the stored buckets for `metrics` in [start, end] with
+    `rows`.
+    """
+    existing = DailyStat.objects.filter(metric__in=metrics)
+    if start:
+        existing = existing.filter(day__gte=start)
+    if end:
+        existing = existing.filter(day__lte=end)
+    with transaction.atomic():
+        existing.delete()
+        DailyStat.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
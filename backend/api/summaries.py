@@ -0,0 +1,104 @@
+from datetime import date
+
+from django.db.models import Count, Min, OuterRef, Subquery, IntegerField, DateField
+from django.db.models.functions import Coalesce
+
+from .models import Patient, PatientSummary, Visit, Vaccination
+from .schedule import sparse_storage, merge_schedule, due_state
+
+SUMMARY_FIELDS = [
+    'last_visit_date', 'latest_weight', 'latest_height', 'latest_head_circumference',
+    'overdue_vaccine_count', 'next_vaccine_due_date', 'refreshed_on',
+]
+
+
+def annotate_summary_values(queryset, today=None):
+    """
+    Annotates a Patient queryset with every PatientSummary column using
+    correlated subqueries, so a whole batch is computed in one query.
+    """
+    today = today or date.today()
+    latest_visit = Visit.objects.filter(patient=OuterRef('pk')).order_by('-date')
+    pending = Vaccination.objects.filter(patient=OuterRef('pk'), status='Pending').order_by().values('patient')
+    overdue = Vaccination.objects.filter(patient=OuterRef('pk'), status__in=Vaccination.OVERDUE_STATUSES).order_by().values('patient')
+    overdue_count = overdue.filter(due_date__lte=today).annotate(c=Count('id')).values('c')
+    next_due = pending.filter(due_date__gt=today).annotate(d=Min('due_date')).values('d')
+
+    return queryset.annotate(
+        last_visit_date=Subquery(latest_visit.values('date')[:1]),
+        latest_weight=Subquery(latest_visit.values('weight')[:1]),
+        latest_height=Subquery(latest_visit.values('height')[:1]),
+        latest_head_circumference=Subquery(latest_visit.values('head_circumference')[:1]),
+        overdue_vaccine_count=Coalesce(Subquery(overdue_count, output_field=IntegerField()), 0),
+        next_vaccine_due_date=Subquery(next_due, output_field=DateField()),
+    )
+
+
+def refresh_patient_summaries(patient_ids, today=None):
+    """
+    Recomputes and upserts the summaries for the given patients.
+    Costs two queries per call regardless of how many ids are passed.
+    """
+    today = today or date.today()
+    rows = list(annotate_summary_values(Patient.objects.filter(pk__in=patient_ids), today).values('pk', 'dob', *SUMMARY_FIELDS[:-1]))
+    if sparse_storage():
+        _apply_derived_schedule(rows, today)
+    summaries = [
+        PatientSummary(patient_id=row['pk'], refreshed_on=today, **{field: row[field] for field in SUMMARY_FIELDS[:-1]})
+        for row in rows
+    ]
+    if summaries:
+        PatientSummary.objects.bulk_create(
+            summaries,
+            update_conflicts=True,
+            unique_fields=['patient'],
+            update_fields=SUMMARY_FIELDS + ['updated_at'],
+        )
+    return len(summaries)
+
+
+def _apply_derived_schedule(rows, today):
+    # In sparse storage most schedule entries have no row, so the vaccine
+    # columns are recomputed from the merged schedule (one extra query).
+    stored = {}
+    for vaccination in Vaccination.objects.filter(patient_id__in=[row['pk'] for row in rows]).only('patient_id', 'vaccine_name', 'status', 'due_date'):
+        stored.setdefault(vaccination.patient_id, []).append(vaccination)
+    for row in rows:
+        merged = merge_schedule(row['pk'], row['dob'], stored.get(row['pk'], []), today)
+        row['overdue_vaccine_count'], row['next_vaccine_due_date'] = due_state(merged, today)
+
+
+def refresh_patient_summary(patient_id):
+    return refresh_patient_summaries([patient_id])
+
+
+def ensure_fresh_summaries(patients):
+    """
+    Makes sure each patient in an already-fetched page (loaded with
+    select_related('summary')) has a current summary attached, refreshing
+    missing or stale rows in one batch.
+    """
+    outdated = []
+    for patient in patients:
+        summary = getattr(patient, 'summary', None)
+        if summary is None or summary.is_stale:
+            outdated.append(patient.pk)
+    if outdated:
+        refresh_patient_summaries(outdated)
+        fresh = PatientSummary.objects.in_bulk(outdated)
+        for patient in patients:
+            if patient.pk in fresh:
+                patient.summary = fresh[patient.pk]
+    return patients
+
+
+def get_patient_summary(patient_id):
+    """
+    Returns the current PatientSummary for a patient, refreshing it if it is
+    missing or stale. None if the patient does not exist.
+    """
+    summary = PatientSummary.objects.filter(patient_id=patient_id).first()
+    if summary is None or summary.is_stale:
+        refresh_patient_summary(patient_id)
+        summary = PatientSummary.objects.filter(patient_id=patient_id).first()
+    return summary
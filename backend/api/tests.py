@@ -1,3 +1,1210 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import json
+import uuid
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+
+from .models import Patient, Visit, Attachment, ScanResult, Vaccination, ChatSession, ChatMessage, GrowthFlag, PatientSummary, DailyStat
+from .management.commands.populate_vaccinations import Command as PopulateVaccinationsCommand
+from . import imports
+from .analytics import rollup_all, rollup_pending_days
+from .vitals import downsample_indices
+from .stats import DAILY_MISSED_ROLLOVER
+from .schedule import SCHEDULE_OFFSETS, merge_schedule
+from .vaccinations import due_worklist
+from .views import GrowthBatchView
+from .signals import restore_search_triggers
+from .growth import zscores, growth_zscores
+from .llm import chat_model, prompt_chain, response_key
+from .chat_history import fold_context
+from .session_summaries import summarize_session
+from .utils import get_pediatric_system_prompt, get_llm_chain_response
+from .prompts import FULL_SUMMARY_TEMPLATE
+
+
+class PatientDetailQueryBudgetTests(TestCase):
+    # patient, visits, attachments (+ scan_analysis), given vaccines, vaccinations
+    QUERY_BUDGET = 5
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+
+    def make_patient(self, visit_count):
+        patient = Patient.objects.create(
+            name='Test Child', dob=date(2020, 1, 1), gender='Female',
+            father_height=175, mother_height=162
+        )
+        visits = Visit.objects.bulk_create([
+            Visit(patient=patient, date=patient.dob + timedelta(days=7 * i), age=i / 52, height=50 + i / 10, weight=3 + i / 20)
+            for i in range(visit_count)
+        ])
+        attachments = Attachment.objects.bulk_create([
+            Attachment(visit=visit, file=f'attachments/scan-{i}.png', name=f'scan-{i}.png')
+            for i, visit in enumerate(visits)
+        ])
+        ScanResult.objects.bulk_create([
+            ScanResult(attachment=attachment, modality='X-Ray', findings='Clear', impression='Normal')
+            for attachment in attachments
+        ])
+        vaccinations = list(Vaccination.objects.filter(patient=patient)[:visit_count])
+        for visit, vaccination in zip(visits, vaccinations):
+            vaccination.status = 'Given'
+            vaccination.visit = visit
+            vaccination.given_at = visit.date
+        Vaccination.objects.bulk_update(vaccinations, ['status', 'visit', 'given_at'])
+        return patient
+
+    def test_query_count_is_constant_for_200_visits(self):
+        patient = self.make_patient(200)
+
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            response = self.client.post('/api/patients/detail/', {'id': str(patient.id)}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['visits']), 200)
+        first_visit = response.data['visits'][0]
+        self.assertEqual(first_visit['date'], '2020-01-01')
+        self.assertEqual(first_visit['attachments'][0]['scan_analysis']['modality'], 'X-Ray')
+        self.assertEqual(len(first_visit['given_vaccines_display']), 1)
+
+    def test_query_count_does_not_grow_with_visits(self):
+        small = self.make_patient(1)
+        large = self.make_patient(50)
+
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            self.client.post('/api/patients/detail/', {'id': str(small.id)}, format='json')
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            self.client.post('/api/patients/detail/', {'id': str(large.id)}, format='json')
+
+
+class PatientListCompactTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        base = timezone.now() - timedelta(days=1)
+        for i in range(1, 8):
+            Patient.objects.create(
+                id=uuid.UUID(int=i), name=f'Child {i}', dob=date(2020, 1, 1), gender='Female',
+                father_height=175, mother_height=162
+            )
+            # Pairs share a timestamp so the id tie-break is exercised
+            Patient.objects.filter(pk=uuid.UUID(int=i)).update(created_at=base + timedelta(hours=i // 2))
+        self.expected = [str(p.id) for p in Patient.objects.order_by('-created_at', '-id')]
+
+    def page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_pages_follow_cursor_order_without_gaps(self):
+        Visit.objects.create(patient_id=uuid.UUID(int=7), date=date(2021, 1, 1), age=1, height=75, weight=9.5)
+        seen, url = [], '/api/patients/list/?mode=compact&limit=3'
+        while url:
+            data = self.page(url)
+            self.assertLessEqual(len(data['results']), 3)
+            seen += [row['id'] for row in data['results']]
+            url = data['next']
+
+        self.assertEqual(seen, self.expected)
+        first = self.page('/api/patients/list/?mode=compact&limit=3')['results'][0]
+        self.assertEqual(first['latest_weight'], 9.5)
+
+    def test_page_boundaries_hold_when_patients_are_added(self):
+        first = self.page('/api/patients/list/?mode=compact&limit=3')
+        self.assertEqual([row['id'] for row in first['results']], self.expected[:3])
+        Patient.objects.create(name='Newest', dob=date(2021, 1, 1), gender='Male', father_height=175, mother_height=162)
+
+        second = self.page(first['next'])
+        self.assertEqual([row['id'] for row in second['results']], self.expected[3:6])
+        back = self.page(second['previous'])
+        self.assertEqual([row['id'] for row in back['results']], self.expected[:3])
+
+
+class PatientSummarySignalTests(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(
+            name='Summary Child', dob=date.today() - timedelta(days=100), gender='Male',
+            father_height=175, mother_height=162
+        )
+
+    def summary(self):
+        return PatientSummary.objects.get(patient=self.patient)
+
+    def test_visit_writes_refresh_the_latest_measurements(self):
+        self.assertIsNone(self.summary().last_visit_date)
+        older = Visit.objects.create(patient=self.patient, date=self.patient.dob + timedelta(days=30), age=0.1, height=55, weight=4.5)
+        newer = Visit.objects.create(patient=self.patient, date=self.patient.dob + timedelta(days=60), age=0.2, height=58, weight=5.4)
+        self.assertEqual((self.summary().last_visit_date, self.summary().latest_weight), (newer.date, 5.4))
+
+        newer.weight = 5.6
+        newer.save()
+        self.assertEqual(self.summary().latest_weight, 5.6)
+
+        newer.delete()
+        self.assertEqual((self.summary().last_visit_date, self.summary().latest_height), (older.date, 55))
+        older.delete()
+        self.assertIsNone(self.summary().latest_weight)
+
+    def test_vaccination_writes_refresh_the_due_counts(self):
+        overdue = self.summary().overdue_vaccine_count
+        self.assertGreater(overdue, 0)
+        vaccination = Vaccination.objects.filter(patient=self.patient, status='Pending', due_date__lte=date.today()).first()
+
+        vaccination.status = 'Given'
+        vaccination.save()
+        self.assertEqual(self.summary().overdue_vaccine_count, overdue - 1)
+
+        extra = Vaccination.objects.create(patient=self.patient, vaccine_name='Typhoid Catch-up', due_date=date.today() - timedelta(days=1))
+        self.assertEqual(self.summary().overdue_vaccine_count, overdue)
+        extra.delete()
+        self.assertEqual(self.summary().overdue_vaccine_count, overdue - 1)
+
+        upcoming = Vaccination.objects.filter(patient=self.patient, status='Pending', due_date__gt=date.today()).order_by('due_date')
+        next_due = upcoming.first()
+        self.assertEqual(self.summary().next_vaccine_due_date, next_due.due_date)
+        next_due.delete()
+        self.assertEqual(self.summary().next_vaccine_due_date, upcoming.first().due_date)
+
+
+class DashboardStatsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        self.today = date.today()
+        self.patients = [
+            Patient.objects.create(name=f'Stats Child {i}', dob=date(2022, 1, 1), gender='Female', father_height=175, mother_height=162)
+            for i in range(2)
+        ]
+
+    def totals(self):
+        return self.client.post('/api/dashboard/').data
+
+    def trends(self):
+        response = self.client.get('/api/dashboard/trends/?days=3')
+        self.assertEqual(response.data['dates'], [self.today - timedelta(days=i) for i in (2, 1, 0)])
+        return response.data
+
+    def test_counters_and_daily_buckets_follow_writes(self):
+        first = Visit.objects.create(patient=self.patients[0], date=self.today, age=2, height=85, weight=12, visit_type='Routine, Vaccination')
+        Visit.objects.create(patient=self.patients[1], date=self.today - timedelta(days=1), age=3, height=95, weight=14, visit_type='Sick')
+        self.assertEqual(self.totals(), {'total_patients': 2, 'total_visits': 2, 'avg_patient_age': 2.5})
+        trends = self.trends()
+        self.assertEqual(trends['visits'], [0, 1, 1])
+        self.assertEqual(trends['new_patients'], [0, 0, 2])
+        self.assertEqual(trends['visits_by_type'], {'Routine': [0, 0, 1], 'Vaccination': [0, 0, 1], 'Sick': [0, 1, 0]})
+
+        first.date = self.today - timedelta(days=2)
+        first.visit_type = 'Sick'
+        first.age = 4
+        first.save()
+        self.assertEqual(self.totals(), {'total_patients': 2, 'total_visits': 2, 'avg_patient_age': 3.5})
+        trends = self.trends()
+        self.assertEqual(trends['visits'], [1, 1, 0])
+        self.assertEqual(trends['visits_by_type'], {'Sick': [1, 1, 0]})
+
+        first.delete()
+        self.patients[1].delete()
+        self.assertEqual(self.totals(), {'total_patients': 1, 'total_visits': 0, 'avg_patient_age': 0})
+        trends = self.trends()
+        self.assertEqual((trends['visits'], trends['new_patients'], trends['visits_by_type']), ([0, 0, 0], [0, 0, 1], {}))
+
+
+class AnalyticsTests(TestCase):
+    URL = '/api/analytics/?start=2024-01-01&end=2024-01-14'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        girl, boy = [
+            Patient.objects.create(name=f'Analytics {gender}', dob=date(2024, 1, 1), gender=gender, father_height=175, mother_height=162)
+            for gender in ('Female', 'Male')
+        ]
+        visits = [
+            (girl, date(2024, 1, 1), 'Initial', 'Healthy newborn'),
+            (girl, date(2024, 1, 2), 'Sick', 'Otitis  Media'),
+            (boy, date(2024, 1, 3), 'Routine', 'otitis media'),
+            (boy, date(2024, 1, 9), 'Sick', 'Fever'),
+            (boy, date(2024, 1, 15), 'Sick', 'Fever'),
+        ]
+        self.visits = [
+            Visit.objects.create(patient=patient, date=day, age=0, height=50, weight=3.5, visit_type=visit_type, diagnosis=diagnosis)
+            for patient, day, visit_type, diagnosis in visits
+        ]
+        Vaccination.objects.filter(patient=girl, vaccine_name='BCG').update(status='Given', given_at=date(2024, 1, 1))
+        bcg = Vaccination.objects.get(patient=boy, vaccine_name='BCG')
+        bcg.status, bcg.given_at = 'Given', date(2024, 1, 2)
+        bcg.save()
+
+    def analytics(self):
+        rollup_all()
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_day_buckets_aggregate_into_the_requested_range(self):
+        data = self.analytics()
+        self.assertEqual(data['visit_volume_by_week'], [
+            {'week_start': date(2024, 1, 1), 'visits': 2},
+            {'week_start': date(2024, 1, 8), 'visits': 1},
+        ])
+        self.assertEqual(data['top_diagnoses'], [{'diagnosis': 'otitis media', 'visits': 2}, {'diagnosis': 'fever', 'visits': 1}])
+        # The registration visit counts toward none of them
+        self.assertEqual(data['sick_visits'], {'visits': 3, 'sick_visits': 2, 'ratio': 0.667})
+        coverage = {row['vaccine']: row for row in data['vaccination_coverage']}
+        self.assertEqual((coverage['BCG']['due'], coverage['BCG']['given'], coverage['BCG']['coverage']), (2, 2, 1.0))
+        self.assertEqual((coverage['Hep-B2']['due'], coverage['Hep-B2']['given']), (0, 0))
+
+    def test_pending_rollup_moves_an_edited_visit_between_days(self):
+        self.analytics()
+        visit = self.visits[3]
+        visit.date = date(2024, 1, 4)
+        visit.diagnosis = 'Otitis media'
+        visit.save()
+        rollup_pending_days()
+
+        data = self.client.get(self.URL).data
+        self.assertEqual([week['visits'] for week in data['visit_volume_by_week']], [3, 0])
+        self.assertEqual(data['top_diagnoses'], [{'diagnosis': 'otitis media', 'visits': 3}])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        self.patient = Patient.objects.create(
+            name='Aarav Sharma', dob=date(2022, 1, 10), gender='Male',
+            father_height=172, mother_height=160
+        )
+        Patient.objects.create(name='Meera Iyer', dob=date(2021, 5, 2), gender='Female', father_height=168, mother_height=158)
+        self.visit = Visit.objects.create(
+            patient=self.patient, date=date(2023, 2, 1), age=1, height=76, weight=9.5,
+            diagnosis='Bronchiolitis', notes='Wheeze, started salbutamol nebulisation'
+        )
+        session = ChatSession.objects.create(patient=self.patient)
+        self.message = ChatMessage.objects.create(session=session, sender='user', text='Is bronchiolitis contagious to his sister?')
+
+    def search(self, query, **params):
+        response = self.client.get('/api/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_finds_patients_visits_and_messages(self):
+        results = self.search('aarav')
+        self.assertEqual([(r['type'], r['id']) for r in results], [('patient', str(self.patient.id))])
+
+        results = self.search('bronch')
+        self.assertEqual({(r['type'], r['id']) for r in results}, {('visit', str(self.visit.id)), ('message', str(self.message.id))})
+        self.assertTrue(all(r['patient_id'] == str(self.patient.id) for r in results))
+        self.assertEqual(self.search('salbutamol', type='visit')[0]['id'], str(self.visit.id))
+
+    def test_index_follows_edits(self):
+        self.patient.name = 'Vihaan Sharma'
+        self.patient.save()
+        self.assertEqual(self.search('aarav'), [])
+        self.assertEqual(len(self.search('vihaan')), 1)
+
+        self.visit.delete()
+        self.assertEqual(self.search('salbutamol'), [])
+
+    def test_scores_are_ranked_within_each_type(self):
+        Patient.objects.create(name='Sharma Bronchiolitis Test', dob=date(2020, 1, 1), gender='Male', father_height=170, mother_height=160)
+        results = self.search('bronchiolitis')
+        best = {}
+        for r in results:
+            best[r['type']] = max(best.get(r['type'], 0), r['score'])
+        self.assertEqual(best, {'patient': 1.0, 'visit': 1.0, 'message': 1.0})
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5 index')
+    def test_index_survives_rowid_renumbering(self):
+        # What VACUUM or a table rebuild may do to UUID-keyed tables
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE api_patient SET rowid = rowid + 1000")
+            cursor.execute("UPDATE api_visit SET rowid = rowid + 1000")
+        self.assertEqual([r['id'] for r in self.search('aarav')], [str(self.patient.id)])
+        self.assertEqual([r['id'] for r in self.search('salbutamol')], [str(self.visit.id)])
+
+        self.visit.notes = 'Wheeze settled with oxygen'
+        self.visit.save()
+        self.assertEqual(self.search('salbutamol'), [])
+        self.assertEqual([r['id'] for r in self.search('oxygen')], [str(self.visit.id)])
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5 index')
+    def test_triggers_dropped_by_a_table_rebuild_come_back_after_migrate(self):
+        with connection.cursor() as cursor:
+            for trigger in ('api_patient_search_ai', 'api_patient_search_au'):
+                cursor.execute(f"DROP TRIGGER {trigger}")
+        kabir = Patient.objects.create(name='Kabir Rao', dob=date(2023, 4, 1), gender='Male', father_height=170, mother_height=160)
+        self.patient.name = 'Vihaan Sharma'
+        self.patient.save()
+        self.assertEqual(self.search('kabir'), [])
+
+        restore_search_triggers(sender=django_apps.get_app_config('api'), using='default')
+        self.assertEqual([r['id'] for r in self.search('kabir')], [str(kabir.id)])
+        self.assertEqual([r['id'] for r in self.search('vihaan')], [str(self.patient.id)])
+        self.assertEqual(self.search('aarav'), [])
+        Patient.objects.create(name='Kabir Menon', dob=date(2023, 4, 1), gender='Male', father_height=170, mother_height=160)
+        self.assertEqual(len(self.search('kabir')), 2)
+
+
+class PatientDetailCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        self.patient = Patient.objects.create(
+            name='Cached Child', dob=date(2021, 6, 1), gender='Male',
+            father_height=180, mother_height=165
+        )
+
+    def fetch(self):
+        return self.client.post('/api/patients/detail/', {'id': str(self.patient.id)}, format='json')
+
+    def test_repeat_read_is_served_from_cache(self):
+        self.fetch()
+        with self.assertNumQueries(1):
+            response = self.fetch()
+        self.assertEqual(response.data['name'], 'Cached Child')
+
+    def test_visit_write_invalidates_cached_payload(self):
+        self.assertEqual(len(self.fetch().data['visits']), 0)
+        visit = Visit.objects.create(patient=self.patient, date=date(2022, 6, 1), age=1, height=75, weight=10)
+        self.assertEqual(len(self.fetch().data['visits']), 1)
+
+        attachment = Attachment.objects.create(visit=visit, file='attachments/xray.png')
+        self.assertEqual(len(self.fetch().data['visits'][0]['attachments']), 1)
+
+        ScanResult.objects.create(attachment=attachment, modality='X-Ray')
+        self.assertEqual(self.fetch().data['visits'][0]['attachments'][0]['scan_analysis']['modality'], 'X-Ray')
+
+        visit.delete()
+        self.assertEqual(len(self.fetch().data['visits']), 0)
+
+    def test_vaccination_write_invalidates_cached_payload(self):
+        self.fetch()
+        vaccination = Vaccination.objects.filter(patient=self.patient).first()
+        vaccination.status = 'Given'
+        vaccination.save()
+        statuses = {v['id']: v['status'] for v in self.fetch().data['vaccinations']}
+        self.assertEqual(statuses[str(vaccination.id)], 'Given')
+
+    def test_attachment_urls_follow_the_request_scheme(self):
+        visit = Visit.objects.create(patient=self.patient, date=date(2022, 6, 1), age=1, height=75, weight=10)
+        Attachment.objects.create(visit=visit, file='attachments/xray.png')
+        url = lambda response: response.data['visits'][0]['attachments'][0]['file']
+
+        self.assertTrue(url(self.fetch()).startswith('http://'))
+        secure = self.client.post('/api/patients/detail/', {'id': str(self.patient.id)}, format='json', secure=True)
+        self.assertTrue(url(secure).startswith('https://'))
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        self.patient = Patient.objects.create(
+            name='Etag Child', dob=date(2022, 3, 1), gender='Female',
+            father_height=170, mother_height=160
+        )
+        self.session = ChatSession.objects.create(patient=self.patient)
+
+    def test_patient_detail_revalidates_until_record_changes(self):
+        url = f'/api/patients/detail/?id={self.patient.id}'
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Visit.objects.create(patient=self.patient, date=date(2023, 3, 1), age=1, height=74, weight=9)
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+
+    def test_session_messages_and_list_revalidate_after_new_message(self):
+        messages_url = f'/api/ai/sessions/messages/?sessionId={self.session.id}'
+        list_url = f'/api/ai/sessions/list/?patientId={self.patient.id}'
+        messages_etag = self.client.get(messages_url)['ETag']
+        list_etag = self.client.get(list_url)['ETag']
+        self.assertEqual(self.client.get(messages_url, HTTP_IF_NONE_MATCH=messages_etag).status_code, 304)
+        self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=list_etag).status_code, 304)
+
+        ChatMessage.objects.create(session=self.session, sender='user', text='Fever since last night')
+
+        response = self.client.get(messages_url, HTTP_IF_NONE_MATCH=messages_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        response = self.client.get(list_url, HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+
+    def test_malformed_ids_are_rejected_without_a_server_error(self):
+        self.assertEqual(self.client.get('/api/patients/detail/?id=not-a-uuid').status_code, 404)
+        self.assertEqual(self.client.get('/api/ai/sessions/messages/?sessionId=not-a-uuid').status_code, 404)
+        self.assertEqual(self.client.get('/api/ai/sessions/list/?patientId=not-a-uuid').status_code, 400)
+
+
+class PatientVitalsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        self.patient = Patient.objects.create(
+            name='Vitals Child', dob=date(2022, 1, 1), gender='Male',
+            father_height=175, mother_height=162
+        )
+        Visit.objects.bulk_create([
+            Visit(patient=self.patient, date=self.patient.dob + timedelta(days=7 * i), age=i / 52, height=50 + i / 5, weight=3 + i / 10, visit_type='Routine')
+            for i in range(30)
+        ])
+        self.url = f'/api/patients/vitals/?id={self.patient.id}'
+
+    def test_returns_parallel_arrays_in_date_order(self):
+        data = self.client.get(self.url).data
+        self.assertEqual((data['count'], data['returned']), (30, 30))
+        for column in ('dates', 'age', 'visit_type', 'height', 'weight', 'head_circumference', 'temperature', 'heart_rate'):
+            self.assertEqual(len(data[column]), 30)
+        self.assertEqual(data['dates'], sorted(data['dates']))
+        self.assertEqual((data['dates'][0], data['weight'][0], data['head_circumference'][0]), (self.patient.dob, 3, None))
+
+    def test_downsampling_keeps_first_and_last_visits(self):
+        data = self.client.get(f'{self.url}&max_points=10').data
+        self.assertEqual(data['count'], 30)
+        self.assertLessEqual(data['returned'], 10)
+        self.assertEqual(len(data['dates']), data['returned'])
+        self.assertEqual(data['dates'][0], self.patient.dob)
+        self.assertEqual(data['dates'][-1], self.patient.dob + timedelta(days=7 * 29))
+        self.assertEqual(data['dates'], sorted(data['dates']))
+
+        # Clustered visits still come back evenly spread and bounded
+        days = [0, 1, 2, 3, 4, 5, 100, 200, 201, 300]
+        kept = downsample_indices(days, 4)
+        self.assertLessEqual(len(kept), 4)
+        self.assertEqual((kept[0], kept[-1]), (0, len(days) - 1))
+
+    def test_rejects_bad_max_points_and_unknown_patients(self):
+        self.assertEqual(self.client.get(f'{self.url}&max_points=many').status_code, 400)
+        self.assertEqual(self.client.get(f'{self.url}&max_points=1').status_code, 400)
+        self.assertEqual(self.client.get('/api/patients/vitals/').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/patients/vitals/?id={uuid.uuid4()}').status_code, 404)
+        self.assertEqual(self.client.get('/api/patients/vitals/?id=not-a-uuid').status_code, 404)
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Downsampled responses carry their own tag
+        self.assertEqual(self.client.get(f'{self.url}&max_points=10', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        Visit.objects.create(patient=self.patient, date=date(2023, 1, 1), age=1, height=76, weight=10)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+async def fake_stream(messages, model=None):
+    for text in ['How long ', 'has the fever ', 'lasted?']:
+        yield text
+
+
+class AIChatStreamTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_superuser('doctor', 'doctor@example.com', 'pass')
+        self.auth = {'Authorization': f'Token {Token.objects.create(user=user).key}'}
+        self.patient = Patient.objects.create(
+            name='Stream Child', dob=date(2022, 3, 1), gender='Male',
+            father_height=175, mother_height=162
+        )
+
+    @mock.patch('api.views.API_KEY', 'test-key')
+    @mock.patch('api.views.astream_ai_response', fake_stream)
+    async def test_streams_tokens_and_saves_reply(self):
+        response = await self.async_client.post('/api/ai/chat/', {
+            'message': 'My son has a fever', 'patientId': str(self.patient.id),
+            'patientStats': {'age': '1 year'}, 'stream': True
+        }, content_type='application/json', headers=self.auth)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        events = [block.split('\n') for block in body.strip().split('\n\n')]
+        self.assertEqual([lines[0] for lines in events], ['event: token'] * 3 + ['event: done'])
+        done = json.loads(events[-1][1][len('data: '):])
+        self.assertEqual(done['text'], 'How long has the fever lasted?')
+
+        session = await ChatSession.objects.aget(pk=done['sessionId'])
+        self.assertEqual(
+            [row async for row in session.messages.values_list('sender', 'text')],
+            [('user', 'My son has a fever'), ('ai', 'How long has the fever lasted?')]
+        )
+
+
+@mock.patch('api.views.API_KEY', 'test-key')
+class ChatTurnPipelineTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        self.patient = Patient.objects.create(
+            name='Turn Child', dob=date(2023, 1, 1), gender='Male',
+            father_height=170, mother_height=160
+        )
+        self.session = ChatSession.objects.create(patient=self.patient)
+        self.attachment = Attachment.objects.create(session=self.session, file='attachments/scan.jpg', name='scan.jpg')
+        ScanResult.objects.create(attachment=self.attachment, modality='X-Ray', findings='Clear lungs', impression='Normal')
+
+    def send(self):
+        with mock.patch('api.views.aget_ai_response', mock.AsyncMock(return_value=AIMessage(content='Noted'))) as llm:
+            response = self.client.post('/api/ai/chat/', {
+                'message': 'What does the scan show?', 'patientId': str(self.patient.id),
+                'sessionId': str(self.session.id), 'attachmentId': str(self.attachment.id)
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response, llm.call_args.args[0]
+
+    def test_turn_loads_everything_once(self):
+        self.send()
+        # attachment + scan, patient, session, history counts and window,
+        # then insert + session touch for each of the two messages
+        with self.assertNumQueries(9):
+            response, messages = self.send()
+
+        self.assertEqual(response.data['structured_findings']['impression'], 'Normal')
+        self.assertIn('**Findings**: Clear lungs', messages[0].content)
+        self.assertIn('load;dur=', response['Server-Timing'])
+
+
+class ClinicalContextCacheTests(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(
+            name='Context Child', dob=date(2024, 1, 15), gender='Male',
+            father_height=170, mother_height=160
+        )
+        Visit.objects.create(patient=self.patient, date=date(2024, 6, 1), age=0, height=66, weight=7.5)
+
+    def prompt(self):
+        return get_pediatric_system_prompt(str(self.patient.id), {}, 'patient', [])
+
+    def test_prompt_is_built_from_cache_until_a_visit_changes(self):
+        first = self.prompt()
+        self.assertIn('Weight: 7.5 kg', first)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.prompt(), first)
+
+        Visit.objects.create(patient=self.patient, date=date(2025, 6, 1), age=1, height=76, weight=9.9)
+        self.assertIn('Weight: 9.9 kg', self.prompt())
+
+
+@override_settings(CHAT_HISTORY_MAX_MESSAGES=6, CHAT_HISTORY_TOKEN_BUDGET=1000)
+@mock.patch('api.views.API_KEY', 'test-key')
+class ChatHistoryWindowTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        self.patient = Patient.objects.create(
+            name='Window Child', dob=date(2021, 6, 1), gender='Female',
+            father_height=172, mother_height=160
+        )
+        self.session = ChatSession.objects.create(patient=self.patient)
+        for i in range(10):
+            ChatMessage.objects.create(session=self.session, sender='user' if i % 2 == 0 else 'ai', text=f'message {i}')
+
+    def send(self, text, reply):
+        with mock.patch('api.views.aget_ai_response', mock.AsyncMock(return_value=AIMessage(content=reply))) as llm:
+            response = self.client.post('/api/ai/chat/', {
+                'message': text, 'patientId': str(self.patient.id),
+                'sessionId': str(self.session.id), 'history': [{'role': 'user', 'text': 'ignored'}]
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        return llm.call_args.args[0]
+
+    @mock.patch('api.chat_history.summarize_messages', return_value='EARLIER SUMMARY')
+    @mock.patch('api.chat_history.schedule_context_fold')
+    def test_replays_latest_stored_messages_and_folds_the_rest_later(self, schedule_fold, summarize):
+        sent = self.send('message 10', 'message 11')
+        self.assertEqual([m.content for m in sent[1:]], [f'message {i}' for i in range(4, 11)])
+        self.assertNotIn('EARLIER SUMMARY', sent[0].content)
+        # Messages 0-3 fell out of the window; folding them is left to the background
+        schedule_fold.assert_called_once_with(self.session.pk)
+        summarize.assert_not_called()
+
+        fold_context(ChatSession.objects.get(pk=self.session.pk))
+        previous_summary, folded, _ = summarize.call_args.args
+        self.assertIsNone(previous_summary)
+        self.assertEqual([m['text'] for m in folded], [f'message {i}' for i in range(6)])
+
+        sent = self.send('message 12', 'message 13')
+        self.assertIn('EARLIER SUMMARY', sent[0].content)
+        self.assertEqual([m.content for m in sent[1:]], [f'message {i}' for i in range(6, 13)])
+        self.assertEqual(schedule_fold.call_count, 1)
+
+
+@override_settings(CHAT_SUMMARY_DEBOUNCE_SECONDS=5)
+@mock.patch('api.views.API_KEY', 'test-key')
+class SessionSummaryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        self.patient = Patient.objects.create(
+            name='Summary Child', dob=date(2021, 6, 1), gender='Male',
+            father_height=175, mother_height=162
+        )
+        self.session = ChatSession.objects.create(patient=self.patient)
+
+    def add_messages(self, *texts):
+        for text in texts:
+            ChatMessage.objects.create(session=self.session, sender='ai' if text.startswith('ai') else 'user', text=text)
+
+    @mock.patch('api.session_summaries.threading.Timer')
+    def test_ai_replies_reschedule_one_debounced_update(self, timer):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_messages('user 1')
+        timer.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_messages('ai 1')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_messages('ai 2')
+        self.assertEqual(timer.call_count, 2)
+        self.assertEqual(timer.call_args.args[0], 5)
+        timer.return_value.cancel.assert_called_once()
+
+    @mock.patch('api.session_summaries.summarize_messages', side_effect=['FIRST', 'SECOND'])
+    def test_only_messages_after_the_summary_are_summarized(self, summarize):
+        self.add_messages('user 1', 'ai 1')
+        summarize_session(ChatSession.objects.get(pk=self.session.pk))
+        self.add_messages('user 2', 'ai 2')
+        summarize_session(ChatSession.objects.get(pk=self.session.pk))
+
+        previous_summary, new_messages, _ = summarize.call_args.args
+        self.assertEqual(previous_summary, 'FIRST')
+        self.assertEqual([m['text'] for m in new_messages], ['user 2', 'ai 2'])
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.summary, self.session.cached_message_count), ('SECOND', 4))
+
+    @mock.patch('api.session_summaries.asummarize_messages', new_callable=mock.AsyncMock)
+    def test_summarize_returns_a_current_summary_without_calling_gemini(self, summarize):
+        self.add_messages('user 1', 'ai 1')
+        ChatSession.objects.filter(pk=self.session.pk).update(summary='CURRENT', cached_message_count=2)
+
+        response = self.client.post('/api/ai/summarize/', {
+            'patientId': str(self.patient.id), 'sessionId': str(self.session.id),
+            'history': [{'role': 'ai', 'text': 'greeting'}, {'role': 'user', 'text': 'user 1'}, {'role': 'ai', 'text': 'ai 1'}]
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['summary'], 'CURRENT')
+        summarize.assert_not_called()
+
+    @mock.patch('api.session_summaries.summarize_messages', return_value='REBUILT')
+    def test_summaries_from_client_history_counts_are_rebuilt(self, summarize):
+        # Saved when cached_message_count counted the client history,
+        # greeting included: 3 against 2 stored messages
+        self.add_messages('user 1', 'ai 1')
+        ChatSession.objects.filter(pk=self.session.pk).update(summary='LEGACY', cached_message_count=3)
+
+        reset = importlib.import_module('api.migrations.0021_reset_chat_session_summaries')
+        reset.reset_session_summaries(django_apps, None)
+        self.assertEqual(summarize_session(ChatSession.objects.get(pk=self.session.pk)), 'REBUILT')
+
+        previous_summary, new_messages, _ = summarize.call_args.args
+        self.assertIsNone(previous_summary)
+        self.assertEqual([m['text'] for m in new_messages], ['user 1', 'ai 1'])
+
+@mock.patch('api.llm.API_KEY', 'test-key')
+class LLMRegistryTests(SimpleTestCase):
+    def test_models_and_chains_are_built_once(self):
+        model = chat_model('gemini-flash-latest', 0.2)
+        self.assertIs(chat_model('gemini-flash-latest', 0.2), model)
+        self.assertIsNot(chat_model('gemini-flash-latest', 0.7), model)
+
+        chain = prompt_chain(FULL_SUMMARY_TEMPLATE, 'gemini-flash-latest', 0.2)
+        self.assertIs(prompt_chain(FULL_SUMMARY_TEMPLATE, 'gemini-flash-latest', 0.2), chain)
+        self.assertIs(chain.middle[0], model)
+
+    def test_event_loops_get_their_own_clients(self):
+        async def build():
+            return chat_model('gemini-flash-latest', 0.2), chat_model('gemini-flash-latest', 0.2)
+
+        first, again = asyncio.run(build())
+        self.assertIs(first, again)
+        self.assertIsNot(first, chat_model('gemini-flash-latest', 0.2))
+        self.assertIsNot(asyncio.run(build())[0], first)
+
+
+class LLMResponseCacheTests(SimpleTestCase):
+    def test_identical_prompts_call_the_model_once(self):
+        fake = FakeListChatModel(responses=['Summary A', 'Summary B'])
+        with mock.patch('api.llm.chat_model', return_value=fake):
+            first = get_llm_chain_response('Summarize: {text}', {'text': 'fever'}, model='cache-test-model')
+            again = get_llm_chain_response('Summarize: {text}', {'text': 'fever'}, model='cache-test-model')
+            other = get_llm_chain_response('Summarize: {text}', {'text': 'cough'}, model='cache-test-model')
+
+        self.assertEqual((first, again, other), ('Summary A', 'Summary A', 'Summary B'))
+
+    def test_key_covers_model_temperature_prompt_and_image(self):
+        key = response_key('gemini-2.5-flash', 0.2, 'prompt', b'image')
+        self.assertEqual(key, response_key('gemini-2.5-flash', 0.2, 'prompt', b'image'))
+        for other in (
+            response_key('gemini-flash-latest', 0.2, 'prompt', b'image'),
+            response_key('gemini-2.5-flash', 0.7, 'prompt', b'image'),
+            response_key('gemini-2.5-flash', 0.2, 'prompt!', b'image'),
+            response_key('gemini-2.5-flash', 0.2, 'prompt', b'image2'),
+        ):
+            self.assertNotEqual(key, other)
+
+
+class VisitVaccineReconcileTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        self.patient = Patient.objects.create(
+            name='Reconcile Child', dob=date(2024, 1, 1), gender='Female',
+            father_height=170, mother_height=160
+        )
+        self.visit = Visit.objects.create(patient=self.patient, date=date(2024, 1, 2), age=0, height=50, weight=3.2)
+
+    def update(self, vaccines):
+        response = self.client.post('/api/visits/update/', {'id': str(self.visit.id), 'vaccines': vaccines}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def given(self):
+        return dict(
+            Vaccination.objects.filter(patient=self.patient, status='Given')
+            .values_list('vaccine_name', 'visit_id')
+        )
+
+    def test_vaccine_list_is_diffed_against_the_visit(self):
+        self.update(['BCG', 'OPV-0'])
+        self.assertEqual(self.given(), {'BCG': self.visit.id, 'OPV-0': self.visit.id})
+
+        scheduled = Vaccination.objects.filter(patient=self.patient).count()
+        self.update(['BCG', 'Typhoid Catch-up'])
+        self.assertEqual(self.given(), {'BCG': self.visit.id, 'Typhoid Catch-up': self.visit.id})
+        opv = Vaccination.objects.get(patient=self.patient, vaccine_name='OPV-0')
+        self.assertEqual((opv.status, opv.visit_id, opv.given_at), ('Pending', None, None))
+        self.assertEqual(Vaccination.objects.filter(patient=self.patient).count(), scheduled + 1)
+        self.assertEqual(self.patient.summary.last_visit_date, self.visit.date)
+
+    def test_update_cost_does_not_grow_with_vaccines(self):
+        self.update(['BCG'])
+        with self.assertNumQueries(13):
+            self.update(['OPV-0'])
+        with self.assertNumQueries(13):
+            self.update(['BCG', 'OPV-0', 'Hep-B1'])
+
+    def test_one_row_per_patient_and_vaccine(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Vaccination.objects.create(patient=self.patient, vaccine_name='BCG', due_date=date(2024, 1, 1))
+
+
+class PopulateVaccinationsTests(TestCase):
+    def setUp(self):
+        self.patients = [
+            Patient.objects.create(name=f'Backfill {i}', dob=date(2023, 1, 1), gender='Female', father_height=170, mother_height=160)
+            for i in range(5)
+        ]
+        self.scheduled = Vaccination.objects.filter(patient=self.patients[0]).count()
+        Vaccination.objects.filter(patient__in=self.patients[1:3]).delete()
+        Vaccination.objects.filter(patient=self.patients[3], vaccine_name='BCG').delete()
+
+    def populate(self, *args):
+        out = StringIO()
+        call_command('populate_vaccinations', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_backfills_missing_vaccines_in_chunks(self):
+        self.assertIn(f'Would add {2 * self.scheduled + 1} missing vaccines for 3 of 5 patients', self.populate('--dry-run'))
+        self.assertEqual(Vaccination.objects.filter(patient=self.patients[1]).count(), 0)
+
+        self.assertIn(f'Added {2 * self.scheduled + 1} missing vaccines for 3 of 5 patients', self.populate())
+        for patient in self.patients:
+            self.assertEqual(Vaccination.objects.filter(patient=patient).count(), self.scheduled)
+        next_due = PatientSummary.objects.filter(patient__in=self.patients).values_list('next_vaccine_due_date', flat=True)
+        self.assertEqual(len(set(next_due)), 1)
+
+        self.assertIn('Added 0 missing vaccines for 0 of 5 patients', self.populate())
+
+    def test_pool_reads_chunks_only_as_workers_free_up(self):
+        read = []
+
+        def chunks():
+            for i in range(20):
+                read.append(i)
+                yield [i]
+
+        command = PopulateVaccinationsCommand()
+        with mock.patch.object(command, 'process_chunk_in_thread', side_effect=lambda chunk: (len(chunk), 0, 0)):
+            results = command.process_in_pool(chunks(), workers=2)
+            next(results)
+            self.assertEqual(len(read), 4)
+            self.assertEqual(sum(size for size, _, _ in results), 19)
+
+
+class VaccinationWorklistTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        self.patients = [
+            Patient.objects.create(name=f'Worklist {i}', dob=date(2023, 1, 1), gender='Male', father_height=175, mother_height=160)
+            for i in range(3)
+        ]
+        Vaccination.objects.all().delete()
+        today = date.today()
+        a, b, c = self.patients
+        for patient, name, due, status in [
+            (a, 'DTP-1', 2, 'Pending'), (a, 'IPV-1', 2, 'Pending'), (b, 'DTP-1', 2, 'Pending'),
+            (c, 'DTP-1', 2, 'Pending'), (a, 'DTP-2', 10, 'Pending'), (b, 'IPV-1', 1, 'Given'),
+            (a, 'BCG', -60, 'Missed'), (b, 'BCG', -40, 'Pending'), (c, 'BCG', -10, 'Pending'),
+        ]:
+            Vaccination.objects.create(patient=patient, vaccine_name=name, due_date=today + timedelta(days=due), status=status)
+
+    def pages(self, **params):
+        pages = []
+        url = '/api/vaccinations/worklist/'
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            pages.append([(g['patient_id'], sorted(g['vaccines'])) for g in response.data['results']])
+            url, params = response.data['next'], None
+        return pages
+
+    def test_week_pages_keep_each_patients_vaccines_together(self):
+        pages = self.pages(window='week', limit=1)
+        self.assertTrue(all(len(page) <= 1 for page in pages))
+        first = self.patients[0]
+        self.assertEqual(
+            [group for page in pages for group in page],
+            sorted((p.pk, ['DTP-1', 'IPV-1'] if p == first else ['DTP-1']) for p in self.patients)
+        )
+
+    def test_overdue_window_covers_pending_and_missed_past_the_grace_days(self):
+        a, b, c = self.patients
+        groups = [group for page in self.pages(window='overdue') for group in page]
+        self.assertEqual(groups, [(a.pk, ['BCG']), (b.pk, ['BCG'])])
+
+        groups = [group for page in self.pages(window='overdue', days=5, limit=1) for group in page]
+        self.assertEqual(groups, [(a.pk, ['BCG']), (b.pk, ['BCG']), (c.pk, ['BCG'])])
+
+
+class VaccinationRolloverTests(TestCase):
+    def setUp(self):
+        today = date.today()
+        self.patient = Patient.objects.create(
+            name='Rollover Child', dob=today - timedelta(days=200), gender='Male',
+            father_height=175, mother_height=160
+        )
+        Vaccination.objects.filter(patient=self.patient, vaccine_name='BCG').update(status='Given', given_at=self.patient.dob)
+        self.cutoff = today - timedelta(days=30)
+
+    def rollover(self):
+        out = StringIO()
+        call_command('rollover_vaccinations', '--chunk-size', '2', stdout=out)
+        return out.getvalue()
+
+    def test_marks_pending_vaccines_past_grace_as_missed_once(self):
+        rows = Vaccination.objects.filter(patient=self.patient)
+        overdue = set(rows.filter(status='Pending', due_date__lt=self.cutoff).values_list('pk', flat=True))
+        within_grace = set(rows.filter(status='Pending', due_date__gte=self.cutoff).values_list('pk', flat=True))
+        self.assertTrue(overdue and within_grace)
+        version = Patient.objects.get(pk=self.patient.pk).record_version
+
+        self.assertIn(f'Successfully marked {len(overdue)} vaccinations as Missed', self.rollover())
+        self.assertEqual(set(rows.filter(status='Missed').values_list('pk', flat=True)), overdue)
+        self.assertEqual(set(rows.filter(status='Pending').values_list('pk', flat=True)), within_grace)
+        self.assertEqual(rows.get(vaccine_name='BCG').status, 'Given')
+        self.assertNotEqual(Patient.objects.get(pk=self.patient.pk).record_version, version)
+
+        self.assertIn('Successfully marked 0 vaccinations as Missed', self.rollover())
+        self.assertEqual(rows.filter(status='Missed').count(), len(overdue))
+
+        # Each night's count is kept for auditing
+        logged = DailyStat.objects.get(day=date.today(), metric=DAILY_MISSED_ROLLOVER, key='')
+        self.assertEqual(logged.value, len(overdue))
+
+
+class PatientImportTests(TestCase):
+    HEADER = 'name,dob,gender,father_height,mother_height,initial_weight,initial_height\n'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+
+    def upload(self, content, **data):
+        return self.client.post('/api/patients/import/', {
+            'file': SimpleUploadedFile('patients.csv', content, content_type='text/csv'), **data
+        }, format='multipart')
+
+    def test_imports_valid_rows_and_reports_the_rest(self):
+        content = (
+            self.HEADER
+            + 'Aarav Sharma,2023-04-01,Male,172,160,9.5,74\n'
+            + 'No Dob,,Female,165,158,,\n'
+            + 'Diya Rao,2022-11-15,Female,168,155,,\n'
+        ).encode()
+        response = self.upload(content, batch_size='2')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            {key: response.data[key] for key in ('created', 'users', 'visits', 'failed', 'error')},
+            {'created': 2, 'users': 2, 'visits': 1, 'failed': 1, 'error': None}
+        )
+        self.assertEqual(response.data['errors'][0]['line'], 3)
+        aarav = Patient.objects.get(name='Aarav Sharma')
+        self.assertEqual(aarav.user.username, 'aaravsharma')
+        self.assertEqual(aarav.summary.latest_weight, 9.5)
+        self.assertTrue(Vaccination.objects.filter(patient=aarav).exists())
+
+    def test_unreadable_tail_keeps_the_committed_batches(self):
+        content = (self.HEADER + 'Aarav Sharma,2023-04-01,Male,172,160,,\n').encode() + b'Diya \xff\xfe Rao,2022-11-15,Female,168,155,,\n'
+        response = self.upload(content, batch_size='1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], 1)
+        self.assertIn('Unreadable file', response.data['error'])
+        self.assertTrue(Patient.objects.filter(name='Aarav Sharma').exists())
+
+    def test_username_taken_by_a_concurrent_import_is_retried(self):
+        User.objects.create_user('aaravsharma')
+        real = imports.assign_usernames
+        # The first check misses the user the other import just created
+        with mock.patch('api.imports.assign_usernames', side_effect=[['aaravsharma'], real(['Aarav Sharma'])]):
+            response = self.upload((self.HEADER + 'Aarav Sharma,2023-04-01,Male,172,160,,\n').encode())
+        self.assertEqual(response.status_code, 201)
+        username = Patient.objects.get(name='Aarav Sharma').user.username
+        self.assertTrue(username.startswith('aaravsharma'))
+        self.assertNotEqual(username, 'aaravsharma')
+
+
+class SparseVaccinationStorageTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+
+    def vaccinations(self, patient):
+        response = self.client.get(f'/api/patients/detail/?id={patient.id}')
+        return [(v['vaccine_name'], v['due_date'], v['status'], v['given_at']) for v in response.data['vaccinations']]
+
+    def test_sparse_mode_renders_the_same_schedule(self):
+        dob = date.today() - timedelta(days=100)
+        dense = Patient.objects.create(name='Dense', dob=dob, gender='Male', father_height=175, mother_height=160)
+        Visit.objects.create(patient=dense, date=dob, age=0, height=50, weight=3)
+        self.client.post('/api/visits/update/', {'id': str(dense.visits.get().id), 'vaccines': ['BCG']}, format='json')
+        # Sparse mode derives Missed; dense rows get it from the nightly job
+        call_command('rollover_vaccinations', stdout=StringIO())
+
+        with override_settings(VACCINATION_STORAGE='sparse'):
+            sparse = Patient.objects.create(name='Sparse', dob=dob, gender='Male', father_height=175, mother_height=160)
+            visit = Visit.objects.create(patient=sparse, date=dob, age=0, height=50, weight=3)
+            self.client.post('/api/visits/update/', {'id': str(visit.id), 'vaccines': ['BCG']}, format='json')
+
+            self.assertEqual(Vaccination.objects.filter(patient=sparse).count(), 1)
+            self.assertEqual(self.vaccinations(sparse), self.vaccinations(dense))
+            self.assertEqual(sparse.summary.overdue_vaccine_count, dense.summary.overdue_vaccine_count)
+
+
+@override_settings(VACCINATION_STORAGE='sparse')
+class SparseVaccinationWorklistTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        self.today = date.today()
+        self.patients = [
+            Patient.objects.create(
+                id=uuid.UUID(int=i + 1), name=f'Sparse {i}', dob=self.today - timedelta(days=age),
+                gender='Female', father_height=175, mother_height=160
+            )
+            for i, age in enumerate([45, 45, 100, 400])
+        ]
+        first, second, third, _ = self.patients
+        # Stored exceptions: given vaccines and an ad-hoc one due this week
+        for patient, name in [(first, 'BCG'), (third, 'OPV-0'), (third, 'IPV-1')]:
+            Vaccination.objects.create(
+                patient=patient, vaccine_name=name, due_date=patient.dob + SCHEDULE_OFFSETS[name],
+                status='Given', given_at=patient.dob + SCHEDULE_OFFSETS[name]
+            )
+        Vaccination.objects.create(patient=second, vaccine_name='Typhoid Catch-up', due_date=self.today + timedelta(days=3))
+
+    WINDOWS = [
+        ('week', lambda today: (today, today + timedelta(days=6), ['Pending'])),
+        ('overdue', lambda today: (date.min, today - timedelta(days=31), Vaccination.OVERDUE_STATUSES)),
+        ('missed only', lambda today: (today - timedelta(days=120), today, ['Missed'])),
+        ('season', lambda today: (today - timedelta(days=60), today + timedelta(days=90), ['Pending'])),
+    ]
+
+    def walk(self, start, end, statuses, limit):
+        rows, after = [], None
+        while True:
+            groups, after = due_worklist(start, end, after=after, limit=limit, statuses=statuses)
+            rows += [(g['due_date'], g['patient_id'], sorted(g['vaccines'])) for g in groups]
+            if after is None:
+                return rows
+
+    def materialize(self):
+        # What dense storage would hold for the same patients
+        for patient in self.patients:
+            merged = merge_schedule(patient.pk, patient.dob, list(Vaccination.objects.filter(patient=patient)), self.today)
+            Vaccination.objects.bulk_create([v for v in merged if v._state.adding])
+
+    def test_paged_worklist_matches_stored_mode(self):
+        sparse = {}
+        for label, window in self.WINDOWS:
+            start, end, statuses = window(self.today)
+            for limit in (1, 2, 100):
+                rows = self.walk(start, end, statuses, limit)
+                keys = [row[:2] for row in rows]
+                self.assertEqual(keys, sorted(set(keys)), (label, limit))
+                self.assertTrue(all(start <= day <= end for day, _ in keys), (label, limit))
+                sparse[label, limit] = rows
+            self.assertTrue(sparse[label, 100], label)
+            self.assertEqual(sparse[label, 1], sparse[label, 100], label)
+
+        self.materialize()
+        with self.settings(VACCINATION_STORAGE='dense'):
+            for (label, limit), rows in sparse.items():
+                start, end, statuses = dict(self.WINDOWS)[label](self.today)
+                self.assertEqual(self.walk(start, end, statuses, limit), rows, (label, limit))
+
+    def test_stored_exceptions_replace_their_derived_entries(self):
+        first, second, third, _ = self.patients
+        rows = self.walk(self.today - timedelta(days=120), self.today + timedelta(days=90), Vaccination.OVERDUE_STATUSES, 100)
+        vaccines = {(pk, name) for _, pk, names in rows for name in names}
+        self.assertIn((second.pk, 'Typhoid Catch-up'), vaccines)
+        self.assertIn((first.pk, 'OPV-0'), vaccines)
+        self.assertNotIn((first.pk, 'BCG'), vaccines)
+        self.assertNotIn((third.pk, 'OPV-0'), vaccines)
+
+        response = self.client.get('/api/vaccinations/worklist/', {'window': 'week', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([g['vaccines'] for g in response.data['results']], [['Typhoid Catch-up']])
+        self.assertIsNone(response.data['next'])
+
+    def test_rollover_grace_days_are_rejected(self):
+        with self.assertRaises(CommandError):
+            call_command('rollover_vaccinations', '--grace-days', '10', stdout=StringIO())
+        call_command('rollover_vaccinations', stdout=StringIO())
+
+
+class GrowthZScoreTests(TestCase):
+    def test_matches_who_reference_points(self):
+        # Boys weight-for-age at birth: median 3.3464 kg, +2 SD ~4.4 kg, -3 SD ~2.1 kg
+        z = zscores('wfa', 'Male', [0, 0, 0], [3.3464, 4.4, 2.1])
+        self.assertAlmostEqual(z[0], 0, places=4)
+        self.assertAlmostEqual(z[1], 2, delta=0.05)
+        self.assertAlmostEqual(z[2], -3, delta=0.1)
+
+    def test_scores_whole_history_in_one_call(self):
+        scores = growth_zscores(
+            ['Female', 'Female', 'Male'], [0, 365, 2500],
+            weight=[3.2322, 8.9481, 20], height=[49.1477, 74.0, 115]
+        )
+        self.assertAlmostEqual(scores['wfa'][0], 0, places=3)
+        self.assertAlmostEqual(scores['hfa'][1], 0, delta=0.05)
+        # Beyond the 0-5 year standards
+        self.assertTrue(np.isnan(scores['hfa'][2]))
+
+
+class GrowthApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        dob = date(2022, 1, 1)
+        self.patient = Patient.objects.create(name='Growth Child', dob=dob, gender='Male', father_height=176, mother_height=163)
+        self.other = Patient.objects.create(name='No Visits', dob=dob, gender='Female', father_height=176, mother_height=163)
+        Visit.objects.create(patient=self.patient, date=dob + timedelta(days=183), age=0.5, height=67.6, weight=7.9, head_circumference=43.3)
+        # Head circumference not measured at this visit
+        Visit.objects.create(patient=self.patient, date=dob + timedelta(days=365), age=1, height=75.7, weight=9.6)
+
+    def test_patient_payload_has_parallel_arrays_with_gaps_as_none(self):
+        response = self.client.get(f'/api/patients/growth/?id={self.patient.id}')
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual(data['dates'], [date(2022, 7, 3), date(2023, 1, 1)])
+        self.assertEqual(data['age_days'], [183, 365])
+        self.assertLessEqual({'wfa', 'hfa', 'wfh', 'hcfa'}, set(data['indicators']))
+        for indicator in data['indicators'].values():
+            self.assertEqual((len(indicator['z']), len(indicator['percentile'])), (2, 2))
+        self.assertAlmostEqual(data['indicators']['wfa']['z'][0], 0, delta=0.1)
+        self.assertIsNotNone(data['indicators']['hcfa']['z'][0])
+        self.assertIsNone(data['indicators']['hcfa']['z'][1])
+        self.assertIsNone(data['indicators']['hcfa']['percentile'][1])
+        # Strict JSON: no NaN literals
+        self.assertIsNone(json.loads(response.content)['indicators']['hcfa']['z'][1])
+
+    def test_unknown_or_invalid_patients(self):
+        self.assertEqual(self.client.get('/api/patients/growth/').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/patients/growth/?id={uuid.uuid4()}').status_code, 404)
+        self.assertEqual(self.client.get('/api/patients/growth/?id=not-a-uuid').status_code, 404)
+
+    def test_batch_returns_known_patients_keyed_by_id(self):
+        response = self.client.post('/api/growth/batch/', {'ids': [str(self.patient.id), str(self.other.id), str(uuid.uuid4())]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {str(self.patient.id), str(self.other.id)})
+        single = self.client.get(f'/api/patients/growth/?id={self.patient.id}').data
+        self.assertEqual(response.data[str(self.patient.id)], single)
+        self.assertEqual(response.data[str(self.other.id)]['dates'], [])
+
+        for ids in (None, [], 'abc', ['not-a-uuid'], ['x'] * (GrowthBatchView.MAX_PATIENTS + 1)):
+            response = self.client.post('/api/growth/batch/', {'ids': ids}, format='json')
+            self.assertEqual(response.status_code, 400, ids)
+
+    def test_batch_is_for_staff_only(self):
+        self.client.force_authenticate(User.objects.create_user('parent', password='pass'))
+        response = self.client.post('/api/growth/batch/', {'ids': [str(self.patient.id)]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class GrowthScreenTests(TestCase):
+    def add_patient(self, pk, weights):
+        dob = date(2022, 1, 1)
+        patient = Patient.objects.create(
+            id=uuid.UUID(int=pk), name=f'Screen {pk}', dob=dob, gender='Male',
+            father_height=176, mother_height=163
+        )
+        for months, (weight, height) in zip((6, 12), weights):
+            Visit.objects.create(patient=patient, date=dob + timedelta(days=months * 30), age=0, height=height, weight=weight)
+        return patient
+
+    def test_flags_faltering_but_not_implausible_outliers(self):
+        # Weight entered in grams, then growing along the median
+        outlier = self.add_patient(1, [(7900, 67.6), (9.6, 75.7)])
+        steady = self.add_patient(2, [(7.9, 67.6), (9.6, 75.7)])
+        # Median at six months, below the 9th percentile at a year
+        faltering = self.add_patient(3, [(7.9, 67.6), (8.0, 75.7)])
+
+        call_command('screen_growth', stdout=StringIO())
+
+        crossings = set(GrowthFlag.objects.filter(kind='weight_crossing').values_list('patient_id', flat=True))
+        self.assertIn(faltering.id, crossings)
+        self.assertNotIn(steady.id, crossings)
+        self.assertNotIn(outlier.id, crossings)
+
+    def test_flag_list_filters_by_kind_newest_first(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('doctor', 'doctor@example.com', 'pass'))
+        patients = [self.add_patient(pk, []) for pk in (1, 2, 3)]
+        for patient, kind, detected_on in [
+            (patients[0], 'weight_crossing', date(2023, 1, 1)),
+            (patients[1], 'weight_crossing', date(2023, 3, 1)),
+            (patients[2], 'weight_crossing', date(2023, 1, 1)),
+            (patients[0], 'low_weight_for_height', date(2023, 6, 1)),
+        ]:
+            GrowthFlag.objects.create(patient=patient, kind=kind, z_score=-2.5, detected_on=detected_on)
+
+        response = self.client.get('/api/growth/flags/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([flag['detected_on'] for flag in response.data], [date(2023, 6, 1), date(2023, 3, 1), date(2023, 1, 1), date(2023, 1, 1)])
+
+        response = self.client.get('/api/growth/flags/', {'kind': 'weight_crossing', 'limit': 2})
+        self.assertEqual([(flag['patient_id'], flag['kind']) for flag in response.data], [
+            (patients[1].id, 'weight_crossing'), (patients[0].id, 'weight_crossing'),
+        ])
+        self.assertEqual(response.data[0]['patient_name'], 'Screen 2')
+        self.assertEqual(self.client.get('/api/growth/flags/', {'kind': 'tall'}).status_code, 400)
@@ -1,8 +1,9 @@
 from django.urls import path, include
 from .views import (
     LoginView,
-    PatientListView, PatientCreateView, PatientDetailView,
-    VisitCreateView, VisitUpdateView, VisitDeleteView, DashboardView,
+    PatientListView, PatientCreateView, PatientImportView, PatientDetailView, PatientGrowthView, PatientVitalsView, GrowthBatchView, GrowthFlagListView,
+    VisitCreateView, VisitUpdateView, VisitDeleteView, DashboardView, DashboardTrendsView, AnalyticsView, SearchView,
+    VaccinationWorklistView,
     AIChatView, AISummarizeView,
     ChatSessionListView, ChatSessionCreateView, ChatSessionMessagesView, ChatSessionDeleteView,
     AttachmentCreateView, ScanAnalysisView, ScanResultUpdateView
@@ -12,11 +13,20 @@ urlpatterns = [
     path('login/', LoginView.as_view(), name='login'),
     path('patients/list/', PatientListView.as_view(), name='patient-list'),
     path('patients/create/', PatientCreateView.as_view(), name='patient-create'),
+    path('patients/import/', PatientImportView.as_view(), name='patient-import'),
     path('patients/detail/', PatientDetailView.as_view(), name='patient-detail'),
+    path('patients/growth/', PatientGrowthView.as_view(), name='patient-growth'),
+    path('patients/vitals/', PatientVitalsView.as_view(), name='patient-vitals'),
+    path('growth/batch/', GrowthBatchView.as_view(), name='growth-batch'),
+    path('growth/flags/', GrowthFlagListView.as_view(), name='growth-flags'),
     path('visits/create/', VisitCreateView.as_view(), name='visit-create'),
     path('visits/update/', VisitUpdateView.as_view(), name='visit-update'),
     path('visits/delete/', VisitDeleteView.as_view(), name='visit-delete'),
     path('dashboard/', DashboardView.as_view(), name='dashboard'),
+    path('dashboard/trends/', DashboardTrendsView.as_view(), name='dashboard-trends'),
+    path('analytics/', AnalyticsView.as_view(), name='analytics'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('vaccinations/worklist/', VaccinationWorklistView.as_view(), name='vaccination-worklist'),
     path('ai/chat/', AIChatView.as_view(), name='ai-chat'),
     path('ai/summarize/', AISummarizeView.as_view(), name='ai-summarize'),
 
@@ -1,77 +1,87 @@
-import os
+import asyncio
 import base64
 import json
 import re
-from dotenv import load_dotenv
 from datetime import date
-from langchain_google_genai import ChatGoogleGenerativeAI
+from asgiref.sync import sync_to_async
 from langchain_core.messages import HumanMessage
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from .models import ScanResult, Vaccination, Patient, Visit, Attachment
+from .models import ScanResult, Attachment
+from .llm import chat_model, prompt_chain, response_key, cached_response, acached_response
+from .clinical_context import get_clinical_context
 from .prompts import (
     SCAN_ANALYSIS_PROMPT, SCAN_JSON_FORMAT_PROMPT,
-    DOCTOR_MODE_SYSTEM_PROMPT, PATIENT_MODE_SYSTEM_PROMPT,
+    DOCTOR_MODE_SYSTEM_PROMPT, PATIENT_MODE_SYSTEM_PROMPT, ATTACHMENT_ANALYSIS_CONTEXT,
     INCREMENTAL_SUMMARY_TEMPLATE, FULL_SUMMARY_TEMPLATE
 )
 
-load_dotenv()
+# Utilities for Pediatrician App
 
-API_KEY = os.getenv("GEMINI_API_KEY")
+SCAN_MODEL = "gemini-2.5-flash"
+SCAN_TEMPERATURE = 0.2
 
-# Utilities for Pediatrician App
+def _scan_key(image_bytes):
+    return response_key(SCAN_MODEL, SCAN_TEMPERATURE, SCAN_ANALYSIS_PROMPT + SCAN_JSON_FORMAT_PROMPT, image_bytes)
+
+def _scan_messages(image_bytes):
+    image_data = base64.b64encode(image_bytes).decode("utf-8")
+    return [
+        HumanMessage(
+            content=[
+                {"type": "text", "text": SCAN_ANALYSIS_PROMPT},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}}
+            ]
+        ),
+        HumanMessage(
+            content=SCAN_JSON_FORMAT_PROMPT
+        )
+    ]
+
+def _parse_scan_response(content):
+    json_match = re.search(r'\{.*\}', content, re.DOTALL)
+    if json_match:
+        json_str = json_match.group(0)
+        return json.loads(json_str)
+    return {
+        'modality': 'Unknown',
+        'findings': content,
+        'impression': 'See findings.'
+    }
 
-def analyze_scan_helper(attachment):
+def _scan_result_data(scan_result):
+    return {
+        'modality': scan_result.modality,
+        'findings': scan_result.findings,
+        'impression': scan_result.impression
+    }
+
+def _read_file(file_field):
+    with open(file_field.path, "rb") as image_file:
+        return image_file.read()
+
+async def aanalyze_scan_helper(attachment):
     """
-    Helper function to analyze a scan attachment using Gemini Vision.
-    Returns a dict with 'findings', 'impression', 'modality'.
+    Analyzes a scan attachment using Gemini Vision, or returns its stored
+    analysis. Returns a dict with 'findings', 'impression', 'modality'.
+    The model call is awaited and the image is read in a thread, so no
+    event-loop time is spent blocking.
     """
     try:
-        if hasattr(attachment, 'scan_analysis') and attachment.scan_analysis:
-            return {
-                'modality': attachment.scan_analysis.modality,
-                'findings': attachment.scan_analysis.findings,
-                'impression': attachment.scan_analysis.impression
-            }
-
-        image_path = attachment.file.path
-        
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            google_api_key=API_KEY,
-            temperature=0.2
-        )
-        
-        with open(image_path, "rb") as image_file:
-            image_data = base64.b64encode(image_file.read()).decode("utf-8")
-            
-        messages = [
-            HumanMessage(
-                content=[
-                    {"type": "text", "text": SCAN_ANALYSIS_PROMPT},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}}
-                ]
-            ),
-            HumanMessage(
-                content=SCAN_JSON_FORMAT_PROMPT
-            )
-        ]
-        
-        response = llm.invoke(messages)
-        content = response.content
-        
-        json_match = re.search(r'\{.*\}', content, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(0)
-            data = json.loads(json_str)
+        if Attachment.scan_analysis.is_cached(attachment):
+            scan_result = getattr(attachment, 'scan_analysis', None)
         else:
-            data = {
-                'modality': 'Unknown',
-                'findings': content,
-                'impression': 'See findings.'
-            }
+            scan_result = await ScanResult.objects.filter(attachment=attachment).afirst()
+        if scan_result:
+            return _scan_result_data(scan_result)
+
+        image_bytes = await asyncio.to_thread(_read_file, attachment.file)
+
+        async def call():
+            response = await chat_model(SCAN_MODEL, SCAN_TEMPERATURE).ainvoke(_scan_messages(image_bytes))
+            return response.content
+
+        data = _parse_scan_response(await acached_response(_scan_key(image_bytes), call))
 
-        ScanResult.objects.create(
+        await ScanResult.objects.acreate(
             attachment=attachment,
             modality=data.get('modality', 'Unknown'),
             findings=data.get('findings', ''),
@@ -83,33 +93,56 @@ def analyze_scan_helper(attachment):
         print(f"Analysis Helper Error: {e}")
         return None
 
-def get_ai_response(messages, model="gemini-2.5-flash-lite", temperature=0.7):
+async def aget_ai_response(messages, model="gemini-2.5-flash-lite", temperature=0.7):
+    llm = chat_model(model, temperature)
+    return await llm.ainvoke(messages)
+
+async def astream_ai_response(messages, model="gemini-2.5-flash-lite", temperature=0.7):
+    """
+    Like aget_ai_response, but yields the reply as text pieces as the model
+    produces them.
     """
-    Helper to get a response from a chat model.
+    llm = chat_model(model, temperature)
+    async for chunk in llm.astream(messages):
+        text = message_text(chunk.content)
+        if text:
+            yield text
+
+def message_text(content):
     """
-    llm = ChatGoogleGenerativeAI(
-        model=model,
-        google_api_key=API_KEY,
-        temperature=temperature
-    )
-    return llm.invoke(messages)
+    Plain text of a model message's content, which may be a string, a list
+    of content blocks, or a JSON-encoded list of blocks.
+    """
+    if isinstance(content, str) and content.strip().startswith('['):
+        try:
+            parsed_content = json.loads(content)
+            if isinstance(parsed_content, list):
+                content = parsed_content
+        except json.JSONDecodeError:
+            pass
+
+    if isinstance(content, list):
+        text_blocks = [block.get('text', '') for block in content if isinstance(block, dict) and block.get('type') == 'text']
+        return "\n".join(text_blocks) if text_blocks else " ".join([str(c) for c in content])
+    if hasattr(content, 'text'):
+        return content.text
+    if not isinstance(content, str):
+        return str(content)
+    return content
 
 def get_llm_chain_response(template, variables, model="gemini-flash-latest", temperature=0.2):
     """
-    Helper to get a response from a prompt template chain.
+    Helper to get a response from a prompt template chain. Identical
+    rendered prompts are answered from the LLM response cache.
     """
-    model_instance = ChatGoogleGenerativeAI(
-        model=model,
-        google_api_key=API_KEY,
-        temperature=temperature
-    )
-        
-    prompt = PromptTemplate(
-        template=template,
-        input_variables=list(variables.keys())
-    )
-    chain = prompt | model_instance | StrOutputParser()
-    return chain.invoke(variables)
+    chain = prompt_chain(template, model, temperature)
+    key = response_key(model, temperature, chain.first.format(**variables))
+    return cached_response(key, lambda: chain.invoke(variables))
+
+async def aget_llm_chain_response(template, variables, model="gemini-flash-latest", temperature=0.2):
+    chain = prompt_chain(template, model, temperature)
+    key = response_key(model, temperature, chain.first.format(**variables))
+    return await acached_response(key, lambda: chain.ainvoke(variables))
 
 def get_vitals_summary(patient_id):
     """
@@ -118,30 +151,25 @@ def get_vitals_summary(patient_id):
     if not patient_id:
         return "None"
     
-    last_visit = Visit.objects.filter(patient_id=patient_id).order_by('-date').first()
-    if not last_visit:
+    context = get_clinical_context(patient_id)
+    if not context or not context['vitals']:
         return "None"
-        
-    vitals = f"Weight: {last_visit.weight} kg, Height: {last_visit.height} cm"
-    if last_visit.head_circumference:
-        vitals += f", Head Circumference: {last_visit.head_circumference} cm"
-    return vitals
+    return context['vitals']
 
-def get_pediatric_system_prompt(patient_id, patient_stats, mode, history, attachment_id=None):
+def get_pediatric_system_prompt(patient_id, patient_stats, mode, history, scan_analysis=None, ai_message_count=None):
     """
     Builds the complete system prompt for AIChat based on patient context.
+    `scan_analysis` is the analyze_scan_helper result for an attached scan.
+    `ai_message_count` overrides counting AI messages in `history`, for
+    callers passing only the latest part of a conversation.
     """
+    context = get_clinical_context(patient_id) if patient_id else None
+
     missing_info = []
-    if not patient_stats.get('age'): missing_info.append("Age")
+    if not patient_stats.get('age') and not context: missing_info.append("Age")
     
-    if patient_id:
-        last_visit = Visit.objects.filter(patient_id=patient_id).order_by('-date').first()
-        if last_visit:
-            if not last_visit.weight: missing_info.append("Weight")
-            if not last_visit.height: missing_info.append("Height")
-        else:
-            if not patient_stats.get('weight'): missing_info.append("Weight")
-            if not patient_stats.get('height'): missing_info.append("Height")
+    if context and context['has_visit']:
+        missing_info.extend(context['missing'])
     else:
         if not patient_stats.get('weight'): missing_info.append("Weight")
         if not patient_stats.get('height'): missing_info.append("Height")
@@ -150,26 +178,16 @@ def get_pediatric_system_prompt(patient_id, patient_stats, mode, history, attach
     missing_prompt = ""
     if missing_info:
         missing_prompt = f"\n\nCRITICAL: The patient's record is missing: {', '.join(missing_info)}. You MUST ask the parent for these specific values."
-    else:
-        vitals_text = get_vitals_summary(patient_id)
-        if vitals_text != "None":
-            missing_prompt = f"\n\nNote: We already have recent vitals ({vitals_text}). Do NOT ask for weight, height, or head circumference again unless relevant."
+    elif context and context['vitals']:
+        missing_prompt = f"\n\nNote: We already have recent vitals ({context['vitals']}). Do NOT ask for weight, height, or head circumference again unless relevant."
         
 
     vaccine_prompt = ""
-    if patient_id:
-        pending_vax_qs = Vaccination.objects.filter(
-            patient_id=patient_id, 
-            status='Pending', 
-            due_date__lte=date.today()
-        ).values_list('vaccine_name', flat=True)
-        
-        pending_vaccines = list(pending_vax_qs)
-        if pending_vaccines:
-            vaccine_list = ", ".join(pending_vaccines)
-            vaccine_prompt = f"\n\n**Vaccination Check**: The patient is due/overdue for the following vaccines: {vaccine_list}. Ask if any of these have been administered recently by another doctor."
+    if context and context['overdue_vaccines']:
+        vaccine_list = ", ".join(context['overdue_vaccines'])
+        vaccine_prompt = f"\n\n**Vaccination Check**: The patient is due/overdue for the following vaccines: {vaccine_list}. Ask if any of these have been administered recently by another doctor."
 
-    age_val = patient_stats.get('age')
+    age_val = patient_stats.get('age') or (context and context['age'])
     age_prompt = ""
     if age_val:
         age_prompt = f"\n\n**Patient Age**: {age_val}. Adjust your questions to be appropriate for a child of this age."
@@ -180,7 +198,9 @@ def get_pediatric_system_prompt(patient_id, patient_stats, mode, history, attach
             missing_prompt=missing_prompt
         )
     else:
-        ai_msg_count = sum(1 for m in history if m.get('role') == 'ai' or m.get('sender') == 'ai')
+        ai_msg_count = ai_message_count
+        if ai_msg_count is None:
+            ai_msg_count = sum(1 for m in history if m.get('role') == 'ai' or m.get('sender') == 'ai')
         
         limit_prompt = ""
         if ai_msg_count >= 10:
@@ -195,57 +215,52 @@ def get_pediatric_system_prompt(patient_id, patient_stats, mode, history, attach
             limit_prompt=limit_prompt
         )
 
-    if attachment_id:
-        try:
-            attachment = Attachment.objects.get(id=attachment_id)
-            analysis_result = analyze_scan_helper(attachment)
-            
-            if analysis_result:
-                analysis_context = ATTACHMENT_ANALYSIS_CONTEXT.format(
-                    modality=analysis_result.get('modality'),
-                    findings=analysis_result.get('findings'),
-                    impression=analysis_result.get('impression')
-                )
-                system_prompt_content += analysis_context
-        except Exception as e:
-            print(f"Attachment Prompt Context Error: {e}")
+    if scan_analysis:
+        system_prompt_content += ATTACHMENT_ANALYSIS_CONTEXT.format(
+            modality=scan_analysis.get('modality'),
+            findings=scan_analysis.get('findings'),
+            impression=scan_analysis.get('impression')
+        )
 
     return system_prompt_content
 
-def generate_chat_summary(history, patient_id, session, model="gemini-flash-latest"):
+def summary_prompt(previous_summary, new_messages, latest_vitals):
     """
-    Handles incremental or full chat summarization.
+    (template, variables) for a summary: the incremental template updating
+    `previous_summary` with `new_messages` when there is one, the full
+    template over `new_messages` otherwise.
     """
-    latest_vitals = get_vitals_summary(patient_id)
-    previous_summary = None
     new_messages_text = ""
-    current_msg_count = len(history)
-
-    if session and session.summary and session.cached_message_count < current_msg_count:
-        previous_summary = session.summary
-        new_msgs = history[session.cached_message_count:]
-        for msg in new_msgs:
-            role = "Parent" if msg.get('role') == 'user' else "Assistant"
-            new_messages_text += f"{role}: {msg.get('text')}\n"
-    else:
-        for msg in history:
-            role = "Parent" if msg.get('role') == 'user' else "Assistant"
-            new_messages_text += f"{role}: {msg.get('text')}\n"
+    for msg in new_messages:
+        role = "Parent" if msg.get('role') == 'user' else "Assistant"
+        new_messages_text += f"{role}: {msg.get('text')}\n"
 
     current_date_str = date.today().strftime("%Y-%m-%d")
 
     if previous_summary:
-        result = get_llm_chain_response(INCREMENTAL_SUMMARY_TEMPLATE, {
+        return INCREMENTAL_SUMMARY_TEMPLATE, {
             "previous_summary": previous_summary,
             "new_messages_text": new_messages_text,
             "latest_vitals": latest_vitals,
             "current_date": current_date_str
-        }, model=model)
-    else:
-        result = get_llm_chain_response(FULL_SUMMARY_TEMPLATE, {
-            "new_messages_text": new_messages_text,
-            "latest_vitals": latest_vitals,
-            "current_date": current_date_str
-        }, model=model)
-    
+        }
+    return FULL_SUMMARY_TEMPLATE, {
+        "new_messages_text": new_messages_text,
+        "latest_vitals": latest_vitals,
+        "current_date": current_date_str
+    }
+
+def _clean_summary(result):
     return result.replace('```json', '').replace('```', '').strip()
+
+def summarize_messages(previous_summary, new_messages, patient_id, model="gemini-flash-latest"):
+    template, variables = summary_prompt(previous_summary, new_messages, get_vitals_summary(patient_id))
+    return _clean_summary(get_llm_chain_response(template, variables, model=model))
+
+async def asummarize_messages(previous_summary, new_messages, patient_id, model="gemini-flash-latest"):
+    latest_vitals = await sync_to_async(get_vitals_summary)(patient_id)
+    template, variables = summary_prompt(previous_summary, new_messages, latest_vitals)
+    return _clean_summary(await aget_llm_chain_response(template, variables, model=model))
+
+async def agenerate_chat_summary(history, patient_id, model="gemini-flash-latest"):
+    return await asummarize_messages(None, history, patient_id, model=model)
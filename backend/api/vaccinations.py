@@ -0,0 +1,321 @@
+import heapq
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Patient, Vaccination
+from .schedule import SCHEDULE, SCHEDULE_GROUPS, SCHEDULE_OFFSETS, sparse_storage, derived_status, merge_schedule
+from .summaries import refresh_patient_summaries
+from .cache import bump_patient_version
+from .analytics import mark_days_dirty
+from .stats import record_missed_rollover
+from .clinical_context import invalidate_clinical_context
+
+# Set-based vaccination writes. These use bulk_update/bulk_create, which
+# skip model signals, so callers go through vaccinations_changed() to keep
+# summaries, cached payloads and analytics in step.
+#
+# Inside batched_record_changes(), that bookkeeping, and the same work the
+# Visit and Vaccination signals do per saved row, is collected and done
+# once when the block exits.
+
+RECONCILED_FIELDS = ['status', 'visit', 'given_at']
+
+_pending_changes = ContextVar('pending_record_changes', default=None)
+
+
+@contextmanager
+def batched_record_changes():
+    if _pending_changes.get() is not None:
+        yield
+        return
+    patient_ids, days = set(), set()
+    token = _pending_changes.set((patient_ids, days))
+    try:
+        yield
+    finally:
+        _pending_changes.reset(token)
+    vaccinations_changed(patient_ids, days)
+
+
+def defer_record_changes(patient_ids, days=()):
+    """Adds to the enclosing batched_record_changes(); False outside one."""
+    pending = _pending_changes.get()
+    if pending is None:
+        return False
+    pending[0].update(patient_ids)
+    pending[1].update(day for day in days if day)
+    return True
+
+
+def vaccinations_changed(patient_ids, days=()):
+    if defer_record_changes(patient_ids, days):
+        return
+    patient_ids = list(patient_ids)
+    if patient_ids:
+        refresh_patient_summaries(patient_ids)
+        bump_patient_version(pk__in=patient_ids)
+        invalidate_clinical_context(*patient_ids)
+    mark_days_dirty(*days)
+
+
+def schedule_rows(patient_id, dob, skip=()):
+    """
+    Unsaved Pending Vaccination rows for a patient's full schedule, leaving
+    out vaccine names in `skip`. Empty in sparse storage mode, where the
+    schedule is derived on read instead of stored.
+    """
+    if sparse_storage():
+        return []
+    return [
+        Vaccination(patient_id=patient_id, vaccine_name=name, due_date=dob + offset)
+        for name, offset in SCHEDULE
+        if name not in skip
+    ]
+
+
+def parse_vaccine_names(vaccines):
+    if isinstance(vaccines, str):
+        vaccines = vaccines.split(',')
+    names = []
+    for name in vaccines or []:
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def reconcile_visit_vaccines(visit, vaccines):
+    """
+    Makes `vaccines` exactly the set of vaccines given at `visit`: matching
+    schedule rows are marked Given, unknown names become ad-hoc Given rows,
+    and vaccines previously recorded at this visit but no longer listed go
+    back to Pending. Runs in a constant number of queries.
+
+    In sparse storage mode, new rows for scheduled vaccines keep their
+    scheduled due date, and scheduled vaccines going back to Pending are
+    deleted so they are derived again.
+    """
+    names = parse_vaccine_names(vaccines)
+    touched_days = {visit.date}
+    sparse = sparse_storage()
+    dob = visit.patient.dob if sparse else None
+
+    # No savepoint of its own; an error here should undo the caller's
+    # changes (the visit save) as well.
+    with transaction.atomic(savepoint=False), batched_record_changes():
+        existing = list(
+            Vaccination.objects.select_for_update()
+            .filter(Q(patient_id=visit.patient_id, vaccine_name__in=names) | Q(visit=visit))
+        )
+        by_name = {v.vaccine_name: v for v in existing if v.patient_id == visit.patient_id}
+
+        changed = []
+        removed = []
+        for vaccination in existing:
+            if vaccination.vaccine_name in names and vaccination.patient_id == visit.patient_id:
+                continue
+            touched_days.add(vaccination.given_at)
+            if sparse and vaccination.vaccine_name in SCHEDULE_OFFSETS:
+                removed.append(vaccination.pk)
+                continue
+            vaccination.status = 'Pending'
+            vaccination.visit = None
+            vaccination.given_at = None
+            changed.append(vaccination)
+
+        missing = []
+        for name in names:
+            vaccination = by_name.get(name)
+            if vaccination is None:
+                scheduled = sparse and name in SCHEDULE_OFFSETS
+                missing.append(Vaccination(
+                    patient_id=visit.patient_id,
+                    vaccine_name=name,
+                    due_date=dob + SCHEDULE_OFFSETS[name] if scheduled else visit.date,
+                    status='Given',
+                    visit=visit,
+                    given_at=visit.date
+                ))
+                continue
+            if (vaccination.status, vaccination.visit_id, vaccination.given_at) == ('Given', visit.pk, visit.date):
+                continue
+            touched_days.add(vaccination.given_at)
+            vaccination.status = 'Given'
+            vaccination.visit = visit
+            vaccination.given_at = visit.date
+            changed.append(vaccination)
+
+        if changed:
+            Vaccination.objects.bulk_update(changed, RECONCILED_FIELDS)
+        if removed:
+            Vaccination.objects.filter(pk__in=removed).delete()
+        if missing:
+            # A concurrent request may have inserted the same (patient, name);
+            # the unique constraint turns that race into an update.
+            Vaccination.objects.bulk_create(
+                missing,
+                update_conflicts=True,
+                unique_fields=['patient', 'vaccine_name'],
+                update_fields=RECONCILED_FIELDS,
+            )
+
+        if changed or removed or missing:
+            vaccinations_changed([visit.patient_id], touched_days)
+
+
+def overdue_vaccine_names(patient_id, today=None):
+    today = today or date.today()
+    if sparse_storage():
+        patient = Patient.objects.filter(pk=patient_id).only('dob').first()
+        if patient is None:
+            return []
+        vaccinations = merge_schedule(patient_id, patient.dob, Vaccination.objects.filter(patient_id=patient_id), today)
+        return [
+            v.vaccine_name for v in vaccinations
+            if v.status in Vaccination.OVERDUE_STATUSES and v.due_date <= today
+        ]
+    # Missed rows are always past due, so this stays one range per status.
+    return list(Vaccination.objects.filter(
+        patient_id=patient_id,
+        status__in=Vaccination.OVERDUE_STATUSES,
+        due_date__lte=today
+    ).values_list('vaccine_name', flat=True))
+
+
+def rollover_missed_vaccinations(grace_days=None, chunk_size=1000, today=None):
+    """
+    Moves Pending vaccinations more than `grace_days` past due to Missed,
+    `chunk_size` rows per UPDATE. Only Pending rows are touched, so reruns
+    are no-ops. Returns the number of rows changed, which is also added to
+    the day's missed_rollover DailyStat along with each chunk.
+    """
+    if grace_days is None:
+        grace_days = settings.VACCINATION_MISSED_GRACE_DAYS
+    today = today or date.today()
+    cutoff = today - timedelta(days=grace_days)
+    overdue = Vaccination.objects.filter(status='Pending', due_date__lt=cutoff)
+
+    # Leaves a row for the day even when nothing was due
+    record_missed_rollover(today, 0)
+    changed = 0
+    while True:
+        chunk = list(overdue.order_by('due_date', 'patient_id', 'id').values_list('id', 'patient_id')[:chunk_size])
+        if not chunk:
+            return changed
+        with transaction.atomic():
+            updated = Vaccination.objects.filter(pk__in=[pk for pk, _ in chunk], status='Pending').update(status='Missed')
+            vaccinations_changed({patient_id for _, patient_id in chunk})
+            record_missed_rollover(today, updated)
+        changed += updated
+
+
+def due_worklist(start, end, after=None, limit=100, statuses=('Pending',)):
+    """
+    One page of the clinic-wide worklist: vaccinations in `statuses` due in
+    [start, end], walked in (due_date, patient) order along
+    vaccination_worklist_idx. A page holds about `limit` rows and always
+    ends on a complete (due_date, patient) group. `after` is the
+    (due_date, patient_id) of the previous page's last group.
+
+    Returns (groups, next_position) where each group is
+    {'due_date', 'patient_id', 'patient_name', 'vaccines'}.
+    """
+    if sparse_storage():
+        return _sparse_due_worklist(start, end, after, limit, statuses)
+    return _stored_due_worklist(start, end, after, limit, statuses)
+
+
+def _stored_due_worklist(start, end, after, limit, statuses):
+    rows = Vaccination.objects.filter(due_date__range=(start, end))
+    if after:
+        due_date, patient_id = after
+        rows = rows.filter(Q(due_date__gt=due_date) | Q(due_date=due_date, patient_id__gt=patient_id))
+    fields = ('due_date', 'patient_id', 'id', 'patient__name', 'vaccine_name')
+    # One query per status, each read in order off vaccination_worklist_idx,
+    # merged here; a single status__in query would have to sort every match.
+    page = list(islice(heapq.merge(
+        *(rows.filter(status=s).order_by('due_date', 'patient_id', 'id').values_list(*fields)[:limit + 1] for s in statuses),
+        key=lambda row: row[:3]
+    ), limit + 1))
+
+    has_more = len(page) > limit
+    if has_more:
+        page = page[:limit]
+        # Finish the last group so a patient's due date never straddles pages.
+        last_date, last_patient = page[-1][0], page[-1][1]
+        seen = sum(1 for row in page if row[:2] == (last_date, last_patient))
+        page += list(
+            rows.filter(status__in=statuses, due_date=last_date, patient_id=last_patient)
+            .order_by('id').values_list(*fields)[seen:]
+        )
+
+    groups = []
+    for due_date, patient_id, _, patient_name, vaccine_name in page:
+        if not groups or (groups[-1]['due_date'], groups[-1]['patient_id']) != (due_date, patient_id):
+            groups.append({'due_date': due_date, 'patient_id': patient_id, 'patient_name': patient_name, 'vaccines': []})
+        groups[-1]['vaccines'].append(vaccine_name)
+
+    next_position = (groups[-1]['due_date'], groups[-1]['patient_id']) if has_more else None
+    return groups, next_position
+
+
+def _sparse_due_worklist(start, end, after, limit, statuses):
+    """
+    Sparse-mode worklist: stored rows merged with schedule entries derived
+    from patient dobs, one dob range query per schedule age. Every source
+    is complete up to its last fetched position, so the page stops at the
+    earliest such position among truncated sources.
+    """
+    today = date.today()
+    stored_groups, stored_next = _stored_due_worklist(start, end, after, limit, statuses)
+    candidates = {(g['due_date'], g['patient_id']): g for g in stored_groups}
+    bounds = [stored_next] if stored_next else []
+
+    derived = []
+    for offset, names in SCHEDULE_GROUPS:
+        patients = Patient.objects.filter(dob__range=(max(start, date.min + offset) - offset, end - offset))
+        if after:
+            due_date, patient_id = after
+            patients = patients.filter(Q(dob__gt=due_date - offset) | Q(dob=due_date - offset, pk__gt=patient_id))
+        rows = list(patients.order_by('dob', 'pk').values_list('dob', 'pk', 'name')[:limit + 1])
+        if len(rows) > limit:
+            rows = rows[:limit]
+            bounds.append((rows[-1][0] + offset, rows[-1][1]))
+        derived.extend((dob + offset, pk, name, names) for dob, pk, name in rows)
+
+    bound = min(bounds) if bounds else None
+    derived = [row for row in derived if bound is None or row[:2] <= bound]
+    stored_names = set(
+        Vaccination.objects.filter(patient_id__in={pk for _, pk, _, _ in derived})
+        .values_list('patient_id', 'vaccine_name')
+    )
+    for due_date, patient_id, patient_name, names in derived:
+        if derived_status(due_date, today) not in statuses:
+            continue
+        vaccines = [name for name in names if (patient_id, name) not in stored_names]
+        if not vaccines:
+            continue
+        group = candidates.setdefault((due_date, patient_id), {
+            'due_date': due_date, 'patient_id': patient_id, 'patient_name': patient_name, 'vaccines': []
+        })
+        group['vaccines'].extend(vaccines)
+
+    groups = []
+    rows = 0
+    for key in sorted(candidates):
+        if bound is not None and key > bound:
+            break
+        groups.append(candidates[key])
+        rows += len(candidates[key]['vaccines'])
+        if rows >= limit:
+            break
+
+    more = bound is not None or len(groups) < len(candidates)
+    next_position = (groups[-1]['due_date'], groups[-1]['patient_id']) if groups and more else bound
+    return groups, next_position
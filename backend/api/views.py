@@ -1,7 +1,8 @@
 import os
 import json
+import codecs
 import random
-from datetime import date
+from datetime import date, timedelta
 from dotenv import load_dotenv
 
 from rest_framework import status
@@ -10,25 +11,61 @@ from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.utils.urls import replace_query_param
 
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from django.db.models import Avg, Count
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag, http_date
 
-from .models import Patient, Visit, Attachment, ChatSession, ChatMessage, Vaccination, ScanResult
+from .models import Patient, Visit, Attachment, ChatSession, ChatMessage, Vaccination, ScanResult, GrowthFlag
 from .utils import (
-    analyze_scan_helper, get_ai_response, get_llm_chain_response,
-    get_pediatric_system_prompt, get_vitals_summary,
-    generate_chat_summary
+    aanalyze_scan_helper, aget_ai_response, astream_ai_response, message_text,
+    agenerate_chat_summary
 )
 from .serializers import (
-    PatientSerializer, PatientDetailSerializer, 
+    PatientSerializer, PatientListItemSerializer,
     VisitSerializer, AttachmentSerializer
 )
+from .async_views import AsyncAPIView
+from .chat_turn import ChatTurn
+from .session_summaries import asummarize_session
+from .pagination import PatientCursorPagination, encode_cursor, decode_cursor
+from .summaries import ensure_fresh_summaries
+from .search import search_records, SEARCH_TYPES
+from .cache import render_patient_detail, bump_patient_version, patient_record_tag
+from .stats import (
+    get_dashboard_totals, get_daily_series,
+    DAILY_VISITS, DAILY_NEW_PATIENTS, DAILY_VISITS_BY_TYPE
+)
+from .analytics import visit_volume_by_week, top_diagnoses, vaccination_coverage, sick_visit_ratio
+from .vaccinations import due_worklist
+from .imports import import_patients, iter_records, guess_format, IMPORT_FORMATS
+from .growth import patient_growth, patients_growth
+from .vitals import vitals_columns
 
 API_KEY = os.getenv("GEMINI_API_KEY")
 
+def conditional_get(request, build, etag, last_modified=None):
+    """
+    Answers a conditional GET with 304 when the client's validators still
+    match; otherwise returns build()'s payload with ETag/Last-Modified set.
+    Clients must revalidate on every use, so caches never serve stale data.
+    """
+    etag = quote_etag(etag)
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = Response(build())
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
 class LoginView(APIView):
     permission_classes = [AllowAny]
 
@@ -60,6 +97,12 @@ class PatientListView(APIView):
             patients = Patient.objects.all().order_by('-created_at')
         else:
             patients = Patient.objects.filter(user=request.user)
+
+        if request.query_params.get('mode') == 'compact':
+            paginator = PatientCursorPagination()
+            page = paginator.paginate_queryset(patients.select_related('summary'), request, view=self)
+            serializer = PatientListItemSerializer(ensure_fresh_summaries(page), many=True)
+            return paginator.get_paginated_response(serializer.data)
             
         serializer = PatientSerializer(patients, many=True, context={'request': request})
         return Response(serializer.data)
@@ -91,7 +134,55 @@ class PatientCreateView(APIView):
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class PatientImportView(APIView):
+    """
+    Bulk import from an uploaded CSV or NDJSON `file`, streamed in batches.
+    `format` overrides the guess from the file name; `create_users=false`
+    skips patient logins.
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({'error': 'File required'}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get('format') or guess_format(upload.name)
+        if fmt not in IMPORT_FORMATS:
+            return Response({'error': 'format must be csv or ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            batch_size = min(max(int(request.data.get('batch_size', 500)), 1), 5000)
+        except ValueError:
+            return Response({'error': 'Invalid batch_size'}, status=status.HTTP_400_BAD_REQUEST)
+        create_users = str(request.data.get('create_users', 'true')).lower() not in ('false', '0')
+
+        result = import_patients(
+            iter_records(codecs.iterdecode(upload, 'utf-8-sig'), fmt),
+            batch_size=batch_size,
+            create_users=create_users,
+        )
+        # Batches before an unreadable part are committed; the counts say how far it got
+        ok = result['created'] and not result['error']
+        return Response(result, status=status.HTTP_201_CREATED if ok else status.HTTP_400_BAD_REQUEST)
+
 class PatientDetailView(APIView):
+    def get(self, request):
+        patient_id = request.query_params.get('id')
+        if not patient_id:
+             return Response({'error': 'Patient ID required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            patient = Patient.objects.get(pk=patient_id)
+        except (Patient.DoesNotExist, ValidationError, ValueError):
+            return Response({'error': 'Patient not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        return conditional_get(
+            request,
+            lambda: render_patient_detail(patient, request),
+            etag=f"patient-{patient.pk}-{patient_record_tag(patient)}"
+        )
+
     def post(self, request):
         patient_id = request.data.get('id')
         if not patient_id:
@@ -99,11 +190,102 @@ class PatientDetailView(APIView):
         
         try:
             patient = Patient.objects.get(pk=patient_id)
-            serializer = PatientDetailSerializer(patient, context={'request': request})
-            return Response(serializer.data)
+            return Response(render_patient_detail(patient, request))
         except Patient.DoesNotExist:
             return Response({'error': 'Patient not found'}, status=status.HTTP_404_NOT_FOUND)
 
+class PatientGrowthView(APIView):
+    """WHO z-scores and percentiles for every visit of a patient, as parallel arrays."""
+    def get(self, request):
+        patient_id = request.query_params.get('id')
+        if not patient_id:
+             return Response({'error': 'Patient ID required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            payload = patient_growth(patient_id)
+        except ValidationError:
+            payload = None
+        if payload is None:
+            return Response({'error': 'Patient not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(payload)
+
+class PatientVitalsView(APIView):
+    """
+    A patient's vitals as parallel arrays for charting. `max_points`
+    downsamples long histories evenly over time.
+    """
+    def get(self, request):
+        patient_id = request.query_params.get('id')
+        if not patient_id:
+             return Response({'error': 'Patient ID required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            max_points = int(request.query_params.get('max_points', 0)) or None
+        except ValueError:
+            return Response({'error': 'Invalid max_points'}, status=status.HTTP_400_BAD_REQUEST)
+        if max_points is not None and max_points < 2:
+            return Response({'error': 'max_points must be at least 2'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            version = Patient.objects.filter(pk=patient_id).values_list('record_version', flat=True).first()
+        except ValidationError:
+            version = None
+        if version is None:
+            return Response({'error': 'Patient not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        return conditional_get(
+            request,
+            lambda: vitals_columns(patient_id, max_points),
+            etag=f"vitals-{patient_id}-{version}-{max_points or 'all'}"
+        )
+
+class GrowthBatchView(APIView):
+    """Growth payloads for up to MAX_PATIENTS patients, keyed by patient id."""
+    permission_classes = [IsAdminUser]
+    MAX_PATIENTS = 500
+
+    def post(self, request):
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not ids:
+            return Response({'error': 'ids must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.MAX_PATIENTS:
+            return Response({'error': f'At most {self.MAX_PATIENTS} ids per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            payloads = patients_growth(ids)
+        except ValidationError:
+            return Response({'error': 'Invalid patient id'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({str(pk): payload for pk, payload in payloads.items()})
+
+class GrowthFlagListView(APIView):
+    """Latest screen_growth flags, newest first, optionally of one `kind`."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        flags = GrowthFlag.objects.select_related('patient').order_by('-detected_on', 'patient_id')
+        kind = request.query_params.get('kind')
+        if kind:
+            if kind not in dict(GrowthFlag.KIND_CHOICES):
+                return Response({'error': 'Unknown flag kind'}, status=status.HTTP_400_BAD_REQUEST)
+            flags = flags.filter(kind=kind)
+        try:
+            limit = min(max(int(request.query_params.get('limit', 100)), 1), 500)
+        except ValueError:
+            return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response([
+            {
+                'patient_id': flag.patient_id,
+                'patient_name': flag.patient.name,
+                'kind': flag.kind,
+                'description': flag.get_kind_display(),
+                'z_score': flag.z_score,
+                'reference_z': flag.reference_z,
+                'detected_on': flag.detected_on,
+                'visit_id': flag.visit_id,
+            }
+            for flag in flags[:limit]
+        ])
+
 class VisitCreateView(APIView):
     def post(self, request):
         serializer = VisitSerializer(data=request.data)
@@ -118,6 +300,7 @@ class VisitCreateView(APIView):
                     
                     if attachments.exists():
                         updated = attachments.update(visit=visit)
+                        bump_patient_version(pk=visit.patient_id)
                 except Exception as e:
                     print(f"Error linking session attachments: {e}")
 
@@ -158,126 +341,176 @@ class VisitDeleteView(APIView):
 
 class DashboardView(APIView):
     def post(self, request):
-        total_patients = Patient.objects.count()
-        total_visits = Visit.objects.count()
-        avg_visit_age = Visit.objects.aggregate(Avg('age'))['age__avg'] or 0
-        
+        return Response(get_dashboard_totals())
+
+class DashboardTrendsView(APIView):
+    def get(self, request):
+        try:
+            days = min(max(int(request.query_params.get('days', 30)), 1), 366)
+        except ValueError:
+            return Response({'error': 'Invalid days'}, status=status.HTTP_400_BAD_REQUEST)
+
+        end = date.today()
+        start = end - timedelta(days=days - 1)
+        dates, series = get_daily_series(
+            [DAILY_VISITS, DAILY_NEW_PATIENTS, DAILY_VISITS_BY_TYPE], start, end
+        )
         return Response({
-            'total_patients': total_patients,
-            'total_visits': total_visits,
-            'avg_patient_age': round(avg_visit_age, 1)
+            'dates': dates,
+            'visits': series[DAILY_VISITS].get('', [0] * len(dates)),
+            'new_patients': series[DAILY_NEW_PATIENTS].get('', [0] * len(dates)),
+            'visits_by_type': series[DAILY_VISITS_BY_TYPE],
         })
 
-class AIChatView(APIView):
-    def post(self, request):
+class AnalyticsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            end = date.fromisoformat(request.query_params['end']) if 'end' in request.query_params else date.today()
+            start = date.fromisoformat(request.query_params['start']) if 'start' in request.query_params else end - timedelta(days=364)
+            top = min(max(int(request.query_params.get('top', 10)), 1), 100)
+        except ValueError:
+            return Response({'error': 'Invalid date range'}, status=status.HTTP_400_BAD_REQUEST)
+        if start > end or (end - start).days > 366 * 5:
+            return Response({'error': 'Invalid date range'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'start': start,
+            'end': end,
+            'visit_volume_by_week': visit_volume_by_week(start, end),
+            'top_diagnoses': top_diagnoses(start, end, limit=top),
+            'vaccination_coverage': vaccination_coverage(start, end),
+            'sick_visits': sick_visit_ratio(start, end),
+        })
+
+class SearchView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Search query required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        types = request.query_params.get('type')
+        types = [t for t in types.split(',') if t in SEARCH_TYPES] if types else SEARCH_TYPES
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'query': query, 'results': search_records(query, types=types, limit=limit)})
+
+class VaccinationWorklistView(APIView):
+    """
+    Clinic-wide vaccines-due worklist. `window=week` lists pending vaccines
+    due in the next 7 days, `window=overdue` pending or missed vaccines more
+    than `days` (30) days past due. Keyset-paginated: follow `next` until it is null.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        window = request.query_params.get('window', 'week')
+        try:
+            days = int(request.query_params.get('days', 30))
+            limit = min(max(int(request.query_params.get('limit', 100)), 1), 500)
+        except ValueError:
+            return Response({'error': 'Invalid days or limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        today = date.today()
+        if window == 'week':
+            start, end, statuses = today, today + timedelta(days=6), ['Pending']
+        elif window == 'overdue':
+            start, end, statuses = date.min, today - timedelta(days=days + 1), Vaccination.OVERDUE_STATUSES
+        else:
+            return Response({'error': 'window must be week or overdue'}, status=status.HTTP_400_BAD_REQUEST)
+
+        after = None
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            position = decode_cursor(cursor)
+            try:
+                after = (date.fromisoformat(position['due_date']), position['patient_id'])
+            except (TypeError, KeyError, ValueError):
+                return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+        groups, next_position = due_worklist(start, end, after=after, limit=limit, statuses=statuses)
+        next_url = None
+        if next_position:
+            due_date, patient_id = next_position
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor',
+                encode_cursor({'due_date': due_date.isoformat(), 'patient_id': str(patient_id)})
+            )
+        return Response({'window': window, 'next': next_url, 'results': groups})
+
+class AIChatView(AsyncAPIView):
+    async def post(self, request):
         if not API_KEY:
              return Response({'error': 'Gemini API Key not configured'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        history = request.data.get('history', [])
-        current_message = request.data.get('message', '')
-        if not current_message:
+        if not request.data.get('message', ''):
             return Response({'error': 'Message content is required'}, status=status.HTTP_400_BAD_REQUEST)
         
+        turn = ChatTurn(request.data)
         try:
-            patient_id = request.data.get('patientId')
-            patient_stats = request.data.get('patientStats', {})
-            mode = request.data.get('mode', 'patient')
-            attachment_id = request.data.get('attachmentId')
-            model_name = request.data.get('modelName', 'gemini-2.5-flash-lite')
-            
-            system_prompt_content = get_pediatric_system_prompt(
-                patient_id=patient_id,
-                patient_stats=patient_stats,
-                mode=mode,
-                history=history,
-                attachment_id=attachment_id
-            )
+            await turn.prepare()
 
-            structured_findings = None
-            if attachment_id:
-                try:
-                    attachment = Attachment.objects.get(id=attachment_id)
-                    structured_findings = analyze_scan_helper(attachment)
-                except Exception:
-                    pass
-
-            messages = [
-                SystemMessage(content=system_prompt_content)
-            ]
-            
-            for msg in history:
-                if msg.get('role') == 'user':
-                    messages.append(HumanMessage(content=msg.get('text', '')))
-                elif msg.get('role') == 'ai':
-                    messages.append(AIMessage(content=msg.get('text', '')))
-            
-            
-            messages.append(HumanMessage(content=current_message))
-            
-            if patient_id:
-                try:
-                    patient_obj = Patient.objects.get(pk=patient_id)
-                    
-                    
-                    session_id = request.data.get('sessionId')
-                    if session_id:
-                        try:
-                            session = ChatSession.objects.get(pk=session_id)
-                        except ChatSession.DoesNotExist:
-                             session = ChatSession.objects.create(patient=patient_obj)
-                    else:
-                        session = ChatSession.objects.filter(patient=patient_obj).order_by('-updated_at').first()
-                        if not session:
-                             session = ChatSession.objects.create(patient=patient_obj)
-
-                    ChatMessage.objects.create(
-                        session=session,
-                        sender='user',
-                        text=current_message,
-                        attachment=Attachment.objects.get(id=attachment_id) if attachment_id else None
-                    )
-                except Patient.DoesNotExist:
-                    patient_obj = None
-                    session = None
-
-            response = get_ai_response(messages, model=model_name)
-            content = response.content
-            
-            if isinstance(content, str) and content.strip().startswith('['):
-                try:
-                    parsed_content = json.loads(content)
-                    if isinstance(parsed_content, list):
-                        content = parsed_content
-                except json.JSONDecodeError:
-                    pass
-
-            if isinstance(content, list):
-                text_blocks = [block.get('text', '') for block in content if isinstance(block, dict) and block.get('type') == 'text']
-                content = "\n".join(text_blocks) if text_blocks else " ".join([str(c) for c in content])
-            elif hasattr(content, 'text'):
-                content = content.text
-            elif not isinstance(content, str):
-                content = str(content)
+            if request.data.get('stream'):
+                response = StreamingHttpResponse(self.event_stream(turn), content_type='text/event-stream')
+                response['Cache-Control'] = 'no-cache'
+                response['X-Accel-Buffering'] = 'no'
+                response['Server-Timing'] = turn.server_timing()
+                return response
 
-            if session:
-                ChatMessage.objects.create(
-                    session=session,
-                    sender='ai',
-                    text=response.content
-                )
+            with turn.stage('llm'):
+                response = await aget_ai_response(turn.messages, model=turn.model_name)
+            content = message_text(response.content)
+
+            with turn.stage('save'):
+                await turn.save_message('ai', response.content)
             
-            return Response({
+            response = Response({
                 'text': content, 
-                'sessionId': session.id if session else None,
-                'structured_findings': structured_findings
+                'sessionId': turn.session.id if turn.session else None,
+                'structured_findings': turn.structured_findings
             })
+            response['Server-Timing'] = turn.server_timing()
+            return response
             
         except Exception as e:
             print(f"LangChain Error: {e}")
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class AISummarizeView(APIView):
-    def post(self, request):
+    async def event_stream(self, turn):
+        """
+        Server-sent events for a streamed reply: a `token` event per text
+        piece as it arrives, then `done` with the full text, sessionId and
+        structured_findings once the reply is saved (or `error`). Served
+        incrementally under ASGI; WSGI servers buffer async streams.
+        """
+        def event(name, data):
+            return f"event: {name}\ndata: {json.dumps(data, default=str)}\n\n"
+
+        pieces = []
+        try:
+            async for text in astream_ai_response(turn.messages, model=turn.model_name):
+                pieces.append(text)
+                yield event('token', {'text': text})
+
+            content = "".join(pieces)
+            await turn.save_message('ai', content)
+            yield event('done', {
+                'text': content,
+                'sessionId': turn.session.id if turn.session else None,
+                'structured_findings': turn.structured_findings
+            })
+        except Exception as e:
+            print(f"LangChain Stream Error: {e}")
+            yield event('error', {'error': str(e)})
+
+class AISummarizeView(AsyncAPIView):
+    async def post(self, request):
         if not API_KEY:
              return Response({'error': 'Gemini API Key not configured'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -289,31 +522,19 @@ class AISummarizeView(APIView):
         session = None
         if session_id:
             try:
-                session = ChatSession.objects.get(pk=session_id)
-
-                current_msg_count = len(history) 
-                
-                if session.summary and session.cached_message_count == current_msg_count:
-                    return Response({'summary': session.summary})
+                session = await ChatSession.objects.aget(pk=session_id)
             except ChatSession.DoesNotExist:
                 pass
         
-        pending_vaccines = []
-        if patient_id:
-            pending_vaccines = list(Vaccination.objects.filter(
-                patient_id=patient_id, 
-                status='Pending', 
-                due_date__lte=date.today()
-            ).values_list('vaccine_name', flat=True))
-        
         try:
-            cleaned_result = generate_chat_summary(history, patient_id, session, model=model_name)
-            
+            # Saved sessions are summarized from their stored messages; the
+            # background update after each reply usually leaves nothing to do.
             if session:
-                session.summary = cleaned_result
-                session.cached_message_count = len(history)
-                session.save()
-            
+                summary = await asummarize_session(session, model=model_name)
+                if summary:
+                    return Response({'summary': summary})
+
+            cleaned_result = await agenerate_chat_summary(history, patient_id, model=model_name)
             return Response({'summary': cleaned_result})
             
         except Exception as e:
@@ -321,18 +542,18 @@ class AISummarizeView(APIView):
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class ScanAnalysisView(APIView):
-    def post(self, request):
+class ScanAnalysisView(AsyncAPIView):
+    async def post(self, request):
         if not API_KEY:
             return Response({'error': 'Gemini API Key not configured'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             
-        attachment_id = request.data.get('attachmentId')
+        attachment_id = request.data.get('attachment_id') or request.data.get('attachmentId')
         if not attachment_id:
             return Response({'error': 'Attachment ID required'}, status=status.HTTP_400_BAD_REQUEST)
             
         try:
-            attachment = Attachment.objects.get(id=attachment_id)
-            analysis = analyze_scan_helper(attachment)
+            attachment = await Attachment.objects.aget(id=attachment_id)
+            analysis = await aanalyze_scan_helper(attachment)
             if analysis:
                 return Response(analysis)
             return Response({'error': 'Failed to analyze scan'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -361,22 +582,63 @@ class ScanResultUpdateView(APIView):
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             
 class ChatSessionListView(APIView):
+    def get(self, request):
+        patient_id = request.query_params.get('patientId')
+        if not patient_id:
+            return Response({'error': 'Patient ID required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Sessions are touched whenever a message is added (see signals.py),
+        # so the newest updated_at plus the count identifies the list.
+        try:
+            state = ChatSession.objects.filter(patient_id=patient_id).aggregate(last=Max('updated_at'), count=Count('id'))
+        except (ValidationError, ValueError):
+            return Response({'error': 'Invalid Patient ID'}, status=status.HTTP_400_BAD_REQUEST)
+        last = state['last']
+        return conditional_get(
+            request,
+            lambda: self.list_sessions(patient_id),
+            etag=f"sessions-{patient_id}-{state['count']}-{last.timestamp() if last else 0}",
+            last_modified=last
+        )
+
     def post(self, request):
         patient_id = request.data.get('patientId')
         if not patient_id:
             return Response({'error': 'Patient ID required'}, status=status.HTTP_400_BAD_REQUEST)
         
+        return Response(self.list_sessions(patient_id))
+
+    def list_sessions(self, patient_id):
         sessions = ChatSession.objects.filter(patient_id=patient_id).annotate(msg_count=Count('messages')).filter(msg_count__gt=0).order_by('-updated_at')
-        data = [{'id': str(s.id), 'name': s.name, 'updated_at': s.updated_at} for s in sessions]
-        return Response(data)
+        return [{'id': str(s.id), 'name': s.name, 'updated_at': s.updated_at} for s in sessions]
 
 class ChatSessionMessagesView(APIView):
+    def get(self, request):
+        session_id = request.query_params.get('sessionId')
+        if not session_id:
+            return Response({'error': 'Session ID required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            session = ChatSession.objects.get(pk=session_id)
+        except (ChatSession.DoesNotExist, ValidationError, ValueError):
+            return Response({'error': 'Session not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        return conditional_get(
+            request,
+            lambda: self.list_messages(session_id),
+            etag=f"messages-{session.pk}-{session.updated_at.timestamp()}",
+            last_modified=session.updated_at
+        )
+
     def post(self, request):
         session_id = request.data.get('sessionId')
         if not session_id:
             return Response({'error': 'Session ID required'}, status=status.HTTP_400_BAD_REQUEST)
-            
-        messages = ChatMessage.objects.filter(session_id=session_id).order_by('timestamp').select_related('attachment')
+
+        return Response(self.list_messages(session_id))
+
+    def list_messages(self, session_id):
+        messages = ChatMessage.objects.filter(session_id=session_id).order_by('timestamp').select_related('attachment__scan_analysis')
         data = []
         for m in messages:
             msg_data = {
@@ -396,7 +658,7 @@ class ChatSessionMessagesView(APIView):
                      }
             
             data.append(msg_data)
-        return Response(data)
+        return data
 
 class ChatSessionCreateView(APIView):
     def post(self, request):
@@ -465,24 +727,3 @@ class AttachmentCreateView(APIView):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-
-class ScanAnalysisView(APIView):
-    def post(self, request):
-        try:
-            attachment_id = request.data.get('attachment_id')
-            if not attachment_id:
-                return Response({'error': 'Attachment ID required'}, status=400)
-            
-            try:
-                attachment = Attachment.objects.get(id=attachment_id)
-            except Attachment.DoesNotExist:
-                 return Response({'error': 'Attachment not found'}, status=404)
-
-            data = analyze_scan_helper(attachment)
-            if not data:
-                 return Response({'error': 'Analysis failed'}, status=500)
-            
-            return Response(data)
-
-        except Exception as e:
-            return Response({'error': str(e)}, status=500)
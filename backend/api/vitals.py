@@ -0,0 +1,40 @@
+from .models import Visit
+
+# Columnar vitals for charts: parallel arrays read straight from
+# values_list, without instantiating Visit models or running serializers.
+
+VITAL_FIELDS = ['date', 'age', 'visit_type', 'height', 'weight', 'head_circumference', 'temperature', 'heart_rate']
+
+
+def downsample_indices(days, max_points):
+    """
+    Indices of at most `max_points` rows spread evenly over time: the span
+    is cut into equal buckets and the latest row of each bucket is kept,
+    along with the first row.
+    """
+    if len(days) <= max_points:
+        return list(range(len(days)))
+    first, span = days[0], (days[-1] - days[0]) or 1
+    buckets = max_points - 1
+    kept = {}
+    for i, day in enumerate(days[1:], start=1):
+        kept[min(int((day - first) * buckets / span), buckets - 1)] = i
+    return [0] + sorted(kept.values())
+
+
+def vitals_columns(patient_id, max_points=None):
+    """
+    {'count', 'dates', 'age', 'height', ...} for a patient's visits in date
+    order, downsampled to `max_points` rows when given.
+    """
+    rows = list(Visit.objects.filter(patient_id=patient_id).order_by('date', 'id').values_list(*VITAL_FIELDS))
+    total = len(rows)
+    if max_points and total > max_points:
+        ordinals = [row[0].toordinal() for row in rows]
+        rows = [rows[i] for i in downsample_indices(ordinals, max_points)]
+
+    columns = list(zip(*rows)) if rows else [()] * len(VITAL_FIELDS)
+    data = {'count': total, 'returned': len(rows)}
+    for field, values in zip(VITAL_FIELDS, columns):
+        data['dates' if field == 'date' else field] = list(values)
+    return data
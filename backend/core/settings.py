@@ -112,6 +112,56 @@ else:
     }
 
 
+# Cache
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared
+# backend (e.g. django.core.cache.backends.redis.RedisCache) in production.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'pediacare'),
+    },
+    # Exact-match Gemini responses for summaries and scan analyses (see
+    # api/llm.py). Kept per process, expiring, and culled past MAX_ENTRIES.
+    'llm': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pediacare-llm',
+        'TIMEOUT': int(os.environ.get('LLM_CACHE_TIMEOUT', 60 * 60 * 24)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 1000)),
+        },
+    },
+}
+
+
+# Vaccinations
+# Pending vaccines this many days past due are moved to Missed by the
+# rollover_vaccinations command.
+
+VACCINATION_MISSED_GRACE_DAYS = int(os.environ.get('VACCINATION_MISSED_GRACE_DAYS', 30))
+
+# 'dense' stores every scheduled vaccine per patient. 'sparse' stores only
+# given, ad-hoc and edited rows and derives the rest from the schedule on
+# read; run compact_vaccinations after switching to drop the stored copies,
+# or populate_vaccinations after switching back.
+VACCINATION_STORAGE = os.environ.get('VACCINATION_STORAGE', 'dense')
+
+
+# AI chat context
+# Each turn replays at most this many of the session's latest stored
+# messages, and no more than fits the token budget (estimated at about
+# four characters per token). Older messages are folded into a summary
+# of their own in the background.
+
+CHAT_HISTORY_MAX_MESSAGES = int(os.environ.get('CHAT_HISTORY_MAX_MESSAGES', 20))
+CHAT_HISTORY_TOKEN_BUDGET = int(os.environ.get('CHAT_HISTORY_TOKEN_BUDGET', 3000))
+
+# Each AI reply schedules a background update of the session summary, which
+# runs once the session has been quiet for this many seconds. 0 turns it off.
+
+CHAT_SUMMARY_DEBOUNCE_SECONDS = float(os.environ.get('CHAT_SUMMARY_DEBOUNCE_SECONDS', 10))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
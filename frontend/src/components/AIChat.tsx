@@ -378,10 +378,14 @@ export default function AIChat({ patientName, patientId, patientStats, onTransfe
                 }
             }
 
-            // 3. Send to Chat
-            const history = messages.map(m => ({ role: m.sender, text: m.text }));
-
-            const response = await AIService.chat({
+            // 3. Send to Chat. Saved sessions are replayed by the server from
+            // stored messages, so the history is only sent for unsaved chats.
+            const history = patientId ? undefined : messages.map(m => ({ role: m.sender, text: m.text }));
+
+            // Show the reply as it streams in, then swap in the final text
+            const aiMsgId = (Date.now() + 1).toString();
+            let streamed = '';
+            const result = await AIService.chatStream({
                 message: userMsg.text || (fileToUpload ? `[Uploaded Image: ${fileToUpload.name}]` : ""),
                 history: history,
                 patientStats: patientStats,
@@ -390,10 +394,19 @@ export default function AIChat({ patientName, patientId, patientStats, onTransfe
                 mode: isDoctorMode ? 'doctor' : 'patient',
                 attachmentId: attachmentId,
                 modelName: selectedModel
+            }, (text) => {
+                const first = !streamed;
+                streamed += text;
+                const partial = streamed.replace("[TRIAGE_COMPLETE]", "");
+                if (first) setIsTyping(false);
+                setMessages(prev => first
+                    ? [...prev, { id: aiMsgId, sender: 'ai', text: partial }]
+                    : prev.map(m => m.id === aiMsgId ? { ...m, text: partial } : m)
+                );
             });
 
-            let reply = response.data.text;
-            const structured = response.data.structured_data;
+            let reply = result.text;
+            const structured = result.structured_data;
 
             let triageComplete = false;
             if (reply.includes("[TRIAGE_COMPLETE]")) {
@@ -402,14 +415,14 @@ export default function AIChat({ patientName, patientId, patientStats, onTransfe
             }
 
             const aiMsg: Message = {
-                id: (Date.now() + 1).toString(),
+                id: aiMsgId,
                 sender: 'ai',
                 text: reply,
                 structuredData: structured
             };
 
             setMessages(prev => {
-                const newMessages = [...prev, aiMsg];
+                const newMessages = [...prev.filter(m => m.id !== aiMsgId), aiMsg];
                 if (triageComplete) {
                     setIsChatEnded(true);
                     setTimeout(() => handleGenerateReport(newMessages), 100);
@@ -3,7 +3,7 @@ import React, { useMemo } from 'react';
 import {
     ComposedChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer, Brush
 } from 'recharts';
-import { Visit } from '@/lib/types';
+import { PatientService } from '@/lib/api';
 import { BOYS_WEIGHT_AGE_Z, GIRLS_WEIGHT_AGE_Z, BOYS_HEIGHT_AGE_Z, GIRLS_HEIGHT_AGE_Z, BOYS_HEAD_CIRCUMFERENCE_AGE_Z, GIRLS_HEAD_CIRCUMFERENCE_AGE_Z } from '@/lib/growthStandards';
 import { Card } from "@/components/ui/card"
 import { Button } from "@/components/ui/button"
@@ -11,10 +11,33 @@ import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from "@
 import { cn } from "@/lib/utils"
 
 interface ChartViewerProps {
-    visits: Visit[];
+    patientId: string;
     gender: 'Male' | 'Female';
+    // Vitals are refetched whenever this changes (e.g. the patient's visits)
+    refreshKey?: unknown;
 }
 
+// Long histories are downsampled by the server to about one point per pixel column
+const MAX_CHART_POINTS = 200;
+
+interface ChartPoint {
+    age: number;
+    visit_type: string;
+    weight: number | null;
+    height: number | null;
+    head_circumference: number | null;
+}
+
+// The vitals endpoint returns parallel arrays; the chart wants one object per visit
+const toChartPoints = (data: any): ChartPoint[] =>
+    (data.dates || []).map((_: string, i: number) => ({
+        age: data.age[i],
+        visit_type: data.visit_type[i],
+        weight: data.weight[i],
+        height: data.height[i],
+        head_circumference: data.head_circumference[i],
+    }));
+
 const CustomTooltip = ({ active, payload, label, ageUnit }: any) => {
     if (active && payload && payload.length) {
         // Separate Patient data from Standards
@@ -64,10 +87,20 @@ const CustomTooltip = ({ active, payload, label, ageUnit }: any) => {
     return null;
 };
 
-export default function ChartViewer({ visits, gender }: ChartViewerProps) {
+export default function ChartViewer({ patientId, gender, refreshKey }: ChartViewerProps) {
+    const [visits, setVisits] = React.useState<ChartPoint[]>([]);
     const [metric, setMetric] = React.useState<'weight' | 'height' | 'head_circumference'>('weight');
     const [ageUnit, setAgeUnit] = React.useState<'yr' | 'mo' | 'dy'>('yr');
     const [isFullRange, setIsFullRange] = React.useState(false);
+
+    React.useEffect(() => {
+        let cancelled = false;
+        PatientService.vitals(patientId, MAX_CHART_POINTS)
+            .then(res => { if (!cancelled) setVisits(toChartPoints(res.data)); })
+            .catch(err => console.error("Failed to load vitals", err));
+        return () => { cancelled = true; };
+    }, [patientId, refreshKey]);
+
     // Auto-scale age unit based on data
     React.useEffect(() => {
         if (!visits || visits.length === 0) return;
@@ -146,13 +179,13 @@ export default function ChartViewer({ visits, gender }: ChartViewerProps) {
         else if (metric === 'head_circumference') standards = (gender === 'Male' ? BOYS_HEAD_CIRCUMFERENCE_AGE_Z : GIRLS_HEAD_CIRCUMFERENCE_AGE_Z);
 
         const valueKey = metric === 'weight' ? 'patientWeight' : (metric === 'height' ? 'patientHeight' : 'patientHC');
-        const visitKey = metric === 'weight' ? 'weight' : (metric === 'height' ? 'height' : 'head_circumference');
+        const visitKey: keyof ChartPoint = metric === 'weight' ? 'weight' : (metric === 'height' ? 'height' : 'head_circumference');
 
         const patientPoints = visits
             .filter(v => v.visit_type !== 'Initial')
             .map(v => ({
                 age: v.age,
-                [valueKey]: (v as any)[visitKey] // Cast to any to access dynamic key
+                [valueKey]: v[visitKey]
             }));
 
         // Dynamically Filter Standards to "Zoom"
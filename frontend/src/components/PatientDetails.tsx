@@ -215,7 +215,7 @@ export default function PatientDetails({ patient, onBack, onAddVisit, onEditVisi
 
                             <TabsContent value="charts" className="h-full m-0 overflow-y-auto">
                                 <Card className="p-4 h-full">
-                                    <ChartViewer visits={visits} gender={patient.gender} />
+                                    <ChartViewer patientId={String(patient.id)} gender={patient.gender} refreshKey={patient.visits} />
                                 </Card>
                             </TabsContent>
 
@@ -31,8 +31,13 @@ export const AuthService = {
 
 export const PatientService = {
     list: () => api.get('patients/list/'),
+    listCompact: (params: { cursor?: string, limit?: number } = {}) =>
+        api.get('patients/list/', { params: { mode: 'compact', ...params } }),
     create: (data: any) => api.post('patients/create/', data),
-    detail: (id: string) => api.post('patients/detail/', { id }),
+    detail: (id: string) => api.get('patients/detail/', { params: { id } }),
+    growth: (id: string) => api.get('patients/growth/', { params: { id } }),
+    vitals: (id: string, maxPoints?: number) =>
+        api.get('patients/vitals/', { params: { id, max_points: maxPoints } }),
 };
 
 export const VisitService = {
@@ -43,10 +48,47 @@ export const VisitService = {
 
 export const AIService = {
     chat: (data: any) => api.post('ai/chat/', data),
+    // Streams the reply as server-sent events (axios can't read a response
+    // body incrementally in the browser, so this uses fetch). Calls onToken
+    // for each text piece and resolves with the final `done` payload.
+    chatStream: async (data: any, onToken: (text: string) => void) => {
+        const token = localStorage.getItem('token');
+        const response = await fetch(`${api.defaults.baseURL}ai/chat/`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                ...(token ? { Authorization: `Token ${token}` } : {}),
+            },
+            body: JSON.stringify({ ...data, stream: true }),
+        });
+        if (!response.ok || !response.body) {
+            throw new Error(`Chat request failed with status ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                const event = block.match(/^event: (.*)$/m)?.[1];
+                const payload = JSON.parse(block.match(/^data: (.*)$/m)?.[1] || '{}');
+                if (event === 'token') onToken(payload.text);
+                else if (event === 'done') return payload;
+                else if (event === 'error') throw new Error(payload.error);
+            }
+        }
+        throw new Error('Chat stream ended unexpectedly');
+    },
     summarize: (data: any) => api.post('ai/summarize/', data),
-    listSessions: (data: any) => api.post('ai/sessions/list/', data),
+    listSessions: (data: any) => api.get('ai/sessions/list/', { params: data }),
     createSession: (data: any) => api.post('ai/sessions/create/', data),
-    getSessionMessages: (data: any) => api.post('ai/sessions/messages/', data),
+    getSessionMessages: (data: any) => api.get('ai/sessions/messages/', { params: data }),
     deleteSession: (data: any) => api.post('ai/sessions/delete/', data),
     scanAnalysis: (data: any) => api.post('ai/scan-analysis/', data),
     updateScanResult: (data: { id: string, modality?: string, findings?: string, impression?: string }) =>